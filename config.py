@@ -13,3 +13,19 @@ except ImportError:
 
 API_KEY = os.getenv("PIPELINES_API_KEY", "0p3n-w3bu!")
 PIPELINES_DIR = os.getenv("PIPELINES_DIR", "./pipelines")
+# Seconds between checks of PIPELINES_DIR for changed pipelines, 0 to only reload on request
+PIPELINES_WATCH_INTERVAL = float(os.getenv("PIPELINES_WATCH_INTERVAL", "2"))
+# Pipelines imported at the same time at startup
+PIPELINES_LOAD_CONCURRENCY = int(os.getenv("PIPELINES_LOAD_CONCURRENCY", "4"))
+# List pipelines from their frontmatter at startup and load each on its first request.
+# Filters and manifolds are always loaded, since their valves and models are needed up front.
+PIPELINES_LAZY = os.getenv("PIPELINES_LAZY", "false").lower() == "true"
+# Install each pipeline's frontmatter requirements into its own directory instead of the
+# server's environment
+PIPELINES_REQUIREMENTS_ISOLATED = (
+    os.getenv("PIPELINES_REQUIREMENTS_ISOLATED", "false").lower() == "true"
+)
+# Seconds a replaced pipeline may finish its running requests before it is shut down
+PIPELINES_DRAIN_TIMEOUT = float(os.getenv("PIPELINES_DRAIN_TIMEOUT", "600"))
+# Worker processes started by `python main.py`, forked after the pipelines are loaded
+PIPELINES_WORKERS = int(os.getenv("PIPELINES_WORKERS", "1"))
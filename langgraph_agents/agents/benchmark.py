@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+sys.path.insert(0, os.path.abspath("."))
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from langgraph_agents.agents.data_analyst import (
+    DEFAULT_MODEL_NAME,
+    create_agent_builder,
+    get_llm,
+)
+from langgraph_agents.agents.plan_and_execute import create_plan_and_execute_builder
+
+
+# Questions about the schema generated by `python -m utils.agents.fixtures`
+DEFAULT_QUESTIONS = [
+    "What is the total investment amount per sector? Show the top 5.",
+    "Which 5 companies have the most completed transactions, and in which region are they?",
+    "Plot the monthly total of revenues in 2020 for the Technology sector.",
+    "Compare the average order amount of each region between 2018 and 2019.",
+]
+
+MODES = {
+    "react": create_agent_builder,
+    "plan": create_plan_and_execute_builder,
+}
+
+
+class CallCounter(BaseCallbackHandler):
+    """
+    Counts the LLM and tool calls of a run and records when the first token arrived.
+    """
+
+    def __init__(self):
+        self.llm_calls = 0
+        self.tool_calls = 0
+        self.tool_errors = 0
+        self.first_token_at = None
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.llm_calls += 1
+
+    def on_llm_new_token(self, token, **kwargs):
+        if self.first_token_at is None and token:
+            self.first_token_at = time.perf_counter()
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self.tool_calls += 1
+
+    def on_tool_error(self, error, **kwargs):
+        self.tool_errors += 1
+
+
+async def run_question(graph, question: str) -> dict:
+    counter = CallCounter()
+    start = time.perf_counter()
+    error = None
+    answer = ""
+    try:
+        # Streamed like the pipelines, so the model streams tokens and the TTFT is comparable
+        async for mode, chunk in graph.astream(
+            {"messages": [("user", question)]},
+            {"callbacks": [counter], "recursion_limit": 50},
+            stream_mode=["messages", "values"],
+        ):
+            if mode == "values":
+                answer = chunk["messages"][-1].content
+    except Exception as e:
+        error = str(e)
+    end = time.perf_counter()
+    return {
+        "question": question,
+        "llm_calls": counter.llm_calls,
+        "tool_calls": counter.tool_calls,
+        "tool_errors": counter.tool_errors,
+        "latency": round(end - start, 3),
+        "ttft": round(counter.first_token_at - start, 3) if counter.first_token_at else None,
+        "answer_chars": len(answer),
+        "error": error,
+    }
+
+
+async def compare(
+    questions: List[str] = DEFAULT_QUESTIONS,
+    modes: Optional[List[str]] = None,
+    model_name: str = DEFAULT_MODEL_NAME,
+    runs: int = 1,
+) -> Dict[str, List[dict]]:
+    """
+    Runs every question through each agent mode and records LLM calls, tool calls and latency.
+
+    The modes run one question at a time, alternating, so both see the same model server state.
+    All modes use the same LLM response cache and turn budget.
+    """
+    modes = list(MODES) if modes is None else list(modes)
+    graphs = {mode: MODES[mode](llm=get_llm(model_name)).compile() for mode in modes}
+    results = {mode: [] for mode in modes}
+    for run in range(runs):
+        for question in questions:
+            for mode, graph in graphs.items():
+                result = await run_question(graph, question)
+                result["run"] = run
+                results[mode].append(result)
+                print(f"{mode}: {result}")
+    return results
+
+
+def summarize(results: Dict[str, List[dict]]) -> Dict[str, dict]:
+    summary = {}
+    for mode, rows in results.items():
+        ok = [r for r in rows if r["error"] is None]
+        summary[mode] = {
+            "questions": len(rows),
+            "errors": len(rows) - len(ok),
+            "avg_llm_calls": round(sum(r["llm_calls"] for r in ok) / len(ok), 2) if ok else None,
+            "avg_tool_calls": round(sum(r["tool_calls"] for r in ok) / len(ok), 2) if ok else None,
+            "avg_latency": round(sum(r["latency"] for r in ok) / len(ok), 3) if ok else None,
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare LLM calls and latency of the ReAct and plan-and-execute agents."
+    )
+    parser.add_argument("--questions", help="A text file with one question per line")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--model", default=DEFAULT_MODEL_NAME)
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--output", help="Write the detailed results to this JSON file")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    results = asyncio.run(
+        compare(questions, args.modes.split(","), model_name=args.model, runs=args.runs)
+    )
+    print(json.dumps(summarize(results), indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
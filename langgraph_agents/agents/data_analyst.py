@@ -1,20 +1,30 @@
+import logging
 import os
 import sys
 
 sys.path.insert(0, os.path.abspath("."))
 
 from utils.agents.get_tables_info import get_tables_info
+from utils.agents.database import get_backend
 from utils.agents.main import remove_think_tags
-
-from typing import Annotated, List
+from utils.agents.query import run_query, describe_table
+from utils.agents.context import create_context_node, count_tokens, load_artifact
+from utils.agents.budget import TurnBudget
+from utils.agents.prompt import PromptPrefix, PREFIX_CACHE_MONITOR
+from utils.agents.llm_cache import LLM_CACHE, cached_invoke, acached_invoke
+from utils.agents import analytics
+from utils.tracing import span
+
+from typing import Annotated, List, Optional
 from typing_extensions import TypedDict
 
-from langchain_core.messages import SystemMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain.tools import StructuredTool
 from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.graph import StateGraph
 from langgraph.graph.message import add_messages
 from langchain_ollama import ChatOllama
+from ollama import AsyncClient
 
 from langgraph_agents.tools.local_python_executor import (
     local_python_executor,
@@ -70,96 +80,45 @@ when you wirte code, do not use print function.
 """
 
 
-DEFAULT_POSTGRES_PROMPT = """
-You have access to a PostgreSQL database for data analysis tasks. Follow these guidelines when working with the database:
-
-### Database Connection Process
-1. Load environment variables securely using the dotenv package (for POSTGRES_USER, POSTGRES_PASSWORD, POSTGRES_HOST, POSTGRES_PORT)
-2. Connect using SQLAlchemy's tools, like engine, inspect, text, etc
-3. Never print or expose sensitive credentials in your responses
-
-### Connection Example (following ReAct framework):
-Thought: I need to connect to the PostgreSQL database to query the data.
-Action: [Use python_tool to establish a secure connection]
-```python
-from dotenv import load_dotenv
-import os
-from sqlalchemy import create_engine, inspect
-
-# Load environment variables securely
-load_dotenv()
-
-# Get credentials without printing them
-db_user = os.getenv('POSTGRES_USER')
-db_password = os.getenv('POSTGRES_PASSWORD')
-db_host = os.getenv('POSTGRES_HOST')
-db_port = os.getenv('POSTGRES_PORT')
-db_name = os.getenv('POSTGRES_DB')
+DEFAULT_DATABASE_PROMPT = """
+You have access to a {dialect} database for data analysis tasks. Follow these guidelines when working with the database:
 
-# Create connection string and engine
-connection_string = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-engine = create_engine(connection_string)
-
-# Use inspector to explore schema
-inspector = inspect(engine)
-```
-Observation: Successfully connected to the PostgreSQL database.
-
-### List databases from Postgres server
+### Query Helper
+A `run_query(sql, params=None)` function is already available inside python_tool. It is the only way to query the database:
+do not create SQLAlchemy engines or connections yourself, and do not read database credentials from environment variables.
+It runs a SELECT query written in {dialect} SQL and returns a pandas DataFrame. Results of repeated queries are cached, so re-running a query is cheap.
+{query_limits}
+If a query is rejected, read the error message and rewrite the query (add filters, aggregate in SQL) instead of retrying it unchanged.
+If `df.attrs.get("truncated")` is set, only the first rows were returned (not a random sample), so aggregate in SQL instead of computing totals from them.
 ```python
-from sqlalchemy import create_engine, text
-connection_string = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/postgres"
-engine = create_engine(connection_string)
-query = text("SELECT datname FROM pg_database WHERE datistemplate = false;")
-with engine.connect() as conn:
-    result = conn.execute(query)
-    databases = [row[0] for row in result]
-databases
+df = run_query("SELECT sector, SUM(amount) AS total FROM investments WHERE year = :year GROUP BY sector", {{"year": 2024}})
+df
 ```
 
-### Examples of one way to use inspector (to get tables of a database)
-```python
-from dotenv import load_dotenv
-import os
-from sqlalchemy import create_engine, inspect
-
-# Load environment variables securely
-load_dotenv()
-
-# Get credentials without printing them
-db_user = os.getenv('POSTGRES_USER')
-db_password = os.getenv('POSTGRES_PASSWORD')
-db_host = os.getenv('POSTGRES_HOST', 'localhost')
-db_port = os.getenv('POSTGRES_PORT', '5432')
-db_name = os.getenv("POSTGRES_DB", "postgres")
-
-# Create connection string and engine
-connection_string = f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
-engine = create_engine(connection_string)
-
-# Use inspector to explore schema
-inspector = inspect(engine)
-
-# Get the list of tables in the database
-tables = inspector.get_table_names()
-tables
-```
+The Database Schema Information below already lists approximate row counts, column statistics
+(null fraction, distinct count, most common values) and sample rows for every table.
+Do not run COUNT(*), SELECT DISTINCT or SELECT * LIMIT queries just to explore the data; use that information,
+or call `describe_table(table)` inside python_tool for the latest statistics of a table.
 
 ### Best Practices
-- Always close connections when finished
-- Use parameterized queries to prevent SQL injection
+- Use named parameters (`:name` with `params`) instead of formatting values into the SQL string
 - Handle exceptions gracefully with try/except blocks
 - Use pandas for efficient data manipulation after querying
 
-### Security Notes
-- Never display database credentials in your responses
-- Only read credentials from the .env file, never hardcode them
-
 Do not create queries that modify the database, such as UPDATE, INSERT, or DELETE, except for SELECT queries.
 
 use Database Schema Information suggest to user which table can help user's question if user's question is ambiguous.
 """
 
+DEFAULT_ANALYTICS_PROMPT = """
+### Analytics Engine
+For heavy aggregations (GROUP BY, joins over large tables) use `analytics_query(sql, params=None)` inside python_tool instead of
+loading rows into pandas. It runs DuckDB SQL over local Parquet extracts of the database tables and returns a pyarrow Table;
+call `.to_pandas()` on it if you need a DataFrame. Extracts can be up to a day old: `extract_freshness()` returns the age of each
+extract in seconds. Use `run_query` instead when the user needs up-to-the-minute data.
+Only these tables have extracts: {tables}.
+"""
+
 DEFAULT_AUTHORIZED_IMPORTS = ["sqlalchemy", "dotenv", "os", "sys", "pandas"]
 
 DEFAULT_MODEL_NAME = "qwen3:30b-a3b"
@@ -167,6 +126,12 @@ DEFAULT_MODEL_NAME = "qwen3:30b-a3b"
 
 class AgentState(TypedDict):
     messages: Annotated[List, add_messages]
+    # Hash of the Open WebUI user turns already in the thread, see utils.agents.threads
+    history_digest: str
+    # Running summary of the turns dropped from the message window, see utils.agents.context
+    summary: str
+    # LLM calls, tool calls and prompt tokens used for the current user turn, see utils.agents.budget
+    budget: dict
 
 
 class Valves(BaseModel):
@@ -178,26 +143,91 @@ class Valves(BaseModel):
     AUTHORIZED_IMPORTS: str = Field(
         default=", ".join(DEFAULT_AUTHORIZED_IMPORTS), description="Authorized imports"
     )
+    REASONING_CONTENT: bool = Field(
+        default=False,
+        description="Stream the model's <think> reasoning as reasoning_content instead of dropping it",
+    )
+
+
+def get_llm(model_name: str = DEFAULT_MODEL_NAME):
+    return ChatOllama(model=model_name, keep_alive=-1)
+
+
+async def warm_llm(model_name: str, *args):
+    """
+    Loads a model into Ollama's memory, so the first request to it does not pay the load time.
+
+    An empty generate request only loads the model. Extra arguments (the rest of a registry key)
+    are ignored.
+    """
+    llm = get_llm(model_name)
+    client = AsyncClient(
+        host=llm.base_url, **{**(llm.client_kwargs or {}), **(llm.async_client_kwargs or {})}
+    )
+    await client.generate(model=model_name, keep_alive=llm.keep_alive)
 
 
-def get_llm():
-    return ChatOllama(model=DEFAULT_MODEL_NAME, keep_alive=-1)
+def parse_authorized_imports(authorized_imports: str) -> List[str]:
+    """
+    Parses the comma separated AUTHORIZED_IMPORTS valve.
+    """
+    return sorted({name.strip() for name in authorized_imports.split(",") if name.strip()})
 
 
 # DEFAULT_LLM = get_llm()
 DEFAULT_LLM = get_llm()
 
 
-def create_agent_builder(
-    llm=DEFAULT_LLM,
-    tools: List = [],
-    system_prompt: str = DEFAULT_SYSTEM_PROMPT
-    + DEFAULT_POSTGRES_PROMPT
-    + get_tables_info(),
-    authorized_imports: List[str] = DEFAULT_AUTHORIZED_IMPORTS,
-):
+def get_default_system_prompt():
+    """
+    Builds the default system prompt, including the schema of the configured database backend.
+
+    This is called when a graph is built rather than at import time, so importing this module
+    does not require a reachable database.
+    """
+    return (
+        DEFAULT_SYSTEM_PROMPT
+        + get_database_prompt()
+        + get_analytics_prompt()
+        + get_tables_info()
+    )
+
+
+def get_database_prompt() -> str:
+    """
+    The database instructions, in the SQL dialect and with the query limits of the configured
+    backend.
+    """
+    backend = get_backend()
+    return DEFAULT_DATABASE_PROMPT.format(
+        dialect=backend.dialect, query_limits=backend.query_limits
+    )
+
+
+def get_analytics_prompt() -> str:
+    """
+    The analytics_query instructions, or nothing if no tables are enabled for extracts.
+    """
+    if not analytics.is_enabled():
+        return ""
+    return DEFAULT_ANALYTICS_PROMPT.format(tables=", ".join(analytics.ANALYTICS_TABLES))
+
+
+def create_python_tool(authorized_imports: List[str] = DEFAULT_AUTHORIZED_IMPORTS):
+    """
+    Creates the python_tool, with the query helpers available inside the executed code.
+    """
     authorized_imports = list(set(BASE_BUILTIN_MODULES) | set(authorized_imports))
 
+    custom_tools = {
+        "run_query": run_query,
+        "describe_table": describe_table,
+        "load_artifact": load_artifact,
+    }
+    if analytics.is_enabled():
+        custom_tools["analytics_query"] = analytics.analytics_query
+        custom_tools["extract_freshness"] = analytics.extract_freshness
+
     def _local_python_executor(code: str):
         """Execute Python code safely with restricted imports.
 
@@ -207,38 +237,129 @@ def create_agent_builder(
         Returns:
             The result of the execution.
         """
-        return local_python_executor(code, authorized_imports)
+        with span("evaluate_python_code"):
+            return local_python_executor(code, authorized_imports, custom_tools=custom_tools)
 
-    python_tool = StructuredTool.from_function(
+    return StructuredTool.from_function(
         func=_local_python_executor,
         name="python_tool",
         description="Execute Python code. Inputs: code (str).",
     )
 
+
+def create_agent_builder(
+    llm=DEFAULT_LLM,
+    tools: List = [],
+    system_prompt: Optional[str] = None,
+    authorized_imports: List[str] = DEFAULT_AUTHORIZED_IMPORTS,
+    budget: Optional[TurnBudget] = None,
+):
+    if system_prompt is None:
+        system_prompt = get_default_system_prompt()
+
+    python_tool = create_python_tool(authorized_imports)
+
     DEFAULT_TOOLS = [python_tool]
 
-    tools += DEFAULT_TOOLS
+    # Copy instead of extending the shared default list, so repeated builds do not duplicate tools
+    tools = list(tools) + DEFAULT_TOOLS
     tools_node = ToolNode(tools=tools)
-    llm = llm.bind_tools(tools=tools)
+    context_node = create_context_node(llm, system_prompt=system_prompt)
+
+    # System prompt and tool schemas form a stable prefix, so Ollama can reuse its KV cache
+    prefix = PromptPrefix(system_prompt, tools)
+    llm_string = llm._get_llm_string()
+    # The final answer of a turn whose budget is used up is requested without tools
+    final_llm = llm
+    llm = llm.bind_tools(tools=prefix.tools)
+    budget = budget or TurnBudget()
 
     # Define the nodes
-    def llm_node(state: AgentState) -> AgentState:
+    def cache_keys(payload, config: RunnableConfig):
+        # The response cache is opt-in, and a request can bypass it with `llm_cache: False`
+        if LLM_CACHE is None or not config.get("configurable", {}).get("llm_cache", True):
+            return None
+        return LLM_CACHE.make_keys(llm_string, prefix.version, payload)
+
+    def prepare_call(state: AgentState):
         messages = state["messages"]
-        payload = [SystemMessage(content=system_prompt)] + messages
-        response = llm.invoke(payload)
+        usage = budget.usage(messages, state.get("budget"))
+        payload = prefix.assemble(messages, summary=state.get("summary"))
+        prompt_tokens = count_tokens(payload)
+
+        forced_reason = budget.exhausted(usage, prompt_tokens)
+        if forced_reason is None:
+            return payload, llm, usage, prompt_tokens, None
+
+        logging.info(f"budget:forcing final answer after {forced_reason}")
+        payload = prefix.assemble(
+            messages,
+            summary=state.get("summary"),
+            tail=budget.final_answer_tail(forced_reason),
+        )
+        return payload, final_llm, usage, prompt_tokens, forced_reason
+
+    def finish_response(
+        payload,
+        response,
+        config: RunnableConfig,
+        usage: dict,
+        prompt_tokens: int,
+        forced_reason: Optional[str],
+        cached: bool = False,
+    ) -> AgentState:
         response.content = remove_think_tags(response.content)
-        return {"messages": response}
 
+        # A cached response never reached the model server, there is no prompt cache use to measure
+        if not cached:
+            thread_id = config.get("configurable", {}).get("thread_id", "default")
+            report = PREFIX_CACHE_MONITOR.observe(thread_id, prefix, payload, response)
+            response.response_metadata.update(report)
+        response.response_metadata["llm_cache_hit"] = cached
+
+        usage = budget.limit_tool_calls(usage, response)
+        usage = budget.record(usage, prompt_tokens, response)
+        response.response_metadata["budget"] = budget.report(usage, forced_reason)
+        return {"messages": response, "budget": usage}
+
+    def llm_node(state: AgentState, config: RunnableConfig) -> AgentState:
+        payload, model, usage, prompt_tokens, forced_reason = prepare_call(state)
+        keys = cache_keys(payload, config)
+        if keys is None:
+            response, cached = model.invoke(payload), False
+        else:
+            response, cached = cached_invoke(LLM_CACHE, model, payload, keys)
+        return finish_response(
+            payload, response, config, usage, prompt_tokens, forced_reason, cached
+        )
+
+    async def allm_node(state: AgentState, config: RunnableConfig) -> AgentState:
+        # With `astream`, the model call waits on the event loop instead of holding a thread
+        payload, model, usage, prompt_tokens, forced_reason = prepare_call(state)
+        keys = cache_keys(payload, config)
+        if keys is None:
+            response, cached = await model.ainvoke(payload), False
+        else:
+            response, cached = await acached_invoke(LLM_CACHE, model, payload, keys)
+        return finish_response(
+            payload, response, config, usage, prompt_tokens, forced_reason, cached
+        )
+
+    CONTEXT_NODE = "CONTEXT_NODE"
     LLM_NODE = "LLM_NODE"
     TOOLS_NAME = "tools"
 
     builder = StateGraph(AgentState)
-    builder.add_node(LLM_NODE, llm_node)
+    builder.add_node(CONTEXT_NODE, context_node)
+    builder.add_node(
+        LLM_NODE, RunnableLambda(llm_node, afunc=allm_node, name="llm_node")
+    )
     builder.add_node(TOOLS_NAME, tools_node)
 
+    builder.add_edge(CONTEXT_NODE, LLM_NODE)
     builder.add_conditional_edges(LLM_NODE, tools_condition)
-    builder.add_edge(TOOLS_NAME, LLM_NODE)
-    builder.set_entry_point(LLM_NODE)
+    builder.add_edge(TOOLS_NAME, CONTEXT_NODE)
+    builder.set_entry_point(CONTEXT_NODE)
 
     return builder
 
@@ -0,0 +1,102 @@
+from typing import AsyncGenerator, Callable, List, Union
+
+from langgraph_agents.agents.data_analyst import (
+    get_llm,
+    warm_llm,
+    parse_authorized_imports,
+    Valves,
+)
+
+from utils.agents.query import TABLE_STATS
+from utils.agents.threads import get_async_checkpointer
+from utils.agents.registry import GraphRegistry
+from utils.agents.streaming import astream_graph
+
+
+class AgentPipeline:
+    """
+    Base of the pipelines serving a checkpointed agent graph.
+
+    It keeps one compiled graph per (model, authorized imports) pair, built by `create_builder`
+    with the valves' model and imports, and streams each request through the current one.
+    Subclasses only pass their name, thread namespace and graph builder.
+
+    Valve Parameters:
+    - MODEL_NAME: The Ollama model answering the questions.
+    - AUTHORIZED_IMPORTS: Comma separated modules the Python tool may import.
+    - REASONING_CONTENT: Stream <think> reasoning as reasoning_content instead of dropping it.
+
+    :param name: The pipeline name shown in Open WebUI.
+    :param thread_namespace: Prefix of the pipeline's thread ids, as pipelines share the
+        checkpoint database.
+    :param create_builder: Returns the uncompiled graph for `llm` and `authorized_imports`.
+    """
+
+    class Valves(Valves):
+        pass
+
+    def __init__(self, name: str, thread_namespace: str, create_builder: Callable):
+        self.name = name
+
+        self.valves = self.Valves()
+
+        # Graphs are built in on_startup, where the checkpointer can be opened on the server's
+        # event loop
+        self.checkpointer = None
+        self.registry = GraphRegistry(self.build_graph, warm=warm_llm)
+        self.thread_namespace = thread_namespace
+        self.create_builder = create_builder
+
+    def graph_key(self) -> tuple:
+        return (
+            self.valves.MODEL_NAME,
+            tuple(parse_authorized_imports(self.valves.AUTHORIZED_IMPORTS)),
+        )
+
+    def build_graph(self, model_name: str, authorized_imports: tuple):
+        # Every graph shares the checkpointer, so conversations survive a model switch
+        return self.create_builder(
+            llm=get_llm(model_name), authorized_imports=list(authorized_imports)
+        ).compile(checkpointer=self.checkpointer)
+
+    async def on_startup(self):
+        print(f"on_startup:{self.name}")
+        # Conversations are kept in a checkpointer keyed by the Open WebUI chat id, so each turn
+        # only sends the new user message
+        self.checkpointer = await get_async_checkpointer()
+        # Ollama may still be starting, so a failed pre-warm does not stop the pipeline from loading
+        await self.registry.activate(self.graph_key(), require_warm=False)
+        # The table statistics in the prompt and describe_table are refreshed in the background
+        TABLE_STATS.start()
+
+    async def on_valves_updated(self):
+        print(f"on_valves_updated:{self.name}")
+        # Requests keep the graph they started with, new requests switch once the model is loaded
+        await self.registry.activate(self.graph_key())
+
+    async def on_shutdown(self):
+        print(f"on_shutdown:{self.name}")
+        # Reloads create a new instance, so release this one's checkpoint connection
+        if self.checkpointer is not None:
+            await self.checkpointer.conn.close()
+
+    async def pipe(
+        self, user_message: str, model_id: str, messages: List[dict], body: dict
+    ) -> AsyncGenerator[Union[str, dict], None]:
+        """
+        Streams the graph's response to the request.
+
+        Tokens are streamed as the LLM produces them, tool calls are announced as soon as the model
+        starts them, and tool outputs are forwarded when the tool returns. The graph runs on the
+        event loop, so a conversation waiting on the model does not hold a worker thread.
+        `<think>` reasoning is filtered out of the tokens, or yielded as {"reasoning_content": ...}
+        deltas with the REASONING_CONTENT valve.
+        """
+        async for line in astream_graph(
+            self.registry.current(),
+            messages,
+            body,
+            stream_reasoning=self.valves.REASONING_CONTENT,
+            thread_namespace=self.thread_namespace,
+        ):
+            yield line
@@ -0,0 +1,296 @@
+import logging
+import os
+import re
+import sys
+import uuid
+
+sys.path.insert(0, os.path.abspath("."))
+
+from utils.agents.main import remove_think_tags
+from utils.agents.context import create_context_node, count_tokens
+from utils.agents.budget import TurnBudget
+from utils.agents.prompt import PromptPrefix, PREFIX_CACHE_MONITOR
+from utils.agents.llm_cache import LLM_CACHE, cached_invoke, acached_invoke
+from utils.agents.get_tables_info import get_tables_info
+
+from typing import Annotated, List, Optional
+from typing_extensions import TypedDict
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langgraph.prebuilt import ToolNode
+from langgraph.graph import StateGraph, END
+from langgraph.graph.message import add_messages
+
+from langgraph_agents.agents.data_analyst import (
+    DEFAULT_LLM,
+    DEFAULT_AUTHORIZED_IMPORTS,
+    create_python_tool,
+    get_analytics_prompt,
+    get_database_prompt,
+)
+
+
+DEFAULT_PLAN_SYSTEM_PROMPT = """You are seungmin from south korea, an advanced data analyst assistant with expertise in data analysis, visualization, and problem-solving.
+
+Respond to the user's query in the same language they used.
+
+If English and Korean are mixed, use Korean.
+
+Respond in Korean if there is even one Korean word.
+
+한번 더 강조하지만, 한국어가 한 단어라도 있으면 반드시 한국어로 응답하도록 해.
+
+You work in two steps. First you write ONE complete Python script that does all the work the question needs
+(load the data, filter, aggregate, build charts), which is executed with python_tool in a single run.
+Then you explain its result to the user.
+
+when you wirte code, do not use print function.
+"""
+
+PLAN_INSTRUCTIONS = """Write one complete Python script that answers the latest user message.
+- Put the whole script in a single ```python code block. It runs once, top to bottom.
+- Do every step in this one script: querying, cleaning, aggregating and charting. Do not split the work.
+- Do not use print. End the script with an expression that evaluates to the final result, e.g. a DataFrame or a dict of results.
+- Write at most two sentences before the code block and nothing after it.
+If the message needs no code (greetings, questions about earlier results), answer it directly without a code block."""
+
+REPAIR_INSTRUCTIONS = """The script failed with the error above. Write the corrected, complete script in a single ```python code block.
+Fix the cause of the error and keep everything else. Do not write anything after the code block."""
+
+ANSWER_INSTRUCTIONS = """The script ran and its result is above. Answer the latest user message based on it.
+Present the key numbers and findings clearly. Do not write new code."""
+
+# Repair attempts after a failed script, per user turn
+DEFAULT_MAX_REPAIRS = int(os.getenv("PLAN_MAX_REPAIRS", "2"))
+
+_CODE_BLOCK_PATTERN = re.compile(r"```(?:python|py)?[ \t]*\n(.*?)```", flags=re.DOTALL)
+
+
+class PlanState(TypedDict):
+    messages: Annotated[List, add_messages]
+    # Hash of the Open WebUI user turns already in the thread, see utils.agents.threads
+    history_digest: str
+    # Running summary of the turns dropped from the message window, see utils.agents.context
+    summary: str
+    # LLM calls, tool calls and prompt tokens used for the current user turn, see utils.agents.budget
+    budget: dict
+
+
+def get_plan_system_prompt():
+    return (
+        DEFAULT_PLAN_SYSTEM_PROMPT
+        + get_database_prompt()
+        + get_analytics_prompt()
+        + get_tables_info()
+    )
+
+
+def extract_script(text: str) -> Optional[str]:
+    """
+    Returns the last Python code block of a response, or None if it has none.
+    """
+    blocks = _CODE_BLOCK_PATTERN.findall(text or "")
+    return blocks[-1].strip() if blocks else None
+
+
+def current_turn(messages: List) -> List:
+    """
+    Returns the messages since the latest user message.
+    """
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], HumanMessage):
+            return messages[i + 1 :]
+    return messages
+
+
+def create_plan_and_execute_builder(
+    llm=DEFAULT_LLM,
+    system_prompt: Optional[str] = None,
+    authorized_imports: List[str] = DEFAULT_AUTHORIZED_IMPORTS,
+    max_repairs: int = DEFAULT_MAX_REPAIRS,
+    budget: Optional[TurnBudget] = None,
+):
+    """
+    Builds a plan-then-execute graph, an alternative to the ReAct loop of `create_agent_builder`.
+
+    One planning call writes a single script for the whole question, python_tool runs it once,
+    and one more call explains the result: two LLM calls for a typical question instead of one
+    per step. Only a failed script goes back to the planner, at most `max_repairs` times per turn.
+
+    All calls share the system prompt as a stable prefix; the step instructions are appended after
+    the conversation, so Ollama can reuse its KV cache across the steps. Like the ReAct agent, the
+    calls go through the LLM response cache and count against the `TurnBudget` of the turn.
+    """
+    if system_prompt is None:
+        system_prompt = get_plan_system_prompt()
+
+    python_tool = create_python_tool(authorized_imports)
+    tools_node = ToolNode(tools=[python_tool])
+    context_node = create_context_node(llm, system_prompt=system_prompt)
+    prefix = PromptPrefix(system_prompt, [])
+    llm_string = llm._get_llm_string()
+    budget = budget or TurnBudget()
+
+    def cache_keys(payload, config: RunnableConfig):
+        # The response cache is opt-in, and a request can bypass it with `llm_cache: False`
+        if LLM_CACHE is None or not config.get("configurable", {}).get("llm_cache", True):
+            return None
+        return LLM_CACHE.make_keys(llm_string, prefix.version, payload)
+
+    def invoke(payload, config: RunnableConfig):
+        keys = cache_keys(payload, config)
+        if keys is None:
+            return llm.invoke(payload), False
+        return cached_invoke(LLM_CACHE, llm, payload, keys)
+
+    async def ainvoke(payload, config: RunnableConfig):
+        keys = cache_keys(payload, config)
+        if keys is None:
+            return await llm.ainvoke(payload), False
+        return await acached_invoke(LLM_CACHE, llm, payload, keys)
+
+    def prepare_call(state: PlanState, instructions: str):
+        messages = state["messages"]
+        usage = budget.usage(messages, state.get("budget"))
+        payload = prefix.assemble(
+            messages,
+            summary=state.get("summary"),
+            tail=[SystemMessage(content=instructions)],
+        )
+        prompt_tokens = count_tokens(payload)
+
+        forced_reason = budget.exhausted(usage, prompt_tokens)
+        if forced_reason is None:
+            return payload, usage, prompt_tokens, None
+
+        logging.info(f"budget:forcing final answer after {forced_reason}")
+        payload = prefix.assemble(
+            messages,
+            summary=state.get("summary"),
+            tail=budget.final_answer_tail(forced_reason),
+        )
+        return payload, usage, prompt_tokens, forced_reason
+
+    def observe(payload, response, config: RunnableConfig, cached: bool):
+        response.content = remove_think_tags(response.content)
+        # A cached response never reached the model server, there is no prompt cache use to measure
+        if not cached:
+            thread_id = config.get("configurable", {}).get("thread_id", "default")
+            report = PREFIX_CACHE_MONITOR.observe(thread_id, prefix, payload, response)
+            response.response_metadata.update(report)
+        response.response_metadata["llm_cache_hit"] = cached
+
+    def finish_call(message, usage: dict, prompt_tokens: int, forced_reason) -> PlanState:
+        usage = budget.limit_tool_calls(usage, message)
+        usage = budget.record(usage, prompt_tokens, message)
+        message.response_metadata["budget"] = budget.report(usage, forced_reason)
+        return {"messages": message, "budget": usage}
+
+    def plan_instructions(state: PlanState) -> str:
+        last = state["messages"][-1]
+        if isinstance(last, ToolMessage) and last.status == "error":
+            return REPAIR_INSTRUCTIONS
+        return PLAN_INSTRUCTIONS
+
+    def finish_plan(
+        payload, response, config: RunnableConfig, usage, prompt_tokens, forced_reason, cached
+    ) -> PlanState:
+        observe(payload, response, config, cached)
+        # A forced final answer is never run, even if the model wrote code anyway
+        script = extract_script(response.content) if forced_reason is None else None
+        if script is None:
+            # Answered directly, nothing to run
+            return finish_call(response, usage, prompt_tokens, forced_reason)
+        # The script becomes a python_tool call, so the thread looks like a regular tool exchange
+        planned = AIMessage(
+            id=response.id,
+            content=response.content,
+            response_metadata=response.response_metadata,
+            tool_calls=[
+                {
+                    "name": python_tool.name,
+                    "args": {"code": script},
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                }
+            ],
+        )
+        return finish_call(planned, usage, prompt_tokens, forced_reason)
+
+    def plan_node(state: PlanState, config: RunnableConfig) -> PlanState:
+        payload, usage, prompt_tokens, forced_reason = prepare_call(
+            state, plan_instructions(state)
+        )
+        response, cached = invoke(payload, config)
+        return finish_plan(
+            payload, response, config, usage, prompt_tokens, forced_reason, cached
+        )
+
+    async def aplan_node(state: PlanState, config: RunnableConfig) -> PlanState:
+        payload, usage, prompt_tokens, forced_reason = prepare_call(
+            state, plan_instructions(state)
+        )
+        response, cached = await ainvoke(payload, config)
+        return finish_plan(
+            payload, response, config, usage, prompt_tokens, forced_reason, cached
+        )
+
+    def answer_node(state: PlanState, config: RunnableConfig) -> PlanState:
+        payload, usage, prompt_tokens, forced_reason = prepare_call(state, ANSWER_INSTRUCTIONS)
+        response, cached = invoke(payload, config)
+        observe(payload, response, config, cached)
+        return finish_call(response, usage, prompt_tokens, forced_reason)
+
+    async def aanswer_node(state: PlanState, config: RunnableConfig) -> PlanState:
+        payload, usage, prompt_tokens, forced_reason = prepare_call(state, ANSWER_INSTRUCTIONS)
+        response, cached = await ainvoke(payload, config)
+        observe(payload, response, config, cached)
+        return finish_call(response, usage, prompt_tokens, forced_reason)
+
+    def route_plan(state: PlanState):
+        last = state["messages"][-1]
+        return TOOLS_NAME if getattr(last, "tool_calls", None) else END
+
+    def route_result(state: PlanState):
+        turn = current_turn(state["messages"])
+        failures = sum(
+            1 for m in turn if isinstance(m, ToolMessage) and m.status == "error"
+        )
+        if turn[-1].status == "error" and failures <= max_repairs:
+            return CONTEXT_NODE
+        return ANSWER_NODE
+
+    CONTEXT_NODE = "CONTEXT_NODE"
+    PLAN_NODE = "PLAN_NODE"
+    ANSWER_NODE = "ANSWER_NODE"
+    TOOLS_NAME = "tools"
+
+    builder = StateGraph(PlanState)
+    builder.add_node(CONTEXT_NODE, context_node)
+    builder.add_node(
+        PLAN_NODE, RunnableLambda(plan_node, afunc=aplan_node, name="plan_node")
+    )
+    builder.add_node(TOOLS_NAME, tools_node)
+    builder.add_node(
+        ANSWER_NODE, RunnableLambda(answer_node, afunc=aanswer_node, name="answer_node")
+    )
+
+    builder.add_edge(CONTEXT_NODE, PLAN_NODE)
+    builder.add_conditional_edges(PLAN_NODE, route_plan, [TOOLS_NAME, END])
+    builder.add_conditional_edges(TOOLS_NAME, route_result, [CONTEXT_NODE, ANSWER_NODE])
+    builder.add_edge(ANSWER_NODE, END)
+    builder.set_entry_point(CONTEXT_NODE)
+
+    return builder
+
+
+if __name__ == "__main__":
+    builder = create_plan_and_execute_builder()
+    graph = builder.compile()
+
+    inputs = {"messages": "디비를 참고해서 어떠한 투자가 괜찮을지 알려줘"}
+
+    for event in graph.stream(inputs, stream_mode="values"):
+        for i, value in enumerate(event.values()):
+            print(f"\n==============\nSTEP: {i + 1}\n==============\n")
+            print(value[-1])
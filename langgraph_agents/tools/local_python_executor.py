@@ -1550,7 +1550,11 @@ class LocalPythonExecutor(PythonExecutor):
     #     self.static_tools = {**tools, **BASE_PYTHON_TOOLS.copy()}
 
 
-def local_python_executor(code: str, authorized_imports: List[str]):
+def local_python_executor(
+    code: str,
+    authorized_imports: List[str],
+    custom_tools: Optional[Dict[str, Callable]] = None,
+):
     """
     Executes Python code in a sandboxed environment with restricted imports for security.
     
@@ -1566,6 +1570,8 @@ def local_python_executor(code: str, authorized_imports: List[str]):
             A list of module names that are allowed to be imported by the code.
             These are in addition to the base built-in modules defined in BASE_BUILTIN_MODULES.
             For unrestricted imports (use with caution), include "*" in the list.
+        custom_tools (Dict[str, Callable], optional):
+            Helper functions made available to the code by name, such as a database query helper.
     
     Returns:
         Any: The result of the last statement in the executed code. If the code raises
@@ -1602,6 +1608,8 @@ def local_python_executor(code: str, authorized_imports: List[str]):
         3
     """
     tool = LocalPythonExecutor(additional_authorized_imports=authorized_imports)
+    if custom_tools:
+        tool.custom_tools.update(custom_tools)
     output, logs, is_final_answer = tool(code_action=code)
     return output
 
@@ -1,16 +1,53 @@
 from fastapi import FastAPI, Request, Depends, status, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.concurrency import run_in_threadpool
+from fastapi.concurrency import run_in_threadpool, iterate_in_threadpool
 
 
 from starlette.responses import StreamingResponse, Response
 from pydantic import BaseModel, ConfigDict
-from typing import List, Union, Generator, Iterator
+from typing import List, Optional, Tuple, Union, Generator, Iterator, AsyncGenerator, AsyncIterator
 
 
 from utils.pipelines.auth import bearer_security, get_current_user
-from utils.pipelines.main import get_last_user_message, stream_message_template
+from utils.pipelines.main import get_last_user_message
 from utils.pipelines.misc import convert_to_raw_url
+from utils.pipelines.registry import RegistrySnapshot
+from utils.pipelines.reloader import (
+    InFlight,
+    LazyPipeline,
+    LoadingPipeline,
+    can_be_lazy,
+    file_signature,
+    is_lazy,
+    is_placeholder,
+    module_files,
+    pipeline_status,
+)
+from utils.pipelines.requirements import RequirementsInstaller, parse_requirements
+from utils.pipelines.workers import WorkerChannel, serve, write_json_atomic
+from utils.metrics import (
+    CURRENT_PIPELINE,
+    METRICS,
+    QUEUE_WAIT,
+    REQUEST_DURATION,
+    REQUESTS,
+    caller_label,
+    measure_stream,
+)
+from utils.tracing import end_span_after, span, start_span, traced_stream, use_span
+from utils.pipelines.sse import SSE_COALESCE_MS, StreamEncoder, acoalesce, coalesce, dumps
+from utils.pipelines.admission import (
+    PIPELINE_MAX_CONCURRENCY,
+    PIPELINE_MAX_QUEUE,
+    PIPELINE_MAX_QUEUE_WAIT,
+    PIPELINE_USER_MAX_QUEUE,
+    AdmissionQueue,
+    AdmissionRejected,
+    AdmittedStreamingResponse,
+    RateLimiter,
+    caller_id,
+    stream_when_admitted,
+)
 
 from contextlib import asynccontextmanager
 from concurrent.futures import ThreadPoolExecutor
@@ -19,17 +56,26 @@ from urllib.parse import urlparse
 
 import shutil
 import aiohttp
+import asyncio
 import os
 import importlib.util
+import inspect
 import logging
 import time
 import json
 import uuid
-import sys
-import subprocess
 
 
-from config import API_KEY, PIPELINES_DIR
+from config import (
+    API_KEY,
+    PIPELINES_DIR,
+    PIPELINES_WATCH_INTERVAL,
+    PIPELINES_LOAD_CONCURRENCY,
+    PIPELINES_LAZY,
+    PIPELINES_REQUIREMENTS_ISOLATED,
+    PIPELINES_DRAIN_TIMEOUT,
+    PIPELINES_WORKERS,
+)
 
 if not os.path.exists(PIPELINES_DIR):
     os.makedirs(PIPELINES_DIR)
@@ -38,6 +84,31 @@ if not os.path.exists(PIPELINES_DIR):
 PIPELINES = {}
 PIPELINE_MODULES = {}
 PIPELINE_NAMES = {}
+# Pipeline id -> AdmissionQueue, kept across reloads so in-flight requests release their slots
+ADMISSION_QUEUES = {}
+RATE_LIMITER = RateLimiter()
+# Module name -> signature of the file as last loaded, to find changed files
+MODULE_SIGNATURES = {}
+# Requests running on each pipeline instance, drained before a replaced instance shuts down
+IN_FLIGHT = InFlight()
+# Serializes reloads from the file watcher and the API
+RELOAD_LOCK = asyncio.Lock()
+# Replaced pipelines that are finishing their requests
+RETIRING = set()
+# Module name -> status and seconds each loading step took, see GET /pipelines/startup
+STARTUP_REPORT = {}
+# Installs frontmatter requirements in the background, see load_pipeline
+INSTALLER = RequirementsInstaller(
+    os.path.join(PIPELINES_DIR, ".requirements"), isolated=PIPELINES_REQUIREMENTS_ISOLATED
+)
+# Module name -> task that loads the module once its requirements are installed
+PENDING_INSTALLS = {}
+# Tells the other worker processes about valves updates and reloads, see on_worker_event
+CHANNEL = WorkerChannel()
+# Whether the pipelines were loaded before the workers were forked, see preload
+PRELOADED = False
+# Set while preload runs: modules are imported but not started
+PRELOADING = False
 
 
 def get_all_pipelines():
@@ -116,46 +187,51 @@ def parse_frontmatter(content):
     return frontmatter
 
 
-def install_frontmatter_requirements(requirements):
-    if requirements:
-        req_list = [req.strip() for req in requirements.split(",")]
-        for req in req_list:
-            print(f"Installing requirement: {req}")
-            subprocess.check_call([sys.executable, "-m", "pip", "install", req])
+def read_frontmatter(module_path):
+    # Read the module content
+    with open(module_path, "r") as file:
+        content = file.read()
+
+    # Parse frontmatter
+    frontmatter = {}
+    if content.startswith('"""'):
+        end = content.find('"""', 3)
+        if end != -1:
+            frontmatter_content = content[3:end]
+            frontmatter = parse_frontmatter(frontmatter_content)
+    return frontmatter
+
+
+def import_pipeline(module_name, module_path, timings):
+    # Load the module
+    start = time.perf_counter()
+    spec = importlib.util.spec_from_file_location(module_name, module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    timings["import"] = time.perf_counter() - start
+    print(f"Loaded module: {module.__name__}")
+    if hasattr(module, "Pipeline"):
+        start = time.perf_counter()
+        pipeline = module.Pipeline()
+        timings["init"] = time.perf_counter() - start
+        return pipeline
     else:
-        print("No requirements found in frontmatter.")
+        raise Exception("No Pipeline class found")
 
 
-async def load_module_from_path(module_name, module_path):
+async def load_module_from_path(module_name, module_path, timings=None):
+    """
+    :param timings: Filled with the seconds the import and the Pipeline constructor took.
+    """
+    timings = {} if timings is None else timings
 
     try:
-        # Read the module content
-        with open(module_path, "r") as file:
-            content = file.read()
-
-        # Parse frontmatter
-        frontmatter = {}
-        if content.startswith('"""'):
-            end = content.find('"""', 3)
-            if end != -1:
-                frontmatter_content = content[3:end]
-                frontmatter = parse_frontmatter(frontmatter_content)
-
-        # Install requirements if specified
-        if "requirements" in frontmatter:
-            install_frontmatter_requirements(frontmatter["requirements"])
-
-        # Load the module
-        spec = importlib.util.spec_from_file_location(module_name, module_path)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        print(f"Loaded module: {module.__name__}")
-        if hasattr(module, "Pipeline"):
-            return module.Pipeline()
-        else:
-            raise Exception("No Pipeline class found")
+        # Imports and constructors can take seconds, e.g. to inspect a database, so they run in a
+        # thread, where several modules can load at once
+        return await asyncio.to_thread(import_pipeline, module_name, module_path, timings)
     except Exception as e:
         print(f"Error loading module: {module_name}")
+        timings["error"] = str(e)
 
         # # Move the file to the error folder
         # failed_pipelines_folder = os.path.join(PIPELINES_DIR, "failed")
@@ -168,66 +244,403 @@ async def load_module_from_path(module_name, module_path):
     return None
 
 
-async def load_modules_from_directory(directory):
+async def load_pipeline(directory, module_name, timings=None):
+    """
+    Imports a pipeline module and creates its Pipeline with the valves saved in its subfolder.
+
+    :param timings: Filled with the seconds the import and the Pipeline constructor took.
+    """
+    module_path = os.path.join(directory, f"{module_name}.py")
+
+    print(f"Loading module: {module_name}")
+    print(f"Loading module path: {module_path}")
+
+    # Create subfolder matching the filename without the .py extension
+    subfolder_path = os.path.join(directory, module_name)
+    if not os.path.exists(subfolder_path):
+        os.makedirs(subfolder_path)
+        logging.info(f"Created subfolder: {subfolder_path}")
+
+    # Create a valves.json file if it doesn't exist
+    valves_json_path = os.path.join(subfolder_path, "valves.json")
+    if not os.path.exists(valves_json_path):
+        write_json_atomic(valves_json_path, {})
+        logging.info(f"Created valves.json in: {subfolder_path}")
+
+    MODULE_SIGNATURES[module_name] = file_signature(module_path)
+
+    frontmatter = read_frontmatter(module_path)
+    requirements = parse_requirements(frontmatter.get("requirements", ""))
+    if not INSTALLER.is_installed(requirements):
+        # Listed as loading until pip is done, then loaded by load_when_installed
+        install_requirements(directory, module_name, requirements)
+        return LoadingPipeline(
+            id=frontmatter.get("id", module_name),
+            name=frontmatter.get("title", module_name),
+        )
+    INSTALLER.activate(requirements)
+
+    pipeline = await load_module_from_path(module_name, module_path, timings)
+    if pipeline:
+        # Overwrite pipeline.valves with values from valves.json
+        if apply_saved_valves(pipeline, valves_json_path):
+            logging.info(f"Updated valves for module: {module_name}")
+
+        logging.info(f"Loaded module: {module_name}")
+    else:
+        logging.warning(f"No Pipeline class found in {module_name}")
+    return pipeline
+
+
+def apply_saved_valves(pipeline, valves_json_path):
+    """
+    Sets the pipeline's valves to its defaults overwritten by the values in valves.json.
+    Returns False if the pipeline has no valves or there is no valves.json.
+    """
+    if not hasattr(pipeline, "valves") or not os.path.exists(valves_json_path):
+        return False
+    with open(valves_json_path, "r") as f:
+        valves_json = json.load(f)
+    ValvesModel = pipeline.valves.__class__
+    # Create a ValvesModel instance using default values and overwrite with valves_json
+    combined_valves = {
+        **pipeline.valves.model_dump(),
+        **valves_json,
+    }
+    pipeline.valves = ValvesModel(**combined_valves)
+    return True
+
+
+def install_requirements(directory, module_name, requirements):
+    """
+    Installs a module's requirements in the background and loads the module afterwards.
+    """
+    if module_name in PENDING_INSTALLS and not PENDING_INSTALLS[module_name].done():
+        return
+    STARTUP_REPORT.setdefault(module_name, {})["status"] = "loading"
+    install = INSTALLER.install(requirements)
+
+    async def load_when_installed():
+        start = time.perf_counter()
+        try:
+            await install
+        except Exception as e:
+            logging.error(f"{module_name}: {e}")
+            for pipeline_id, name in PIPELINE_NAMES.items():
+                pipeline = PIPELINE_MODULES.get(pipeline_id)
+                if name == module_name and isinstance(pipeline, LoadingPipeline):
+                    pipeline.status = "failed"
+                    pipeline.error = str(e)
+            STARTUP_REPORT[module_name] = {"status": "failed", "error": str(e)}
+            return
+        async with RELOAD_LOCK:
+            # Before the fork, the workers start the module themselves
+            await reload_module(directory, module_name, run_startup=not PRELOADING)
+        STARTUP_REPORT[module_name]["requirements"] = time.perf_counter() - start
+
+    PENDING_INSTALLS[module_name] = asyncio.create_task(load_when_installed())
+
+
+def pipeline_id_of(pipeline, module_name):
+    return pipeline.id if hasattr(pipeline, "id") else module_name
+
+
+def lazy_pipeline(directory, module_name):
+    """
+    Returns a stand-in listed from the module's frontmatter, or None if the module has to be
+    loaded now: modules that may be filters or manifolds or set their own id (see
+    `can_be_lazy`), and modules with requirements to install.
+    """
+    module_path = os.path.join(directory, f"{module_name}.py")
+    try:
+        with open(module_path, "r") as f:
+            source = f.read()
+        frontmatter = read_frontmatter(module_path)
+    except Exception as e:
+        logging.warning(f"Could not read the frontmatter of {module_name}: {e}")
+        return None
+    if not can_be_lazy(source) or frontmatter.get("requirements"):
+        return None
+    MODULE_SIGNATURES[module_name] = file_signature(module_path)
+    # Without its own id, the loaded pipeline is registered under the module name
+    return LazyPipeline(id=module_name, name=frontmatter.get("title", module_name))
+
+
+def loaded_pipeline(module_name):
+    """
+    Returns the pipeline loaded from a module, or None if it is not loaded (yet).
+    """
+    for pipeline_id, name in PIPELINE_NAMES.items():
+        pipeline = PIPELINE_MODULES.get(pipeline_id)
+        if name == module_name and pipeline is not None and not is_placeholder(pipeline):
+            return pipeline
+    return None
+
+
+async def load_modules_from_directory(directory, lazy=PIPELINES_LAZY):
+    """
+    Loads the pipeline modules of a directory, several at a time.
+
+    :param lazy: List plain pipes from their frontmatter and load them on their first request.
+    """
     global PIPELINE_MODULES
     global PIPELINE_NAMES
 
-    for filename in os.listdir(directory):
-        if filename.endswith(".py"):
-            module_name = filename[:-3]  # Remove the .py extension
-            module_path = os.path.join(directory, filename)
-
-            print(f"Loading module: {module_name}")
-            print(f"Loading module path: {module_path}")
-
-            # Create subfolder matching the filename without the .py extension
-            subfolder_path = os.path.join(directory, module_name)
-            if not os.path.exists(subfolder_path):
-                os.makedirs(subfolder_path)
-                logging.info(f"Created subfolder: {subfolder_path}")
-
-            # Create a valves.json file if it doesn't exist
-            valves_json_path = os.path.join(subfolder_path, "valves.json")
-            if not os.path.exists(valves_json_path):
-                with open(valves_json_path, "w") as f:
-                    json.dump({}, f)
-                logging.info(f"Created valves.json in: {subfolder_path}")
-
-            pipeline = await load_module_from_path(module_name, module_path)
-            if pipeline:
-                # Overwrite pipeline.valves with values from valves.json
-                if os.path.exists(valves_json_path):
-                    with open(valves_json_path, "r") as f:
-                        valves_json = json.load(f)
-                        if hasattr(pipeline, "valves"):
-                            ValvesModel = pipeline.valves.__class__
-                            # Create a ValvesModel instance using default values and overwrite with valves_json
-                            combined_valves = {
-                                **pipeline.valves.model_dump(),
-                                **valves_json,
-                            }
-                            valves = ValvesModel(**combined_valves)
-                            pipeline.valves = valves
-
-                            logging.info(f"Updated valves for module: {module_name}")
-
-                pipeline_id = pipeline.id if hasattr(pipeline, "id") else module_name
-                PIPELINE_MODULES[pipeline_id] = pipeline
-                PIPELINE_NAMES[pipeline_id] = module_name
-                logging.info(f"Loaded module: {module_name}")
-            else:
-                logging.warning(f"No Pipeline class found in {module_name}")
+    semaphore = asyncio.Semaphore(max(PIPELINES_LOAD_CONCURRENCY, 1))
+
+    async def load(module_name):
+        report = STARTUP_REPORT[module_name] = {"status": "loading"}
+        start = time.perf_counter()
+        pipeline = lazy_pipeline(directory, module_name) if lazy else None
+        if pipeline is None:
+            async with semaphore:
+                pipeline = await load_pipeline(directory, module_name, report)
+        report["status"] = "failed" if pipeline is None else pipeline_status(pipeline)
+        report["load"] = time.perf_counter() - start
+        return pipeline
+
+    module_names = list(module_files(directory))
+    pipelines = await asyncio.gather(*(load(module_name) for module_name in module_names))
+
+    # Registered in directory order, whichever finished loading first
+    for module_name, pipeline in zip(module_names, pipelines):
+        if pipeline:
+            pipeline_id = pipeline_id_of(pipeline, module_name)
+            PIPELINE_MODULES[pipeline_id] = pipeline
+            PIPELINE_NAMES[pipeline_id] = module_name
 
-    global PIPELINES
-    PIPELINES = get_all_pipelines()
+    refresh_registry()
+
+
+async def retire_pipeline(pipeline_id, pipeline):
+    """
+    Shuts a replaced or removed pipeline down once its running requests are done.
+    """
+    if not await IN_FLIGHT.drain(pipeline, PIPELINES_DRAIN_TIMEOUT):
+        logging.warning(
+            f"{pipeline_id}: shutting down with {IN_FLIGHT.running(pipeline)} requests running"
+        )
+    if hasattr(pipeline, "on_shutdown"):
+        try:
+            await pipeline.on_shutdown()
+        except Exception as e:
+            logging.error(f"{pipeline_id}: on_shutdown failed: {e}")
+    logging.info(f"Retired pipeline: {pipeline_id}")
+
+
+async def reload_module(directory, module_name, lazy=False, run_startup=True):
+    """
+    Loads, replaces or removes one pipeline module without touching the others.
+
+    The new Pipeline is created and started while the old one keeps serving, then both are
+    swapped in one registry update. Requests that already run on the old instance finish there
+    before it is shut down. If the new version fails to load or start, the old one stays.
+
+    :param lazy: Only list the module from its frontmatter, unless it is already loaded.
+    :param run_startup: Run the new pipeline's on_startup. Without it, the caller starts it.
+    """
+    old = {
+        pipeline_id: PIPELINE_MODULES[pipeline_id]
+        for pipeline_id, name in PIPELINE_NAMES.items()
+        if name == module_name and pipeline_id in PIPELINE_MODULES
+    }
+
+    pipeline = None
+    if os.path.exists(os.path.join(directory, f"{module_name}.py")):
+        if lazy and all(is_lazy(p) for p in old.values()):
+            pipeline = lazy_pipeline(directory, module_name)
+    if pipeline is None and os.path.exists(os.path.join(directory, f"{module_name}.py")):
+        report = STARTUP_REPORT[module_name] = {"status": "loading"}
+        start = time.perf_counter()
+        pipeline = await load_pipeline(directory, module_name, report)
+        if pipeline is None:
+            report["status"] = "failed"
+            return False
+        if isinstance(pipeline, LoadingPipeline):
+            report["status"] = "loading"
+            if not all(is_placeholder(p) for p in old.values()):
+                # The old version keeps serving until the new requirements are installed
+                return False
+        elif run_startup and hasattr(pipeline, "on_startup"):
+            try:
+                started = time.perf_counter()
+                await pipeline.on_startup()
+                report["on_startup"] = time.perf_counter() - started
+            except Exception as e:
+                logging.error(f"{module_name}: on_startup failed, keeping the old version: {e}")
+                report["status"] = "failed"
+                return False
+        report["status"] = pipeline_status(pipeline)
+        report["load"] = time.perf_counter() - start
+    elif pipeline is None:
+        MODULE_SIGNATURES.pop(module_name, None)
+
+    for pipeline_id in old:
+        del PIPELINE_MODULES[pipeline_id]
+        del PIPELINE_NAMES[pipeline_id]
+    if pipeline:
+        pipeline_id = pipeline_id_of(pipeline, module_name)
+        PIPELINE_MODULES[pipeline_id] = pipeline
+        PIPELINE_NAMES[pipeline_id] = module_name
+    refresh_registry()
+
+    for pipeline_id, old_pipeline in old.items():
+        if is_placeholder(old_pipeline):
+            continue
+        task = asyncio.create_task(retire_pipeline(pipeline_id, old_pipeline))
+        RETIRING.add(task)
+        task.add_done_callback(RETIRING.discard)
+    return True
+
+
+async def sync_modules(directory, force=False):
+    """
+    Reloads the modules whose files were added, changed or removed since they were loaded.
+
+    :param force: Reload every module, changed or not.
+    """
+    async with RELOAD_LOCK:
+        files = module_files(directory)
+        changed = [
+            module_name
+            for module_name in sorted(set(files) | set(MODULE_SIGNATURES))
+            if force
+            or file_signature(files.get(module_name, "")) != MODULE_SIGNATURES.get(module_name)
+        ]
+        for module_name in changed:
+            await reload_module(directory, module_name, lazy=PIPELINES_LAZY)
+        return changed
+
+
+async def ensure_loaded(modules, pipeline_id):
+    """
+    Returns the pipeline instance, loading it first if it was only listed (PIPELINES_LAZY).
+    """
+    pipeline = modules[pipeline_id]
+    if isinstance(pipeline, LoadingPipeline):
+        if pipeline.status == "failed":
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=f"Pipeline {pipeline_id} failed to load: {pipeline.error}",
+            )
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Pipeline {pipeline_id} is installing its requirements",
+            headers={"Retry-After": "10"},
+        )
+    if not is_lazy(pipeline):
+        return pipeline
+    # Looked up by module, as the loaded pipeline may be registered under another id
+    module_name = PIPELINE_NAMES.get(pipeline_id, pipeline_id)
+    async with RELOAD_LOCK:
+        # Another request may have loaded it while this one waited
+        loaded = loaded_pipeline(module_name)
+        if loaded is None:
+            await reload_module(PIPELINES_DIR, module_name)
+            loaded = loaded_pipeline(module_name)
+    if loaded is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Pipeline {pipeline_id} failed to load",
+        )
+    return loaded
+
+
+async def watch_modules(directory, interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            changed = await sync_modules(directory)
+            if changed:
+                logging.info(f"Reloaded changed pipelines: {', '.join(changed)}")
+        except Exception as e:
+            logging.error(f"Watching {directory} failed: {e}")
+
+
+def render_models(pipelines, created: int) -> dict:
+    return {
+        "data": [
+            {
+                "id": pipeline["id"],
+                "name": pipeline["name"],
+                "object": "model",
+                "created": created,
+                "owned_by": "openai",
+                "pipeline": {
+                    "type": pipeline["type"],
+                    **(
+                        {
+                            "pipelines": (
+                                pipeline["valves"].pipelines
+                                if pipeline.get("valves", None)
+                                else []
+                            ),
+                            "priority": pipeline.get("priority", 0),
+                        }
+                        if pipeline.get("type", "pipe") == "filter"
+                        else {}
+                    ),
+                    "valves": pipeline["valves"] != None,
+                },
+            }
+            for pipeline in pipelines.values()
+        ],
+        "object": "list",
+        "pipelines": True,
+    }
+
+
+REGISTRY = RegistrySnapshot(0, {}, {}, {}, render_models)
+
+
+def refresh_registry():
+    """
+    Rebuilds the pipeline registry snapshot after pipelines were loaded, removed or changed.
+
+    This is the only place that calls `get_all_pipelines` (and the manifolds' `pipelines()`).
+    Request handlers keep reading the previous snapshot until the new one is swapped in.
+    """
+    global PIPELINES, REGISTRY
+    REGISTRY = RegistrySnapshot(
+        REGISTRY.version + 1,
+        get_all_pipelines(),
+        PIPELINE_MODULES,
+        PIPELINE_NAMES,
+        render_models,
+    )
+    PIPELINES = REGISTRY.pipelines
+    logging.info(f"registry:version {REGISTRY.version}, {len(PIPELINES)} pipelines")
+
+
+async def start_module(pipeline_id):
+    module = PIPELINE_MODULES[pipeline_id]
+    report = STARTUP_REPORT.setdefault(PIPELINE_NAMES[pipeline_id], {})
+    if hasattr(module, "on_startup"):
+        start = time.perf_counter()
+        await module.on_startup()
+        report["on_startup"] = time.perf_counter() - start
+
+
+def log_startup_report(seconds):
+    lines = [f"Pipelines started in {seconds:.2f}s"]
+    for module_name, report in STARTUP_REPORT.items():
+        steps = ", ".join(
+            f"{step} {report[step]:.2f}s"
+            for step in ("import", "init", "on_startup")
+            if step in report
+        )
+        lines.append(f"  {module_name}: {report['status']} {steps}".rstrip())
+    logging.info("\n".join(lines))
 
 
 async def on_startup():
-    await load_modules_from_directory(PIPELINES_DIR)
+    start = time.perf_counter()
+    if not PRELOADED:
+        STARTUP_REPORT.clear()
+        await load_modules_from_directory(PIPELINES_DIR)
 
-    for module in PIPELINE_MODULES.values():
-        if hasattr(module, "on_startup"):
-            await module.on_startup()
+    await asyncio.gather(*(start_module(pipeline_id) for pipeline_id in list(PIPELINE_MODULES)))
+    log_startup_report(time.perf_counter() - start)
 
 
 async def on_shutdown():
@@ -237,25 +650,80 @@ async def on_shutdown():
 
 
 async def reload():
-    await on_shutdown()
-    # Clear existing pipelines
-    PIPELINES.clear()
-    PIPELINE_MODULES.clear()
-    PIPELINE_NAMES.clear()
-    # Load pipelines afresh
-    await on_startup()
+    # Every module is replaced one at a time, so the others keep serving meanwhile
+    await sync_modules(PIPELINES_DIR, force=True)
+
+
+def preload():
+    """
+    Imports and creates the pipelines before the worker processes are forked, so they share the
+    imported modules copy-on-write. Nothing is started: each worker runs the pipelines'
+    on_startup itself, since that opens connections on the worker's own event loop.
+    """
+    global PRELOADED, PRELOADING, RELOAD_LOCK
+
+    async def load():
+        STARTUP_REPORT.clear()
+        await load_modules_from_directory(PIPELINES_DIR)
+        # Workers must not start with pip still running in the parent. Modules whose
+        # requirements were missing are imported once installed, without on_startup.
+        await asyncio.gather(*PENDING_INSTALLS.values(), return_exceptions=True)
+
+    PRELOADING = True
+    try:
+        asyncio.run(load())
+    finally:
+        PRELOADING = False
+    PENDING_INSTALLS.clear()
+    # Asyncio locks used by the parent's event loop are not usable on the workers' loops
+    RELOAD_LOCK = asyncio.Lock()
+    INSTALLER.reset_lock()
+    PRELOADED = True
+
+
+async def reload_valves(pipeline_id):
+    """
+    Applies valves another worker saved to valves.json.
+    """
+    pipeline = PIPELINE_MODULES.get(pipeline_id)
+    if pipeline is None or is_placeholder(pipeline):
+        # Listed pipelines read valves.json when they are loaded
+        return
+    valves_json_path = os.path.join(PIPELINES_DIR, PIPELINE_NAMES[pipeline_id], "valves.json")
+    if apply_saved_valves(pipeline, valves_json_path):
+        if hasattr(pipeline, "on_valves_updated"):
+            await pipeline.on_valves_updated()
+        refresh_registry()
+
+
+async def on_worker_event(event):
+    """
+    Applies a change another worker process made, see CHANNEL.
+    """
+    if event["type"] == "valves":
+        await reload_valves(event["pipeline_id"])
+    elif event["type"] == "reload":
+        await sync_modules(PIPELINES_DIR, force=event.get("force", False))
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await on_startup()
+    CHANNEL.start(on_worker_event)
+    watcher = None
+    if PIPELINES_WATCH_INTERVAL > 0:
+        watcher = asyncio.create_task(
+            watch_modules(PIPELINES_DIR, PIPELINES_WATCH_INTERVAL)
+        )
     yield
+    if watcher:
+        watcher.cancel()
+    CHANNEL.stop()
     await on_shutdown()
 
 
 app = FastAPI(docs_url="/docs", redoc_url=None, lifespan=lifespan)
 
-app.state.PIPELINES = PIPELINES
 
 
 origins = ["*"]
@@ -272,52 +740,28 @@ app.add_middleware(
 
 @app.middleware("http")
 async def check_url(request: Request, call_next):
-    start_time = int(time.time())
-    app.state.PIPELINES = get_all_pipelines()
+    start_time = time.perf_counter()
     response = await call_next(request)
-    process_time = int(time.time()) - start_time
-    response.headers["X-Process-Time"] = str(process_time)
+    # Until the headers are ready; a stream's full duration is in /metrics
+    process_time = time.perf_counter() - start_time
+    response.headers["X-Process-Time"] = f"{process_time:.6f}"
 
     return response
 
 
 @app.get("/v1/models")
 @app.get("/models")
-async def get_models(user: str = Depends(get_current_user)):
+async def get_models(request: Request, user: str = Depends(get_current_user)):
     """
     Returns the available pipelines
     """
-    app.state.PIPELINES = get_all_pipelines()
-    return {
-        "data": [
-            {
-                "id": pipeline["id"],
-                "name": pipeline["name"],
-                "object": "model",
-                "created": int(time.time()),
-                "owned_by": "openai",
-                "pipeline": {
-                    "type": pipeline["type"],
-                    **(
-                        {
-                            "pipelines": (
-                                pipeline["valves"].pipelines
-                                if pipeline.get("valves", None)
-                                else []
-                            ),
-                            "priority": pipeline.get("priority", 0),
-                        }
-                        if pipeline.get("type", "pipe") == "filter"
-                        else {}
-                    ),
-                    "valves": pipeline["valves"] != None,
-                },
-            }
-            for pipeline in app.state.PIPELINES.values()
-        ],
-        "object": "list",
-        "pipelines": True,
-    }
+    registry = REGISTRY
+    headers = {"ETag": registry.models_etag}
+    if registry.etag_matches(request.headers.get("if-none-match")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(
+        content=registry.models_body, media_type="application/json", headers=headers
+    )
 
 
 @app.get("/v1")
@@ -326,27 +770,39 @@ async def get_status():
     return {"status": True}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Returns the server's metrics in the Prometheus text format
+    """
+    return Response(
+        content=METRICS.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 @app.get("/v1/pipelines")
 @app.get("/pipelines")
 async def list_pipelines(user: str = Depends(get_current_user)):
     if user == API_KEY:
+        registry = REGISTRY
         return {
             "data": [
                 {
                     "id": pipeline_id,
-                    "name": PIPELINE_NAMES[pipeline_id],
+                    "name": registry.names[pipeline_id],
                     "type": (
-                        PIPELINE_MODULES[pipeline_id].type
-                        if hasattr(PIPELINE_MODULES[pipeline_id], "type")
+                        registry.modules[pipeline_id].type
+                        if hasattr(registry.modules[pipeline_id], "type")
                         else "pipe"
                     ),
                     "valves": (
                         True
-                        if hasattr(PIPELINE_MODULES[pipeline_id], "valves")
+                        if hasattr(registry.modules[pipeline_id], "valves")
                         else False
                     ),
+                    "status": pipeline_status(registry.modules[pipeline_id]),
                 }
-                for pipeline_id in list(PIPELINE_MODULES.keys())
+                for pipeline_id in registry.modules.keys()
             ]
         }
     else:
@@ -399,7 +855,8 @@ async def add_pipeline(
 
         print(url)
         file_path = await download_file(url, dest_folder=PIPELINES_DIR)
-        await reload()
+        await sync_modules(PIPELINES_DIR)
+        CHANNEL.broadcast({"type": "reload"})
         return {
             "status": True,
             "detail": f"Pipeline added successfully from {file_path}",
@@ -442,8 +899,9 @@ async def upload_pipeline(
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
 
-        # Perform any necessary reload or processing
-        await reload()
+        # Load the new or changed pipeline, the others keep running
+        await sync_modules(PIPELINES_DIR)
+        CHANNEL.broadcast({"type": "reload"})
 
         return {
             "status": True,
@@ -476,14 +934,12 @@ async def delete_pipeline(
     pipeline_id = form_data.id
     pipeline_name = PIPELINE_NAMES.get(pipeline_id.split(".")[0], None)
 
-    if PIPELINE_MODULES[pipeline_id]:
-        if hasattr(PIPELINE_MODULES[pipeline_id], "on_shutdown"):
-            await PIPELINE_MODULES[pipeline_id].on_shutdown()
-
     pipeline_path = os.path.join(PIPELINES_DIR, f"{pipeline_name}.py")
     if os.path.exists(pipeline_path):
         os.remove(pipeline_path)
-        await reload()
+        # Shuts the pipeline down once its running requests are done
+        await sync_modules(PIPELINES_DIR)
+        CHANNEL.broadcast({"type": "reload"})
         return {
             "status": True,
             "detail": f"Pipeline {pipeline_id} deleted successfully",
@@ -500,6 +956,7 @@ async def delete_pipeline(
 async def reload_pipelines(user: str = Depends(get_current_user)):
     if user == API_KEY:
         await reload()
+        CHANNEL.broadcast({"type": "reload", "force": True})
         return {"message": "Pipelines reloaded successfully."}
     else:
         raise HTTPException(
@@ -508,16 +965,32 @@ async def reload_pipelines(user: str = Depends(get_current_user)):
         )
 
 
+@app.get("/v1/pipelines/startup")
+@app.get("/pipelines/startup")
+async def get_startup_report(user: str = Depends(get_current_user)):
+    """
+    Returns how each pipeline was loaded and how many seconds each step took
+    """
+    return {
+        module_name: {
+            key: round(value, 3) if isinstance(value, float) else value
+            for key, value in report.items()
+        }
+        for module_name, report in STARTUP_REPORT.items()
+    }
+
+
 @app.get("/v1/{pipeline_id}/valves")
 @app.get("/{pipeline_id}/valves")
 async def get_valves(pipeline_id: str):
-    if pipeline_id not in PIPELINE_MODULES:
+    registry = REGISTRY
+    if pipeline_id not in registry.modules:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Pipeline {pipeline_id} not found",
         )
 
-    pipeline = PIPELINE_MODULES[pipeline_id]
+    pipeline = await ensure_loaded(registry.modules, pipeline_id)
 
     if hasattr(pipeline, "valves") is False:
         raise HTTPException(
@@ -531,13 +1004,14 @@ async def get_valves(pipeline_id: str):
 @app.get("/v1/{pipeline_id}/valves/spec")
 @app.get("/{pipeline_id}/valves/spec")
 async def get_valves_spec(pipeline_id: str):
-    if pipeline_id not in PIPELINE_MODULES:
+    registry = REGISTRY
+    if pipeline_id not in registry.modules:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Pipeline {pipeline_id} not found",
         )
 
-    pipeline = PIPELINE_MODULES[pipeline_id]
+    pipeline = await ensure_loaded(registry.modules, pipeline_id)
 
     if hasattr(pipeline, "valves") is False:
         raise HTTPException(
@@ -558,7 +1032,7 @@ async def update_valves(pipeline_id: str, form_data: dict):
             detail=f"Pipeline {pipeline_id} not found",
         )
 
-    pipeline = PIPELINE_MODULES[pipeline_id]
+    pipeline = await ensure_loaded(PIPELINE_MODULES, pipeline_id)
 
     if hasattr(pipeline, "valves") is False:
         raise HTTPException(
@@ -575,9 +1049,10 @@ async def update_valves(pipeline_id: str, form_data: dict):
         subfolder_path = os.path.join(PIPELINES_DIR, PIPELINE_NAMES[pipeline_id])
         valves_json_path = os.path.join(subfolder_path, "valves.json")
 
-        # Save the updated valves data back to the valves.json file
-        with open(valves_json_path, "w") as f:
-            json.dump(valves.model_dump(), f)
+        # Save the updated valves data back to the valves.json file, which the other workers
+        # read when they are told about the update
+        write_json_atomic(valves_json_path, valves.model_dump())
+        CHANNEL.broadcast({"type": "valves", "pipeline_id": pipeline_id})
 
         if hasattr(pipeline, "on_valves_updated"):
             await pipeline.on_valves_updated()
@@ -587,6 +1062,9 @@ async def update_valves(pipeline_id: str, form_data: dict):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"{str(e)}",
         )
+    finally:
+        # Filter valves and manifold pipelines show up in /models
+        refresh_registry()
 
     return pipeline.valves
 
@@ -594,20 +1072,21 @@ async def update_valves(pipeline_id: str, form_data: dict):
 @app.post("/v1/{pipeline_id}/filter/inlet")
 @app.post("/{pipeline_id}/filter/inlet")
 async def filter_inlet(pipeline_id: str, form_data: FilterForm):
-    if pipeline_id not in app.state.PIPELINES:
+    registry = REGISTRY
+    if pipeline_id not in registry.pipelines:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Filter {pipeline_id} not found",
         )
 
     try:
-        pipeline = app.state.PIPELINES[form_data.body["model"]]
+        pipeline = registry.pipelines[form_data.body["model"]]
         if pipeline["type"] == "manifold":
             pipeline_id = pipeline_id.split(".")[0]
     except:
         pass
 
-    pipeline = PIPELINE_MODULES[pipeline_id]
+    pipeline = registry.modules[pipeline_id]
 
     try:
         if hasattr(pipeline, "inlet"):
@@ -626,20 +1105,21 @@ async def filter_inlet(pipeline_id: str, form_data: FilterForm):
 @app.post("/v1/{pipeline_id}/filter/outlet")
 @app.post("/{pipeline_id}/filter/outlet")
 async def filter_outlet(pipeline_id: str, form_data: FilterForm):
-    if pipeline_id not in app.state.PIPELINES:
+    registry = REGISTRY
+    if pipeline_id not in registry.pipelines:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Filter {pipeline_id} not found",
         )
 
     try:
-        pipeline = app.state.PIPELINES[form_data.body["model"]]
+        pipeline = registry.pipelines[form_data.body["model"]]
         if pipeline["type"] == "manifold":
             pipeline_id = pipeline_id.split(".")[0]
     except:
         pass
 
-    pipeline = PIPELINE_MODULES[pipeline_id]
+    pipeline = registry.modules[pipeline_id]
 
     try:
         if hasattr(pipeline, "outlet"):
@@ -655,35 +1135,126 @@ async def filter_outlet(pipeline_id: str, form_data: FilterForm):
         )
 
 
+def completion_message_template(
+    model: str, message: str, reasoning_content: str = "", metadata: Optional[dict] = None
+):
+    completion = {
+        "id": f"{model}-{str(uuid.uuid4())}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": message,
+                },
+                "logprobs": None,
+                "finish_reason": "stop",
+            }
+        ],
+    }
+    if reasoning_content:
+        completion["choices"][0]["message"]["reasoning_content"] = reasoning_content
+    if metadata:
+        completion.update(metadata)
+    return completion
+
+
+def merge_stream_line(
+    message: str, reasoning_content: str, metadata: dict, line
+) -> Tuple[str, str, dict]:
+    if isinstance(line, dict):
+        reasoning_content = f"{reasoning_content}{line.get('reasoning_content', '')}"
+        # Top-level fields of the completion, e.g. {"metadata": {"budget": ...}}
+        metadata = {**metadata, **line.get("metadata", {})}
+        line = line.get("content", "")
+    return f"{message}{line}", reasoning_content, metadata
+
+
+def is_async_pipe(pipe) -> bool:
+    return inspect.iscoroutinefunction(pipe) or inspect.isasyncgenfunction(pipe)
+
+
+def get_admission_queue(pipeline_id: str, pipeline) -> AdmissionQueue:
+    """
+    Returns the admission queue of a pipeline. A pipeline can set `max_concurrency`, `max_queue`,
+    `max_queue_wait` and `user_max_queue` attributes to override the PIPELINE_* defaults.
+    """
+    if pipeline_id not in ADMISSION_QUEUES:
+        ADMISSION_QUEUES[pipeline_id] = AdmissionQueue(
+            pipeline_id,
+            max_concurrency=getattr(pipeline, "max_concurrency", PIPELINE_MAX_CONCURRENCY),
+            max_queue=getattr(pipeline, "max_queue", PIPELINE_MAX_QUEUE),
+            max_queue_wait=getattr(pipeline, "max_queue_wait", PIPELINE_MAX_QUEUE_WAIT),
+            user_max_queue=getattr(pipeline, "user_max_queue", PIPELINE_USER_MAX_QUEUE),
+        )
+    return ADMISSION_QUEUES[pipeline_id]
+
+
+def too_many_requests(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=e.reason,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+def queue_timeout_line(e: AdmissionRejected) -> str:
+    error = {"message": e.reason, "type": "queue_timeout", "retry_after": e.retry_after}
+    return f"data: {dumps({'error': error})}\n\ndata: [DONE]"
+
+
+@app.get("/v1/scheduler")
+@app.get("/scheduler")
+async def get_scheduler_stats(user: str = Depends(get_current_user)):
+    """
+    Returns the queue of each pipeline and the rate limit of each caller
+    """
+    return {
+        "pipelines": {
+            pipeline_id: queue.stats() for pipeline_id, queue in ADMISSION_QUEUES.items()
+        },
+        "rate_limits": RATE_LIMITER.stats(),
+    }
+
+
 @app.post("/v1/chat/completions")
 @app.post("/chat/completions")
-async def generate_openai_chat_completion(form_data: OpenAIChatCompletionForm):
+async def generate_openai_chat_completion(
+    request: Request, form_data: OpenAIChatCompletionForm
+):
+    started = time.perf_counter()
     messages = [message.model_dump() for message in form_data.messages]
     user_message = get_last_user_message(messages)
+    registry = REGISTRY
 
     if (
-        form_data.model not in app.state.PIPELINES
-        or app.state.PIPELINES[form_data.model]["type"] == "filter"
+        form_data.model not in registry.pipelines
+        or registry.pipelines[form_data.model]["type"] == "filter"
     ):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Pipeline {form_data.model} not found",
         )
 
-    def job():
-        print(form_data.model)
+    print(form_data.model)
 
-        pipeline = app.state.PIPELINES[form_data.model]
-        pipeline_id = form_data.model
+    pipeline = registry.pipelines[form_data.model]
+    pipeline_id = form_data.model
 
-        print(pipeline_id)
+    print(pipeline_id)
 
-        if pipeline["type"] == "manifold":
-            manifold_id, pipeline_id = pipeline_id.split(".", 1)
-            pipe = PIPELINE_MODULES[manifold_id].pipe
-        else:
-            pipe = PIPELINE_MODULES[pipeline_id].pipe
+    if pipeline["type"] == "manifold":
+        manifold_id, pipeline_id = pipeline_id.split(".", 1)
+        module_id = manifold_id
+    else:
+        module_id = pipeline_id
+    module = await ensure_loaded(registry.modules, module_id)
+    pipe = module.pipe
 
+    def job():
         if form_data.stream:
 
             def stream_content():
@@ -695,48 +1266,18 @@ async def generate_openai_chat_completion(form_data: OpenAIChatCompletionForm):
                 )
 
                 logging.info(f"stream:true:{res}")
+                encoder = StreamEncoder(form_data.model)
 
                 if isinstance(res, str):
-                    message = stream_message_template(form_data.model, res)
-                    logging.info(f"stream_content:str:{message}")
-                    yield f"data: {json.dumps(message)}\n\n"
+                    yield encoder.content(res)
 
                 if isinstance(res, Iterator):
-                    for line in res:
-                        if isinstance(line, BaseModel):
-                            line = line.model_dump_json()
-                            line = f"data: {line}"
-
-                        try:
-                            line = line.decode("utf-8")
-                        except:
-                            pass
-
-                        logging.info(f"stream_content:Generator:{line}")
-
-                        if line.startswith("data:"):
-                            yield f"{line}\n\n"
-                        else:
-                            line = stream_message_template(form_data.model, line)
-                            yield f"data: {json.dumps(line)}\n\n"
+                    lines = coalesce(res) if SSE_COALESCE_MS > 0 else res
+                    for line in lines:
+                        yield encoder.encode(line)
 
                 if isinstance(res, str) or isinstance(res, Generator):
-                    finish_message = {
-                        "id": f"{form_data.model}-{str(uuid.uuid4())}",
-                        "object": "chat.completion.chunk",
-                        "created": int(time.time()),
-                        "model": form_data.model,
-                        "choices": [
-                            {
-                                "index": 0,
-                                "delta": {},
-                                "logprobs": None,
-                                "finish_reason": "stop",
-                            }
-                        ],
-                    }
-
-                    yield f"data: {json.dumps(finish_message)}\n\n"
+                    yield encoder.finish
                     yield f"data: [DONE]"
 
             return StreamingResponse(stream_content(), media_type="text/event-stream")
@@ -756,31 +1297,175 @@ async def generate_openai_chat_completion(form_data: OpenAIChatCompletionForm):
             else:
 
                 message = ""
+                reasoning_content = ""
+                metadata = {}
 
                 if isinstance(res, str):
                     message = res
 
                 if isinstance(res, Generator):
                     for stream in res:
-                        message = f"{message}{stream}"
+                        message, reasoning_content, metadata = merge_stream_line(
+                            message, reasoning_content, metadata, stream
+                        )
 
                 logging.info(f"stream:false:{message}")
-                return {
-                    "id": f"{form_data.model}-{str(uuid.uuid4())}",
-                    "object": "chat.completion",
-                    "created": int(time.time()),
-                    "model": form_data.model,
-                    "choices": [
-                        {
-                            "index": 0,
-                            "message": {
-                                "role": "assistant",
-                                "content": message,
-                            },
-                            "logprobs": None,
-                            "finish_reason": "stop",
-                        }
-                    ],
-                }
+                return completion_message_template(
+                    form_data.model, message, reasoning_content, metadata
+                )
+
+    async def async_job():
+        async def call_pipe():
+            res = pipe(
+                user_message=user_message,
+                model_id=pipeline_id,
+                messages=messages,
+                body=form_data.model_dump(),
+            )
+            if inspect.isawaitable(res):
+                res = await res
+            return res
+
+        if form_data.stream:
+
+            async def stream_content():
+                res = await call_pipe()
+
+                logging.info(f"stream:true:{res}")
+                encoder = StreamEncoder(form_data.model)
+
+                if isinstance(res, str):
+                    yield encoder.content(res)
+
+                if isinstance(res, (AsyncIterator, Iterator)):
+                    lines = res
+                    if isinstance(res, Iterator):
+                        lines = iterate_in_threadpool(res)
+                    if SSE_COALESCE_MS > 0:
+                        lines = acoalesce(lines)
+                    async for line in lines:
+                        yield encoder.encode(line)
+
+                if isinstance(res, (str, Generator, AsyncGenerator)):
+                    yield encoder.finish
+                    yield f"data: [DONE]"
+
+            return StreamingResponse(stream_content(), media_type="text/event-stream")
+        else:
+            res = await call_pipe()
+            logging.info(f"stream:false:{res}")
+
+            if isinstance(res, dict):
+                return res
+            elif isinstance(res, BaseModel):
+                return res.model_dump()
+            else:
+
+                message = ""
+                reasoning_content = ""
+                metadata = {}
+
+                if isinstance(res, str):
+                    message = res
 
-    return await run_in_threadpool(job)
+                if isinstance(res, AsyncGenerator):
+                    async for stream in res:
+                        message, reasoning_content, metadata = merge_stream_line(
+                            message, reasoning_content, metadata, stream
+                        )
+                elif isinstance(res, Generator):
+                    async for stream in iterate_in_threadpool(res):
+                        message, reasoning_content, metadata = merge_stream_line(
+                            message, reasoning_content, metadata, stream
+                        )
+
+                logging.info(f"stream:false:{message}")
+                return completion_message_template(
+                    form_data.model, message, reasoning_content, metadata
+                )
+
+    async def run():
+        # Async pipes run on the event loop, so long conversations do not each hold a worker thread
+        if is_async_pipe(pipe):
+            return await async_job()
+        return await run_in_threadpool(job)
+
+    # Labels the metrics recorded by the pipeline's model calls, tools and queries
+    CURRENT_PIPELINE.set(form_data.model)
+    caller = caller_id(form_data.model_extra or {}, request.headers)
+    root = start_span(
+        "chat.completion",
+        pipeline=form_data.model,
+        stream=bool(form_data.stream),
+        caller=caller,
+    )
+    admission = get_admission_queue(module_id, module)
+    try:
+        RATE_LIMITER.check(caller)
+        ticket = admission.admit(caller)
+    except AdmissionRejected as e:
+        REQUESTS.inc(pipeline=form_data.model, status="rejected")
+        root.set_status("ERROR", e.reason)
+        root.end()
+        raise too_many_requests(e)
+    ticket.on_release(
+        lambda: QUEUE_WAIT.observe(
+            ticket.waited, pipeline=form_data.model, caller=caller_label(caller)
+        )
+    )
+    ticket.on_release(lambda: root.set_attribute("queue.wait_seconds", ticket.waited))
+    # A reload shuts this instance down only after the request is done
+    IN_FLIGHT.enter(module)
+    ticket.on_release(lambda: IN_FLIGHT.exit(module))
+
+    if form_data.stream:
+        # The pipe is only called once the body is iterated, so the wait can happen in the stream
+        try:
+            response = await run()
+        except BaseException as e:
+            ticket.release()
+            root.record_exception(e)
+            root.end()
+            raise
+        body = traced_stream("pipeline.pipe", root, response.body_iterator)
+        response.body_iterator = end_span_after(
+            root,
+            measure_stream(
+                form_data.model,
+                started,
+                stream_when_admitted(ticket, body, queue_timeout_line),
+            ),
+        )
+        return AdmittedStreamingResponse(response, ticket)
+
+    outcome = "error"
+    try:
+        await ticket.wait()
+        with use_span(root), span("pipeline.pipe"):
+            response = await run()
+        outcome = "ok"
+        return response
+    except AdmissionRejected as e:
+        outcome = "rejected"
+        raise too_many_requests(e)
+    finally:
+        ticket.release()
+        if outcome != "ok":
+            root.set_status("ERROR", outcome)
+        root.end()
+        REQUESTS.inc(pipeline=form_data.model, status=outcome)
+        REQUEST_DURATION.observe(
+            time.perf_counter() - started, pipeline=form_data.model, stream="false"
+        )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", "9099"))
+    if PIPELINES_WORKERS > 1:
+        # The pipelines are loaded once, before the workers are forked
+        serve(app, host, port, PIPELINES_WORKERS, preload=preload, forwarded_allow_ips="*")
+    else:
+        uvicorn.run(app, host=host, port=port, forwarded_allow_ips="*")
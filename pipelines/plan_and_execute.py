@@ -0,0 +1,35 @@
+"""
+title: Postgres Analyst (Plan and Execute)
+author: Seungmin Lee
+description: Postgres Analyst that plans one script per question
+required_open_webui_version: 0.6.5
+version: 0.1
+licence: MIT
+"""
+
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../langgraph_agents"))
+)
+
+from langgraph_agents.agents.plan_and_execute import create_plan_and_execute_builder
+from langgraph_agents.agents.pipeline import AgentPipeline
+
+
+class Pipeline(AgentPipeline):
+    """
+    Plan-and-execute Data Analyst pipeline.
+
+    Instead of a ReAct loop, the model writes one script for the whole question, which is run
+    once and then explained. A failed script is repaired a limited number of times. See
+    `AgentPipeline` for the valves and the streamed response.
+    """
+
+    def __init__(self):
+        super().__init__(
+            name="Postgres Analyst (Plan and Execute)",
+            thread_namespace="plan_and_execute",
+            create_builder=create_plan_and_execute_builder,
+        )
@@ -156,5 +156,10 @@ fi
 
 if [[ "$MODE" == "run" || "$MODE" == "full" ]]; then
   echo "Running via Mode: $MODE"
-  uv run uvicorn main:app --host "$HOST" --port "$PORT" --forwarded-allow-ips '*'
+  if [[ "${PIPELINES_WORKERS:-1}" -gt 1 ]]; then
+    # Loads the pipelines once, then forks the workers
+    HOST="$HOST" PORT="$PORT" uv run python main.py
+  else
+    uv run uvicorn main:app --host "$HOST" --port "$PORT" --forwarded-allow-ips '*'
+  fi
 fi
@@ -0,0 +1,224 @@
+import asyncio
+
+import pytest
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+
+from utils import metrics
+from utils.metrics import caller_label
+from utils.pipelines import admission
+from utils.pipelines.admission import (
+    AdmissionQueue,
+    AdmissionRejected,
+    AdmittedStreamingResponse,
+    RateLimiter,
+    TokenBucket,
+    stream_when_admitted,
+)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine())
+
+
+def queue(**kwargs):
+    options = dict(max_concurrency=1, max_queue=8, max_queue_wait=60, user_max_queue=4, weights={})
+    return AdmissionQueue("pipeline", **{**options, **kwargs})
+
+
+def test_waiting_requests_are_served_fairly_between_callers():
+    async def scenario():
+        pipeline = queue()
+        running = pipeline.admit("alice")
+        batch = [pipeline.admit("bob") for _ in range(3)]
+        question = pipeline.admit("carol")
+        assert [t.position() for t in batch + [question]] == [1, 3, 4, 1]
+
+        order = []
+        current = running
+        for _ in range(4):
+            current.release()
+            current = next(t for t in batch + [question] if t.granted and not t.released)
+            order.append("carol" if current is question else "bob")
+        return order
+
+    assert run(scenario) == ["bob", "carol", "bob", "bob"]
+
+
+def test_weights_give_a_caller_a_larger_share():
+    async def scenario():
+        pipeline = queue(weights={"batch": 4})
+        running = pipeline.admit("other")
+        batch = [pipeline.admit("batch") for _ in range(3)]
+        single = [pipeline.admit("single"), pipeline.admit("single")]
+        return [t.position() for t in batch + single]
+
+    assert run(scenario) == [1, 2, 3, 4, 5]
+
+
+def test_full_queues_reject_with_a_retry_hint():
+    async def scenario():
+        pipeline = queue(max_queue=2, user_max_queue=1)
+        pipeline.admit("alice")
+        pipeline.admit("bob")
+        with pytest.raises(AdmissionRejected) as caller_full:
+            pipeline.admit("bob")
+        pipeline.admit("carol")
+        with pytest.raises(AdmissionRejected) as queue_full:
+            pipeline.admit("dave")
+        return pipeline, caller_full.value, queue_full.value
+
+    pipeline, caller_full, queue_full = run(scenario)
+    assert caller_full.retry_after >= 1 and queue_full.retry_after >= 1
+    assert pipeline.stats()["rejected"] == 2
+
+
+def test_waiting_too_long_is_rejected():
+    async def scenario():
+        pipeline = queue(max_queue_wait=0.05)
+        pipeline.admit("alice")
+        ticket = pipeline.admit("bob")
+        with pytest.raises(AdmissionRejected):
+            await ticket.wait()
+        return pipeline
+
+    pipeline = run(scenario)
+    assert pipeline.stats()["timed_out"] == 1
+    assert pipeline.stats()["waiting"] == 0
+
+
+def test_idle_callers_are_dropped_but_keep_their_counters():
+    async def scenario():
+        pipeline = queue()
+        first = pipeline.admit("alice")
+        batch = [pipeline.admit("bob") for _ in range(3)]
+        question = pipeline.admit("carol")
+        first.release()
+        batch[0].release()
+        question.release()
+        # Carol is idle and was served before Bob's remaining requests
+        busy = set(pipeline.last_finish)
+        for ticket in batch[1:]:
+            ticket.release()
+        return pipeline, busy
+
+    pipeline, busy = run(scenario)
+    assert busy == {"bob"}
+    # Nothing runs or waits, so no caller affects the order of later requests
+    assert pipeline.last_finish == {}
+    stats = pipeline.stats()
+    assert stats["running"] == 0
+    assert {caller: s["admitted"] for caller, s in stats["callers"].items()} == {
+        "alice": 1,
+        "bob": 3,
+        "carol": 1,
+    }
+
+
+def test_outcomes_are_exported_by_hashed_caller():
+    async def scenario():
+        pipeline = queue(max_queue=1)
+        pipeline.admit("alice@example.com")
+        pipeline.admit("bob@example.com")
+        with pytest.raises(AdmissionRejected):
+            pipeline.admit("bob@example.com")
+
+    run(scenario)
+    lines = metrics.ADMISSIONS.collect()
+    alice, bob = caller_label("alice@example.com"), caller_label("bob@example.com")
+    assert "example.com" not in "\n".join(lines)
+    assert any(f'caller="{alice}",outcome="admitted"' in line for line in lines)
+    assert any(f'caller="{bob}",outcome="rejected"' in line for line in lines)
+
+
+def test_caller_labels_are_bounded(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_MAX_CALLERS", 0)
+    monkeypatch.setattr(metrics, "_caller_labels", {})
+    assert caller_label("someone-new") == "other"
+
+
+def test_token_bucket_allows_bursts_then_the_rate(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(rate=60, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() == pytest.approx(1.0)
+    now[0] = 1.0
+    assert bucket.take() == 0
+
+
+def test_rate_limiter_drops_refilled_buckets(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    limiter = RateLimiter(rate=60, burst=1)
+    limiter.check("alice")
+    with pytest.raises(AdmissionRejected):
+        limiter.check("alice")
+    assert limiter.stats()["alice"]["rate_limited"] == 1
+
+    now[0] = 10.0
+    limiter.check("bob")
+    assert set(limiter.buckets) == {"bob"}
+    assert limiter.stats()["alice"] == {"tokens": 1, "rate_limited": 1}
+
+
+def test_streaming_slot_is_released_when_the_body_is_never_iterated():
+    started = []
+
+    async def body():
+        started.append(True)
+        yield "data: {}\n\n"
+
+    async def send(message):
+        # The client went away before the response started
+        raise OSError("connection reset")
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def scenario():
+        pipeline = queue()
+        ticket = pipeline.admit("alice")
+        response = StreamingResponse(
+            stream_when_admitted(ticket, body(), str), media_type="text/event-stream"
+        )
+        with pytest.raises(ClientDisconnect):
+            await AdmittedStreamingResponse(response, ticket)(
+                {"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send
+            )
+        return pipeline, ticket
+
+    pipeline, ticket = run(scenario)
+    assert not started
+    assert ticket.released and pipeline.running == 0
+
+
+def test_streaming_response_keeps_its_headers_and_body():
+    sent = []
+
+    async def body():
+        yield "data: {}\n\n"
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        await asyncio.sleep(60)
+
+    async def scenario():
+        pipeline = queue()
+        ticket = pipeline.admit("alice")
+        response = StreamingResponse(
+            stream_when_admitted(ticket, body(), str),
+            media_type="text/event-stream",
+            headers={"x-request": "1"},
+        )
+        await AdmittedStreamingResponse(response, ticket)(
+            {"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send
+        )
+        return ticket
+
+    assert run(scenario).released
+    assert (b"x-request", b"1") in sent[0]["headers"]
+    assert [m.get("body") for m in sent[1:]] == [b"data: {}\n\n", b""]
@@ -0,0 +1,89 @@
+import os
+import threading
+
+import pytest
+from sqlalchemy import create_engine, text
+
+pytest.importorskip("duckdb")
+pytest.importorskip("pyarrow")
+
+from utils.agents import analytics
+from utils.agents.analytics import ParquetExtractStore
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE sales (region TEXT, amount REAL)"))
+        conn.execute(text("CREATE TABLE secrets (value TEXT)"))
+        conn.execute(text("INSERT INTO sales VALUES ('a', 1), ('a', 2), ('b', 5)"))
+        conn.execute(text("INSERT INTO secrets VALUES ('x')"))
+    return engine
+
+
+def store(engine, tmp_path, tables):
+    return ParquetExtractStore(
+        lambda: engine, directory=str(tmp_path / "extracts"), tables=tables, threads=1
+    )
+
+
+def test_queries_enabled_tables(engine, tmp_path):
+    result = store(engine, tmp_path, ["sales"]).query(
+        "SELECT region, SUM(amount) AS total FROM sales GROUP BY region ORDER BY region"
+    )
+    assert result.to_pydict() == {"region": ["a", "b"], "total": [3.0, 5.0]}
+
+
+def test_no_allowlist_means_no_extracts(engine, tmp_path):
+    extracts = store(engine, tmp_path, [])
+    with pytest.raises(ValueError, match="not enabled"):
+        extracts.snapshot("sales")
+    extracts.ensure_fresh(["sales"])
+    assert extracts.metadata("sales") is None
+
+
+def test_table_outside_allowlist_is_not_extracted(engine, tmp_path):
+    extracts = store(engine, tmp_path, ["sales"])
+    with pytest.raises(ValueError, match="not enabled"):
+        extracts.snapshot("secrets")
+    with pytest.raises(Exception):
+        extracts.query("SELECT * FROM secrets")
+
+
+def test_concurrent_callers_take_one_snapshot(engine, tmp_path):
+    extracts = store(engine, tmp_path, ["sales"])
+    snapshots = []
+    snapshot = extracts._snapshot
+
+    def counting_snapshot(table):
+        snapshots.append(table)
+        return snapshot(table)
+
+    extracts._snapshot = counting_snapshot
+    threads = [threading.Thread(target=extracts.ensure_fresh, args=(["sales"],)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert snapshots == ["sales"]
+
+
+def test_failed_snapshot_removes_partial_file(engine, tmp_path, monkeypatch):
+    extracts = store(engine, tmp_path, ["sales"])
+    monkeypatch.setattr(analytics, "SNAPSHOT_CHUNK_ROWS", 1)
+    writer_class = analytics.pq.ParquetWriter
+
+    class FailingWriter(writer_class):
+        writes = 0
+
+        def write_table(self, table, *args, **kwargs):
+            FailingWriter.writes += 1
+            if FailingWriter.writes > 1:
+                raise OSError("disk full")
+            return super().write_table(table, *args, **kwargs)
+
+    monkeypatch.setattr(analytics.pq, "ParquetWriter", FailingWriter)
+    with pytest.raises(OSError, match="disk full"):
+        extracts.snapshot("sales")
+    assert os.listdir(extracts.directory) == []
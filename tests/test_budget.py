@@ -0,0 +1,68 @@
+import asyncio
+
+from typing import Annotated, List
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph import END, StateGraph
+from langgraph.graph.message import add_messages
+from typing_extensions import TypedDict
+
+from utils.agents.budget import TurnBudget
+from utils.agents.streaming import astream_graph
+
+
+class State(TypedDict):
+    messages: Annotated[List, add_messages]
+    history_digest: str
+    budget: dict
+
+
+def tool_call(i: int) -> dict:
+    return {"name": "python_tool", "args": {"code": str(i)}, "id": f"call_{i}"}
+
+
+def test_parallel_tool_calls_are_limited_to_the_remaining_budget():
+    budget = TurnBudget(max_tool_calls=3)
+    usage = budget.usage([HumanMessage(content="question", id="1")], None)
+    usage["tool_calls"] = 1
+    response = AIMessage(content="", tool_calls=[tool_call(i) for i in range(5)])
+
+    usage = budget.limit_tool_calls(usage, response)
+    usage = budget.record(usage, 0, response)
+
+    assert [call["id"] for call in response.tool_calls] == ["call_0", "call_1"]
+    report = budget.report(usage)
+    assert report["tool_calls"] == 3 and report["dropped_tool_calls"] == 3
+
+
+def test_tool_calls_within_the_budget_are_kept():
+    budget = TurnBudget(max_tool_calls=0)
+    usage = budget.usage([], None)
+    response = AIMessage(content="", tool_calls=[tool_call(i) for i in range(5)])
+    assert budget.limit_tool_calls(usage, response) is usage
+    assert len(response.tool_calls) == 5
+
+
+def test_the_budget_report_is_streamed_to_the_client():
+    budget = TurnBudget()
+
+    def answer(state):
+        usage = budget.record(budget.usage(state["messages"], None), 10, None)
+        response = AIMessage(content="answer")
+        response.response_metadata["budget"] = budget.report(usage)
+        return {"messages": response, "budget": usage}
+
+    builder = StateGraph(State)
+    builder.add_node("answer", answer)
+    builder.set_entry_point("answer")
+    builder.add_edge("answer", END)
+    graph = builder.compile(checkpointer=InMemorySaver())
+
+    async def collect():
+        messages = [{"role": "user", "content": "question"}]
+        return [line async for line in astream_graph(graph, messages, {"chat_id": "chat"})]
+
+    lines = asyncio.run(collect())
+    assert lines[-1]["metadata"]["budget"]["llm_calls"] == 1
+    assert lines[-1]["metadata"]["budget"]["prompt_tokens"] == 10
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, ToolMessage
+
+from utils.agents import context
+from utils.agents.context import (
+    TOOL_OUTPUT_COMPACT_CHARS,
+    compact_tool_outputs,
+    create_context_node,
+    split_turns,
+)
+
+
+@pytest.fixture(autouse=True)
+def artifacts_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(context, "ARTIFACTS_DIR", str(tmp_path))
+
+
+class FakeLLM:
+    def invoke(self, messages, config=None):
+        return SimpleNamespace(content="summary")
+
+
+def tool_call(index: int, output: str):
+    call_id = f"call-{index}"
+    return [
+        AIMessage(
+            id=f"ai-{index}",
+            content="",
+            tool_calls=[{"id": call_id, "name": "python_tool", "args": {"code": "df"}}],
+        ),
+        ToolMessage(id=f"tool-{index}", tool_call_id=call_id, name="python_tool", content=output),
+    ]
+
+
+LONG_OUTPUT = "x" * (TOOL_OUTPUT_COMPACT_CHARS + 1)
+
+
+def test_compacts_older_tool_outputs_of_the_current_turn():
+    messages = [HumanMessage(id="user", content="question")]
+    for index in range(4):
+        messages += tool_call(index, LONG_OUTPUT)
+
+    replacements = compact_tool_outputs(split_turns(messages), keep_recent=2)
+
+    assert [m.id for m in replacements] == ["tool-0", "tool-1"]
+    assert all("load_artifact(" in m.content for m in replacements)
+
+
+def test_compacts_every_long_tool_output_of_earlier_turns():
+    messages = [HumanMessage(id="first", content="question")] + tool_call(0, LONG_OUTPUT)
+    messages += [HumanMessage(id="second", content="question")] + tool_call(1, LONG_OUTPUT)
+
+    replacements = compact_tool_outputs(split_turns(messages), keep_recent=1)
+
+    assert [m.id for m in replacements] == ["tool-0"]
+
+
+def test_system_prompt_counts_against_the_budget():
+    messages = [HumanMessage(id="first", content="question")] + tool_call(0, LONG_OUTPUT)
+    messages += [HumanMessage(id="second", content="question")]
+    message_tokens = context.count_tokens(messages)
+
+    node = create_context_node(FakeLLM(), max_tokens=message_tokens, keep_recent_tokens=10)
+    assert node.invoke({"messages": messages}) == {}
+
+    node = create_context_node(
+        FakeLLM(), max_tokens=message_tokens, keep_recent_tokens=10, system_prompt="p" * 400
+    )
+    update = node.invoke({"messages": messages})
+    assert [m.id for m in update["messages"]] == ["tool-0"]
+    assert "load_artifact(" in update["messages"][0].content
+
+
+def test_summarizes_old_turns_when_compaction_is_not_enough():
+    messages = [HumanMessage(id="first", content="q" * 400)] + tool_call(0, "short")
+    messages += [HumanMessage(id="second", content="question")]
+
+    node = create_context_node(FakeLLM(), max_tokens=100, keep_recent_tokens=10)
+    update = node.invoke({"messages": messages})
+
+    assert update["summary"] == "summary"
+    assert {m.id for m in update["messages"] if isinstance(m, RemoveMessage)} == {
+        "first",
+        "ai-0",
+        "tool-0",
+    }
@@ -0,0 +1,41 @@
+import os
+
+import pytest
+from langchain_core.messages import AIMessageChunk, HumanMessage
+
+from utils.agents import llm_cache
+from utils.agents.llm_cache import LLMResponseCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LLMResponseCache(path=str(tmp_path / "cache.sqlite"), ttl=None)
+
+
+def test_connects_on_first_use(cache, tmp_path):
+    assert not (tmp_path / "cache.sqlite").exists()
+    keys = cache.make_keys("model", "prefix", [HumanMessage(content="Hello  World")])
+    assert cache.get(keys) is None
+    assert (tmp_path / "cache.sqlite").exists()
+
+
+def test_replays_exact_and_normalized_hits(cache):
+    keys = cache.make_keys("model", "prefix", [HumanMessage(content="Hello World")])
+    cache.put(keys, [AIMessageChunk(content="Hi"), AIMessageChunk(content=" there")])
+
+    assert [c.content for c in cache.get(keys)] == ["Hi", " there"]
+    normalized = cache.make_keys("model", "prefix", [HumanMessage(content=" hello   world")])
+    assert [c.content for c in cache.get(normalized)] == ["Hi", " there"]
+    assert cache.stats()["hits"] == 1 and cache.stats()["normalized_hits"] == 1
+
+
+def test_each_process_opens_its_own_connection(cache, monkeypatch):
+    parent = cache._connect()
+    assert cache._connect() is parent
+
+    # As in a worker forked after the cache was created
+    pid = os.getpid()
+    monkeypatch.setattr(llm_cache.os, "getpid", lambda: pid + 1)
+    child = cache._connect()
+    assert child is not parent
+    assert cache.stats()["entries"] == 0
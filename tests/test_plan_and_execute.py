@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("langchain_ollama")
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+from langgraph_agents.agents import plan_and_execute
+from langgraph_agents.agents.benchmark import compare
+from utils.agents.budget import TurnBudget
+from utils.agents.llm_cache import LLMResponseCache
+
+PLAN = "Summing up.\n```python\n1 + 1\n```"
+
+
+def build(responses, **kwargs):
+    llm = GenericFakeChatModel(messages=iter(AIMessage(content=r) for r in responses))
+    return plan_and_execute.create_plan_and_execute_builder(
+        llm=llm, system_prompt="You are a test.", **kwargs
+    ).compile()
+
+
+def ask(graph, question="What is 1 + 1?"):
+    async def run():
+        return await graph.ainvoke({"messages": [("user", question)]})
+
+    return asyncio.run(run())
+
+
+def test_calls_count_against_the_turn_budget(monkeypatch):
+    monkeypatch.setattr(plan_and_execute, "LLM_CACHE", None)
+    state = ask(build([PLAN, "It is 2."]))
+
+    answer = state["messages"][-1]
+    assert answer.content == "It is 2."
+    assert state["budget"]["llm_calls"] == 2 and state["budget"]["tool_calls"] == 1
+    assert answer.response_metadata["budget"]["forced_final_answer"] is None
+    assert answer.response_metadata["llm_cache_hit"] is False
+
+
+def test_a_used_up_budget_answers_without_running_code(monkeypatch):
+    monkeypatch.setattr(plan_and_execute, "LLM_CACHE", None)
+    state = ask(build([PLAN], budget=TurnBudget(max_llm_calls=1)))
+
+    answer = state["messages"][-1]
+    assert not answer.tool_calls
+    assert answer.response_metadata["budget"]["forced_final_answer"] == "1 model calls"
+
+
+def test_calls_go_through_the_response_cache(monkeypatch, tmp_path):
+    cache = LLMResponseCache(path=str(tmp_path / "cache.sqlite"), ttl=None)
+    monkeypatch.setattr(plan_and_execute, "LLM_CACHE", cache)
+    ask(build([PLAN, "It is 2."]))
+    state = ask(build([]))
+
+    assert state["messages"][-1].content == "It is 2."
+    assert state["messages"][-1].response_metadata["llm_cache_hit"] is True
+
+
+def test_benchmark_runs_all_modes_by_default(monkeypatch):
+    seen = []
+
+    def builder(llm):
+        seen.append(llm)
+        raise RuntimeError("stop")
+
+    monkeypatch.setattr("langgraph_agents.agents.benchmark.MODES", {"only": builder})
+    with pytest.raises(RuntimeError):
+        asyncio.run(compare(questions=[]))
+    assert len(seen) == 1
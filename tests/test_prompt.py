@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utils.agents.context import count_tokens
+from utils.agents.prompt import PrefixCacheMonitor, PromptPrefix
+
+
+def response(eval_count=None, eval_duration=None):
+    return SimpleNamespace(
+        response_metadata={"prompt_eval_count": eval_count, "prompt_eval_duration": eval_duration}
+    )
+
+
+def test_reports_the_shared_prefix_estimate_and_ollama_counts_separately():
+    prefix = PromptPrefix("system prompt", [])
+    monitor = PrefixCacheMonitor()
+    first = prefix.assemble([HumanMessage(content="question")])
+    second = first + [AIMessage(content="answer"), HumanMessage(content="follow-up")]
+
+    report = monitor.observe("thread", prefix, first, response(100, 2e9))
+    assert report["shared_prefix_messages"] == 0
+    assert report["shared_prefix_tokens_estimate"] == 0
+
+    report = monitor.observe("thread", prefix, second, response(7, 1e8))
+    assert report["shared_prefix_messages"] == len(first)
+    assert report["shared_prefix_tokens_estimate"] == count_tokens(first)
+    assert report["prompt_eval_count"] == 7
+    assert report["prompt_eval_seconds"] == 0.1
+
+    stats = monitor.stats()
+    assert stats["calls"] == 2
+    assert stats["shared_tokens_estimate"] == count_tokens(first)
+    assert stats["evaluated_tokens"] == 107
+    assert stats["eval_seconds"] == 2.1
+
+
+def test_saving_is_computed_in_ollama_tokens_and_seconds():
+    prefix = PromptPrefix("system prompt " * 50, [])
+    monitor = PrefixCacheMonitor()
+    first = prefix.assemble([HumanMessage(content="question")])
+    second = first + [AIMessage(content="answer"), HumanMessage(content="follow-up")]
+
+    # The uncached first call: Ollama counts twice the local estimate, at 10ms per token
+    size = 2 * count_tokens(first)
+    report = monitor.observe("thread", prefix, first, response(size, size * 1e7))
+    assert report["cached_prompt_tokens"] == 0
+    assert report["prompt_eval_seconds_saved"] == 0
+
+    report = monitor.observe("thread", prefix, second, response(12, 12 * 1e7))
+    cached = 2 * count_tokens(second) - 12
+    assert report["cached_prompt_tokens"] == cached
+    assert report["prompt_eval_seconds_saved"] == round(cached * 0.01, 3)
+    assert monitor.stats()["cached_tokens"] == cached
+
+
+def test_saving_is_unknown_without_an_uncached_call():
+    prefix = PromptPrefix("system prompt", [])
+    monitor = PrefixCacheMonitor()
+    payload = prefix.assemble([HumanMessage(content="question")])
+
+    monitor.observe("thread", prefix, payload, response())
+    report = monitor.observe("thread", prefix, payload, response(3, 3e7))
+    assert report["cached_prompt_tokens"] is None
+    assert report["prompt_eval_seconds_saved"] is None
+
+
+def test_threads_are_tracked_separately():
+    prefix = PromptPrefix("system prompt", [])
+    monitor = PrefixCacheMonitor(max_threads=1)
+    payload = prefix.assemble([HumanMessage(content="question")])
+
+    monitor.observe("a", prefix, payload, response())
+    assert monitor.observe("b", prefix, payload, response())["shared_prefix_messages"] == 0
+    # "a" was evicted to keep one thread
+    assert monitor.observe("a", prefix, payload, response())["shared_prefix_messages"] == 0
+    assert monitor.observe("a", prefix, payload, response())["shared_prefix_messages"] == 2
@@ -0,0 +1,72 @@
+import time
+
+import pandas as pd
+
+from utils.agents.query_cache import QueryResultCache, normalize_sql, referenced_tables
+
+
+def test_normalize_sql_ignores_cosmetic_differences():
+    a = "SELECT  name\nFROM Companies -- all of them\nWHERE sector = 'Tech';"
+    b = "select name from companies where sector = 'Tech'"
+    assert normalize_sql(a) == normalize_sql(b)
+
+
+def test_normalize_sql_keeps_quoted_literals():
+    assert normalize_sql("SELECT 'A  B'") != normalize_sql("SELECT 'a b'")
+
+
+def test_referenced_tables():
+    sql = 'SELECT * FROM public.orders o JOIN "Customers" c ON o.cid = c.id'
+    assert referenced_tables(sql) == ["orders", "customers"]
+
+
+def test_key_depends_on_params_and_fingerprint():
+    key = QueryResultCache.make_key("select 1", {"a": 1}, "f1")
+    assert key == QueryResultCache.make_key("SELECT 1;", {"a": 1}, "f1")
+    assert key != QueryResultCache.make_key("select 1", {"a": 2}, "f1")
+    assert key != QueryResultCache.make_key("select 1", {"a": 1}, "f2")
+
+
+def test_hit_and_miss():
+    cache = QueryResultCache(max_bytes=1 << 20, default_ttl=None)
+    df = pd.DataFrame({"n": [1, 2]})
+    assert cache.get("select n from t", None, "f") is None
+    cache.put("select n from t", None, "f", df)
+    assert cache.get("SELECT n FROM t", None, "f") is df
+    assert cache.get("select n from t", None, "other") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_table_ttl_expires_entry():
+    cache = QueryResultCache(max_bytes=1 << 20, default_ttl=None, table_ttls={"t": 0.01})
+    cache.put("select * from t", None, "f", "value")
+    cache.put("select * from u", None, "f", "value")
+    time.sleep(0.02)
+    assert cache.get("select * from t", None, "f") is None
+    assert cache.get("select * from u", None, "f") == "value"
+
+
+def test_evicts_least_recently_used_over_budget():
+    cache = QueryResultCache(max_bytes=30, default_ttl=None)
+    cache.put("select 1", None, "f", "a" * 10)
+    cache.put("select 2", None, "f", "b" * 10)
+    cache.get("select 1", None, "f")
+    cache.put("select 3", None, "f", "c" * 10)
+    assert cache.get("select 2", None, "f") is None
+    assert cache.get("select 1", None, "f") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_by_table_and_fingerprint():
+    cache = QueryResultCache(max_bytes=1 << 20, default_ttl=None)
+    seen = []
+    cache.add_invalidation_hook(seen.append)
+    cache.put("select * from orders", None, "f1", 1)
+    cache.put("select * from customers", None, "f1", 2)
+    cache.put("select * from customers", None, "f2", 3)
+
+    assert cache.invalidate(["Orders"]) == 1
+    assert seen == [["orders"]]
+    assert cache.invalidate_fingerprint("f2") == 1
+    assert cache.get("select * from customers", None, "f2") == 3
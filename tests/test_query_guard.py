@@ -0,0 +1,64 @@
+from contextlib import nullcontext
+
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from utils.agents.query_guard import QueryRejected, check_plan, run_guarded_query
+
+
+def test_cheap_plan_runs_unchanged():
+    assert check_plan({"Total Cost": 10, "Plan Rows": 10}, max_cost=100, max_rows=100) is None
+
+
+def test_expensive_plan_is_rejected():
+    with pytest.raises(QueryRejected, match="estimated cost"):
+        check_plan({"Total Cost": 1000, "Plan Rows": 1}, max_cost=100, max_rows=100)
+
+
+def test_plan_with_too_many_rows_is_truncated_or_rejected():
+    plan = {"Total Cost": 10, "Plan Rows": 1000}
+    assert check_plan(plan, max_cost=100, max_rows=100, truncate_rows=50) == 50
+    with pytest.raises(QueryRejected, match="rows"):
+        check_plan(plan, max_cost=100, max_rows=100, truncate_rows=0)
+
+
+class PgError(Exception):
+    def __init__(self, pgcode):
+        super().__init__(pgcode)
+        self.pgcode = pgcode
+
+
+class FailingConnection:
+    """
+    Accepts the transaction settings and fails the EXPLAIN with a Postgres error code.
+    """
+
+    def __init__(self, pgcode):
+        self.pgcode = pgcode
+        self.statements = []
+
+    def begin(self):
+        return nullcontext()
+
+    def execute(self, statement, params=None):
+        self.statements.append(str(statement))
+        if str(statement).startswith("EXPLAIN"):
+            raise DBAPIError(str(statement), params, PgError(self.pgcode))
+
+
+def test_writes_are_rejected_by_the_read_only_transaction():
+    conn = FailingConnection("25006")
+    with pytest.raises(QueryRejected, match="read-only"):
+        run_guarded_query(conn, "DELETE FROM companies")
+    assert conn.statements[0] == "SET TRANSACTION READ ONLY"
+    assert conn.statements[1].startswith("SET LOCAL statement_timeout")
+
+
+def test_statement_timeout_is_reported_to_the_model():
+    with pytest.raises(QueryRejected, match="statement timeout"):
+        run_guarded_query(FailingConnection("57014"), "SELECT * FROM a, b", statement_timeout_ms=5)
+
+
+def test_other_database_errors_are_raised_unchanged():
+    with pytest.raises(DBAPIError):
+        run_guarded_query(FailingConnection("42P01"), "SELECT * FROM missing")
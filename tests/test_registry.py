@@ -0,0 +1,58 @@
+import asyncio
+
+from utils.agents.registry import GraphRegistry
+
+
+def run(coroutine):
+    return asyncio.run(coroutine())
+
+
+def test_activates_a_second_key_with_one_slot():
+    registry = GraphRegistry(lambda *key: ("graph",) + key, max_graphs=1)
+
+    async def scenario():
+        await registry.activate(("a",))
+        assert await registry.get(("b",)) == ("graph", "b")
+        assert await registry.activate(("b",)) == ("graph", "b")
+
+    run(scenario)
+    assert registry.active_key == ("b",)
+    assert registry.current() == ("graph", "b")
+
+
+def test_evicts_least_recently_used_but_not_active():
+    built = []
+
+    def build(*key):
+        built.append(key)
+        return key
+
+    registry = GraphRegistry(build, max_graphs=2)
+
+    async def scenario():
+        await registry.activate(("a",))
+        await registry.get(("b",))
+        await registry.get(("c",))
+        # "a" is active so "b" goes, a second "b" rebuilds it
+        await registry.get(("a",))
+        await registry.get(("b",))
+
+    run(scenario)
+    assert built == [("a",), ("b",), ("c",), ("b",)]
+    assert registry.current() == ("a",)
+
+
+def test_concurrent_gets_share_one_build():
+    built = []
+
+    def build(*key):
+        built.append(key)
+        return key
+
+    registry = GraphRegistry(build)
+
+    async def scenario():
+        return await asyncio.gather(*(registry.get(("a",)) for _ in range(5)))
+
+    assert run(scenario) == [("a",)] * 5
+    assert built == [("a",)]
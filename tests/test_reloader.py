@@ -0,0 +1,26 @@
+from pathlib import Path
+
+import pytest
+
+from utils.pipelines.reloader import can_be_lazy
+
+
+PIPELINES_DIR = Path(__file__).resolve().parent.parent / "pipelines"
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        'class Pipeline:\n    def __init__(self):\n        self.type = "filter"\n',
+        'class Pipeline:\n    def __init__(self):\n        self.type = "manifold"\n',
+        'class Pipeline:\n    def __init__(self):\n        self.id = "other_id"\n',
+        "class Pipeline:\n    async def inlet(self, body, user=None):  # a filter\n",
+    ],
+)
+def test_filters_manifolds_and_own_ids_are_not_lazy(source):
+    assert not can_be_lazy(source)
+
+
+def test_plain_pipes_can_be_lazy():
+    for path in PIPELINES_DIR.glob("*.py"):
+        assert can_be_lazy(path.read_text()), path.name
@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+from pydantic import BaseModel
+
+from utils.pipelines.main import stream_delta_template
+from utils.pipelines.sse import StreamEncoder, acoalesce, coalesce
+
+
+def parse(event: str) -> dict:
+    assert event.startswith("data: ") and event.endswith("\n\n")
+    return json.loads(event[len("data: ") : -2])
+
+
+def without_id(chunk: dict) -> dict:
+    return {key: value for key, value in chunk.items() if key not in ("id", "created")}
+
+
+def test_encodes_the_same_chunks_as_the_template():
+    encoder = StreamEncoder("model")
+    for line, delta in [
+        ('text with "quotes"\n and 한글', {"content": 'text with "quotes"\n and 한글'}),
+        ({"reasoning_content": "thinking"}, {"reasoning_content": "thinking"}),
+    ]:
+        chunk = parse(encoder.encode(line))
+        assert without_id(chunk) == without_id(stream_delta_template("model", delta))
+
+
+def test_chunks_of_a_response_share_the_envelope():
+    encoder = StreamEncoder("model")
+    first, second = parse(encoder.encode("a")), parse(encoder.encode("b"))
+    finish = parse(encoder.finish)
+    assert first["id"] == second["id"] == finish["id"]
+    assert finish["choices"][0] == {
+        "index": 0,
+        "delta": {},
+        "logprobs": None,
+        "finish_reason": "stop",
+    }
+
+
+def test_passes_ready_events_through():
+    class Event(BaseModel):
+        value: int
+
+    encoder = StreamEncoder("model")
+    assert encoder.encode('data: {"custom": 1}') == 'data: {"custom": 1}\n\n'
+    assert encoder.encode(b'data: {"custom": 1}') == 'data: {"custom": 1}\n\n'
+    assert encoder.encode(Event(value=1)) == 'data: {"value":1}\n\n'
+
+
+def test_metadata_is_sent_as_top_level_fields_without_choices():
+    encoder = StreamEncoder("model")
+    chunk = parse(encoder.encode({"metadata": {"budget": {"llm_calls": 2}}}))
+    assert chunk["id"] == parse(encoder.finish)["id"]
+    assert chunk["choices"] == [] and chunk["budget"] == {"llm_calls": 2}
+
+
+def test_coalesce_merges_text_of_the_same_field():
+    lines = ["a", "b", {"reasoning_content": "c"}, {"reasoning_content": "d"}, "e"]
+    assert list(coalesce(iter(lines), max_delay=float("inf"), max_chars=100)) == [
+        "ab",
+        {"reasoning_content": "cd"},
+        "e",
+    ]
+
+
+def test_coalesce_keeps_other_lines_in_order():
+    event = 'data: {"custom": 1}'
+    lines = ["a", event, "b", {"content": "c", "role": "assistant"}]
+    assert list(coalesce(iter(lines), max_delay=float("inf"), max_chars=100)) == [
+        "a",
+        event,
+        "b",
+        {"content": "c", "role": "assistant"},
+    ]
+
+
+def test_coalesce_sends_once_max_chars_is_reached():
+    lines = ["ab", "cd", "ef", "g"]
+    assert list(coalesce(iter(lines), max_delay=float("inf"), max_chars=4)) == ["abcd", "efg"]
+
+
+def test_coalesce_without_delay_sends_every_line():
+    assert list(coalesce(iter(["a", "b"]), max_delay=0, max_chars=100)) == ["a", "b"]
+
+
+def test_acoalesce_sends_buffered_text_while_the_pipe_waits():
+    received = []
+
+    async def pipe():
+        yield "a"
+        yield "b"
+        await asyncio.sleep(0.2)
+        yield "c"
+
+    async def run():
+        async for line in acoalesce(pipe(), max_delay=0.05, max_chars=100):
+            received.append(line)
+
+    asyncio.run(run())
+    assert received == ["ab", "c"]
@@ -0,0 +1,52 @@
+import pytest
+
+from utils.agents.main import ThinkTagFilter, remove_think_tags
+
+
+RESPONSE = "<think>Let me check the table.\nThe < sign matters.</think>The answer is 3 < 4."
+
+
+def run(chunks):
+    think_filter = ThinkTagFilter()
+    content, reasoning = "", ""
+    for chunk in chunks:
+        text, thought = think_filter.feed(chunk)
+        content += text
+        reasoning += thought
+    text, thought = think_filter.flush()
+    return content + text, reasoning + thought
+
+
+def test_splits_a_whole_response():
+    assert run([RESPONSE]) == (
+        "The answer is 3 < 4.",
+        "Let me check the table.\nThe < sign matters.",
+    )
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5, 7, 8])
+def test_chunk_boundaries_do_not_matter(size):
+    chunks = [RESPONSE[i : i + size] for i in range(0, len(RESPONSE), size)]
+    assert run(chunks) == run([RESPONSE])
+
+
+def test_matches_remove_think_tags():
+    assert run([RESPONSE])[0] == remove_think_tags(RESPONSE)
+
+
+def test_holds_back_only_a_possible_tag():
+    think_filter = ThinkTagFilter()
+    assert think_filter.feed("Answer <thi") == ("Answer ", "")
+    assert think_filter.pending == "<thi"
+    # The next chunk rules the tag out, so the held back text is released as answer
+    assert think_filter.feed("s>") == ("<this>", "")
+
+
+def test_flush_returns_an_unfinished_tag_in_its_section():
+    think_filter = ThinkTagFilter()
+    think_filter.feed("<think>reasoning </thi")
+    assert think_filter.flush() == ("", "</thi")
+
+    think_filter = ThinkTagFilter()
+    think_filter.feed("answer <")
+    assert think_filter.flush() == ("<", "")
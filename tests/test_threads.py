@@ -0,0 +1,17 @@
+import pytest
+
+pytest.importorskip("langgraph.checkpoint.sqlite")
+
+from utils.agents.threads import get_thread_id
+
+
+def test_thread_ids_are_namespaced_per_pipeline():
+    assert get_thread_id("chat", "data_analyst") == "data_analyst:chat"
+    assert get_thread_id("chat", "data_analyst") != get_thread_id("chat", "plan_and_execute")
+    assert get_thread_id("chat") == "chat"
+
+
+def test_chats_without_id_get_throwaway_threads():
+    first, second = get_thread_id(None, "data_analyst"), get_thread_id(None, "data_analyst")
+    assert first.startswith("ephemeral-")
+    assert first != second
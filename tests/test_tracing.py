@@ -0,0 +1,68 @@
+import contextvars
+import json
+import time
+import uuid
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from utils import tracing
+from utils.agents.instrumentation import TracingCallback
+from utils.tracing import CURRENT_SPAN, Tracer, span
+
+
+@pytest.fixture
+def spans(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACER", Tracer("jsonl", str(tmp_path)))
+
+    def read():
+        path = tmp_path / "spans.jsonl"
+        for _ in range(100):
+            if path.exists():
+                break
+            time.sleep(0.01)
+        time.sleep(0.05)
+        return {s["name"]: s for s in map(json.loads, path.read_text().splitlines())}
+
+    return read
+
+
+def test_span_nests_and_restores_the_current_span(spans):
+    with span("parent") as parent:
+        with span("child"):
+            assert CURRENT_SPAN.get().name == "child"
+        assert CURRENT_SPAN.get() is parent
+    assert CURRENT_SPAN.get() is None
+
+    recorded = spans()
+    assert recorded["child"]["parentSpanId"] == recorded["parent"]["spanId"]
+
+
+def test_callback_restores_the_current_span_after_a_run(spans):
+    with span("request") as request:
+        callback = TracingCallback()
+        graph, node = uuid.uuid4(), uuid.uuid4()
+        callback.on_chain_start({}, {}, run_id=graph, name="graph")
+        assert CURRENT_SPAN.get().name == "graph"
+
+        # Nodes run in a copied context, which is dropped when they end
+        def run_node():
+            callback.on_chain_start(
+                {},
+                {},
+                run_id=node,
+                parent_run_id=graph,
+                name="agent",
+                metadata={"langgraph_node": "agent"},
+            )
+            assert CURRENT_SPAN.get().name == "node agent"
+
+        contextvars.copy_context().run(run_node)
+        callback.on_chain_end({}, run_id=node)
+        callback.on_chain_end({}, run_id=graph)
+        assert CURRENT_SPAN.get() is request
+
+    recorded = spans()
+    assert recorded["node agent"]["parentSpanId"] == recorded["graph"]["spanId"]
+    assert recorded["graph"]["parentSpanId"] == recorded["request"]["spanId"]
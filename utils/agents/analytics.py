@@ -0,0 +1,348 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from utils.agents.query_cache import referenced_tables
+from utils.agents.query_guard import guarded_transaction
+from utils.metrics import DB_QUERY_DURATION
+from utils.tracing import span
+
+try:
+    import duckdb
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    duckdb = None
+    print("duckdb or pyarrow not installed, analytics engine disabled...")
+
+
+ANALYTICS_EXTRACTS_DIR = os.getenv("ANALYTICS_EXTRACTS_DIR", "./.extracts")
+# Extracts older than this (in seconds) are refreshed before they are queried
+ANALYTICS_MAX_EXTRACT_AGE = float(os.getenv("ANALYTICS_MAX_EXTRACT_AGE", "86400"))
+# Comma-separated tables that may be extracted. An extract reads the whole table, so none are
+# extracted unless they are listed here.
+ANALYTICS_TABLES = [
+    t.strip() for t in os.getenv("ANALYTICS_TABLES", "").split(",") if t.strip()
+]
+# Statement timeout of the read-only transaction that copies a table into an extract, on Postgres
+ANALYTICS_SNAPSHOT_TIMEOUT_MS = int(os.getenv("ANALYTICS_SNAPSHOT_TIMEOUT_MS", "600000"))
+ANALYTICS_THREADS = int(os.getenv("ANALYTICS_THREADS", str(os.cpu_count() or 1)))
+SNAPSHOT_CHUNK_ROWS = 100_000
+
+
+def is_available() -> bool:
+    return duckdb is not None
+
+
+def is_enabled() -> bool:
+    """
+    Whether analytics_query can be offered: duckdb is installed and tables are enabled for extracts.
+    """
+    return is_available() and bool(ANALYTICS_TABLES)
+
+
+class ParquetExtractStore:
+    """
+    Local Parquet snapshots of database tables, queried with DuckDB.
+
+    Each extract is written next to a metadata file that records when it was taken,
+    so callers can tell how stale the data they are aggregating is.
+    """
+
+    def __init__(
+        self,
+        engine_factory,
+        directory: str = ANALYTICS_EXTRACTS_DIR,
+        max_age: float = ANALYTICS_MAX_EXTRACT_AGE,
+        tables: Optional[List[str]] = None,
+        threads: int = ANALYTICS_THREADS,
+    ):
+        if not is_available():
+            raise ImportError("The analytics engine requires duckdb and pyarrow.")
+
+        self.engine_factory = engine_factory
+        self.directory = directory
+        self.max_age = max_age
+        self.tables = tables if tables is not None else ANALYTICS_TABLES
+        self.threads = threads
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, table: str):
+        base = os.path.join(self.directory, table)
+        return f"{base}.parquet", f"{base}.json"
+
+    def _lock_for(self, table: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(table, threading.Lock())
+
+    def metadata(self, table: str) -> Optional[dict]:
+        _, meta_path = self._paths(table)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r") as f:
+            return json.load(f)
+
+    def is_fresh(self, table: str) -> bool:
+        meta = self.metadata(table)
+        return meta is not None and time.time() - meta["created_at"] <= self.max_age
+
+    def snapshot(self, table: str) -> dict:
+        """
+        Copies a table into a Parquet extract, streaming it in chunks to bound memory use.
+
+        On Postgres the copy runs in a read-only transaction with ANALYTICS_SNAPSHOT_TIMEOUT_MS
+        as its statement timeout.
+        """
+        with self._lock_for(table):
+            return self._snapshot(table)
+
+    def _snapshot(self, table: str) -> dict:
+        if table not in self.tables:
+            raise ValueError(
+                f"Table {table} is not enabled for extracts. "
+                f"Enabled tables: {', '.join(self.tables) or 'none (set ANALYTICS_TABLES)'}"
+            )
+
+        import pandas as pd
+
+        parquet_path, meta_path = self._paths(table)
+        tmp_path = f"{parquet_path}.tmp"
+        start = time.monotonic()
+        rows = 0
+        writer = None
+
+        engine = self.engine_factory()
+        quoted = engine.dialect.identifier_preparer.quote(table)
+        try:
+            with engine.connect() as conn:
+                conn = conn.execution_options(stream_results=True)
+                if engine.dialect.name == "postgresql":
+                    transaction = guarded_transaction(conn, ANALYTICS_SNAPSHOT_TIMEOUT_MS)
+                else:
+                    transaction = conn.begin()
+                with transaction:
+                    for chunk in pd.read_sql_query(
+                        text(f"SELECT * FROM {quoted}"),
+                        conn,
+                        chunksize=SNAPSHOT_CHUNK_ROWS,
+                    ):
+                        batch = pa.Table.from_pandas(chunk, preserve_index=False)
+                        if writer is None:
+                            writer = pq.ParquetWriter(tmp_path, batch.schema)
+                        elif batch.schema != writer.schema:
+                            batch = batch.cast(writer.schema)
+                        writer.write_table(batch)
+                        rows += len(chunk)
+            if writer is None:
+                raise ValueError(f"Table {table} is empty, nothing to extract.")
+            writer.close()
+            writer = None
+            os.replace(tmp_path, parquet_path)
+        finally:
+            if writer is not None:
+                writer.close()
+            # Left behind only if the copy failed
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+        meta = {
+            "table": table,
+            "created_at": time.time(),
+            "rows": rows,
+            "bytes": os.path.getsize(parquet_path),
+            "duration": time.monotonic() - start,
+        }
+        with open(meta_path, "w") as f:
+            json.dump(meta, f)
+
+        logging.info(f"analytics:snapshot {meta}")
+        return meta
+
+    def ensure_fresh(self, tables: List[str]):
+        for table in tables:
+            if self.is_fresh(table):
+                continue
+            with self._lock_for(table):
+                # Another caller may have taken the snapshot while this one waited
+                if self.is_fresh(table):
+                    continue
+                try:
+                    self._snapshot(table)
+                except Exception as e:
+                    # Names from FROM clauses can also be CTEs or table functions
+                    logging.warning(f"analytics:snapshot {table} skipped: {e}")
+
+    def freshness(self) -> Dict[str, dict]:
+        """
+        Returns, for every extract, when it was taken, how old it is and how many rows it holds.
+        """
+        result = {}
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(".json"):
+                continue
+            meta = self.metadata(filename[:-5])
+            if meta is None:
+                continue
+            result[meta["table"]] = {
+                "created_at": datetime.fromtimestamp(
+                    meta["created_at"], tz=timezone.utc
+                ).isoformat(),
+                "age_seconds": round(time.time() - meta["created_at"], 1),
+                "rows": meta["rows"],
+            }
+        return result
+
+    def connect(self):
+        """
+        Opens an in-memory DuckDB connection with a view over every extract.
+        """
+        conn = duckdb.connect(config={"threads": self.threads})
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".parquet"):
+                table = filename[: -len(".parquet")]
+                path = os.path.join(self.directory, filename).replace("'", "''")
+                conn.execute(
+                    f"CREATE VIEW \"{table}\" AS SELECT * FROM read_parquet('{path}')"
+                )
+        return conn
+
+    def query(self, sql: str, params: Optional[list] = None):
+        """
+        Runs SQL over the extracts and returns a pyarrow Table.
+
+        Tables referenced by the query are extracted first if they are missing or stale.
+        """
+        tables = [t for t in referenced_tables(sql) if t in self.tables]
+        self.ensure_fresh(tables)
+
+        conn = self.connect()
+        try:
+            result = conn.execute(sql, params or []).fetch_arrow_table()
+        finally:
+            conn.close()
+
+        freshness = self.freshness()
+        result = result.replace_schema_metadata(
+            {
+                "freshness": json.dumps(
+                    {t: freshness.get(t, {}).get("age_seconds") for t in tables}
+                )
+            }
+        )
+        return result
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> ParquetExtractStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                from utils.agents.query import get_engine
+
+                _store = ParquetExtractStore(get_engine)
+    return _store
+
+
+def analytics_query(sql: str, params: Optional[list] = None):
+    """
+    Runs an aggregation SQL query with DuckDB over local Parquet extracts of the database tables
+    and returns a pyarrow Table (call `.to_pandas()` for a DataFrame).
+
+    Much faster than pandas for large group-by and join workloads. The data may be up to
+    ANALYTICS_MAX_EXTRACT_AGE seconds old; check `extract_freshness()` when recency matters.
+
+    :param sql: DuckDB SQL referencing tables by name. Use ? for parameters.
+    :param params: Positional parameter values.
+    :return: The result as a pyarrow Table.
+    """
+    start = time.perf_counter()
+    try:
+        with span("analytics_query", **{"db.system": "duckdb"}):
+            return get_store().query(sql, params)
+    finally:
+        DB_QUERY_DURATION.observe(time.perf_counter() - start, backend="duckdb", cache="extract")
+
+
+def extract_freshness() -> Dict[str, dict]:
+    """
+    Returns how old each local extract is, keyed by table name.
+    """
+    return get_store().freshness()
+
+
+def benchmark(rows: int = 5_000_000, groups: int = 1_000, repeat: int = 3):
+    """
+    Compares a group-by/join aggregation in pandas against DuckDB over a Parquet extract.
+    """
+    import tempfile
+
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    facts = pd.DataFrame(
+        {
+            "sector_id": rng.integers(0, groups, rows),
+            "amount": rng.random(rows) * 1000,
+            "year": rng.integers(2015, 2025, rows),
+        }
+    )
+    sectors = pd.DataFrame(
+        {"sector_id": np.arange(groups), "sector": [f"s{i}" for i in range(groups)]}
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        facts_path = os.path.join(directory, "facts.parquet")
+        sectors_path = os.path.join(directory, "sectors.parquet")
+        facts.to_parquet(facts_path)
+        sectors.to_parquet(sectors_path)
+
+        def run_pandas():
+            df = pd.read_parquet(facts_path).merge(
+                pd.read_parquet(sectors_path), on="sector_id"
+            )
+            return df.groupby(["sector", "year"])["amount"].agg(["sum", "mean", "count"])
+
+        def run_duckdb():
+            conn = duckdb.connect(config={"threads": ANALYTICS_THREADS})
+            try:
+                return conn.execute(
+                    f"""
+                    SELECT s.sector, f.year, SUM(f.amount), AVG(f.amount), COUNT(*)
+                    FROM read_parquet('{facts_path}') f
+                    JOIN read_parquet('{sectors_path}') s USING (sector_id)
+                    GROUP BY s.sector, f.year
+                    """
+                ).fetch_arrow_table()
+            finally:
+                conn.close()
+
+        results = {}
+        for name, fn in (("pandas", run_pandas), ("duckdb", run_duckdb)):
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn()
+                timings.append(time.perf_counter() - start)
+            results[name] = min(timings)
+
+    return results
+
+
+if __name__ == "__main__":
+    results = benchmark()
+    for name, seconds in results.items():
+        print(f"{name}: {seconds:.3f}s")
+    print(f"speedup: {results['pandas'] / results['duckdb']:.1f}x")
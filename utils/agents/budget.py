@@ -0,0 +1,134 @@
+import os
+import time
+from typing import List, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+
+# Limits of one user turn, i.e. everything the agent does to answer one message. 0 disables a limit.
+TURN_MAX_LLM_CALLS = int(os.getenv("TURN_MAX_LLM_CALLS", "10"))
+TURN_MAX_TOOL_CALLS = int(os.getenv("TURN_MAX_TOOL_CALLS", "12"))
+TURN_DEADLINE_SECONDS = float(os.getenv("TURN_DEADLINE_SECONDS", "600"))
+TURN_MAX_PROMPT_TOKENS = int(os.getenv("TURN_MAX_PROMPT_TOKENS", "300000"))
+# Share of the deadline after which the agent is asked to answer, leaving time for the answer
+TURN_DEADLINE_RESERVE = float(os.getenv("TURN_DEADLINE_RESERVE", "0.2"))
+
+FINAL_ANSWER_PROMPT = """The budget for this question is used up ({reason}). Do not call any more tools.
+Answer the user now with the results you already have, and say briefly what is still unverified."""
+
+
+class TurnBudget:
+    """
+    Limits on the ReAct loop for one user turn: LLM calls, tool calls, wall-clock time and
+    prompt tokens.
+
+    The usage is kept in the graph state and starts over with each new user message. When the
+    next LLM call would be the last one the budget allows, the agent is asked for a final answer
+    without tools instead of being cut off by the recursion limit. Parallel tool calls of one
+    response beyond the remaining tool calls are dropped before they run.
+    """
+
+    def __init__(
+        self,
+        max_llm_calls: int = TURN_MAX_LLM_CALLS,
+        max_tool_calls: int = TURN_MAX_TOOL_CALLS,
+        deadline_seconds: float = TURN_DEADLINE_SECONDS,
+        max_prompt_tokens: int = TURN_MAX_PROMPT_TOKENS,
+        deadline_reserve: float = TURN_DEADLINE_RESERVE,
+    ):
+        self.max_llm_calls = max_llm_calls
+        self.max_tool_calls = max_tool_calls
+        self.deadline_seconds = deadline_seconds
+        self.max_prompt_tokens = max_prompt_tokens
+        self.deadline_reserve = deadline_reserve
+
+    def usage(self, messages: List[BaseMessage], usage: Optional[dict]) -> dict:
+        """
+        Returns the usage of the current turn, starting a new one if a user message arrived since.
+        """
+        turn = next(
+            (m.id for m in reversed(messages) if isinstance(m, HumanMessage)), None
+        )
+        if usage and usage.get("turn") == turn:
+            return dict(usage)
+        return {
+            "turn": turn,
+            "started_at": time.time(),
+            "llm_calls": 0,
+            "tool_calls": 0,
+            "dropped_tool_calls": 0,
+            "prompt_tokens": 0,
+        }
+
+    def exhausted(self, usage: dict, prompt_tokens: int) -> Optional[str]:
+        """
+        Returns why the next LLM call has to give the final answer, or None if it may use tools.
+
+        :param usage: The usage of the current turn, before the next call.
+        :param prompt_tokens: Prompt tokens of the next call.
+        """
+        if self.max_llm_calls and usage["llm_calls"] + 1 >= self.max_llm_calls:
+            return f"{self.max_llm_calls} model calls"
+        if self.max_tool_calls and usage["tool_calls"] >= self.max_tool_calls:
+            return f"{self.max_tool_calls} tool calls"
+        if self.deadline_seconds:
+            elapsed = time.time() - usage["started_at"]
+            if elapsed >= self.deadline_seconds * (1 - self.deadline_reserve):
+                return f"{self.deadline_seconds:.0f} seconds"
+        if (
+            self.max_prompt_tokens
+            and usage["prompt_tokens"] + 2 * prompt_tokens > self.max_prompt_tokens
+        ):
+            # A tool round trip would need at least one more prompt of about the same size
+            return f"{self.max_prompt_tokens} prompt tokens"
+        return None
+
+    def final_answer_tail(self, reason: str) -> List[BaseMessage]:
+        """
+        The instruction appended after the conversation for the forced final answer.
+        """
+        return [SystemMessage(content=FINAL_ANSWER_PROMPT.format(reason=reason))]
+
+    def limit_tool_calls(self, usage: dict, response) -> dict:
+        """
+        Drops the tool calls of a response beyond the remaining tool calls. All tool calls of one
+        response run in the same tools step, so they are limited before it rather than after.
+
+        :return: The usage with the dropped calls counted.
+        """
+        tool_calls = getattr(response, "tool_calls", None) or []
+        remaining = max(self.max_tool_calls - usage["tool_calls"], 0)
+        if not self.max_tool_calls or len(tool_calls) <= remaining:
+            return usage
+        response.tool_calls = tool_calls[:remaining]
+        usage = dict(usage)
+        dropped = len(tool_calls) - remaining
+        usage["dropped_tool_calls"] = usage.get("dropped_tool_calls", 0) + dropped
+        return usage
+
+    def record(self, usage: dict, prompt_tokens: int, response) -> dict:
+        """
+        Adds an LLM call and the tool calls it requested to the usage.
+        """
+        usage = dict(usage)
+        usage["llm_calls"] += 1
+        usage["prompt_tokens"] += prompt_tokens
+        usage["tool_calls"] += len(getattr(response, "tool_calls", None) or [])
+        return usage
+
+    def report(self, usage: dict, forced_reason: Optional[str] = None) -> dict:
+        """
+        Summarizes the usage against the limits, for the response metadata and the client.
+        """
+        return {
+            "llm_calls": usage["llm_calls"],
+            "max_llm_calls": self.max_llm_calls,
+            "tool_calls": usage["tool_calls"],
+            "max_tool_calls": self.max_tool_calls,
+            "dropped_tool_calls": usage.get("dropped_tool_calls", 0),
+            "elapsed_seconds": round(time.time() - usage["started_at"], 3),
+            "deadline_seconds": self.deadline_seconds,
+            "prompt_tokens": usage["prompt_tokens"],
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "forced_final_answer": forced_reason,
+        }
@@ -0,0 +1,252 @@
+import hashlib
+import logging
+import os
+from typing import Callable, List, Optional
+
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    ToolMessage,
+)
+from langchain_core.runnables import RunnableLambda
+
+
+# Prompt token budget for the system prompt, the running summary and the message window
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "24000"))
+# Tokens of recent turns kept verbatim when older turns are summarized
+CONTEXT_KEEP_RECENT_TOKENS = int(os.getenv("CONTEXT_KEEP_RECENT_TOKENS", "8000"))
+# Tool outputs longer than this are replaced by an excerpt and an artifact handle, except the
+# latest CONTEXT_KEEP_TOOL_OUTPUTS outputs of the current turn
+TOOL_OUTPUT_COMPACT_CHARS = int(os.getenv("TOOL_OUTPUT_COMPACT_CHARS", "2000"))
+CONTEXT_KEEP_TOOL_OUTPUTS = int(os.getenv("CONTEXT_KEEP_TOOL_OUTPUTS", "2"))
+TOOL_OUTPUT_EXCERPT_CHARS = TOOL_OUTPUT_COMPACT_CHARS // 4
+ARTIFACTS_DIR = os.getenv("ARTIFACTS_DIR", "./.artifacts")
+
+SUMMARY_PROMPT = """You maintain a running summary of a data analysis conversation.
+Merge the previous summary and the new conversation excerpt into one concise summary.
+Keep the user's goals, tables and columns used, important numbers and findings, and open questions.
+Drop code and raw tool output. Answer with the summary only, in the language of the conversation."""
+
+
+def approximate_tokens(text: str) -> int:
+    """
+    Estimates the token count of a text without a tokenizer.
+
+    ASCII text averages about four characters per token, while Hangul and other non-ASCII
+    characters mostly take a token each.
+    """
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _message_text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, list):
+        content = "".join(
+            item.get("text", "") if isinstance(item, dict) else str(item)
+            for item in content
+        )
+    if isinstance(message, AIMessage) and message.tool_calls:
+        content += "".join(str(tool_call["args"]) for tool_call in message.tool_calls)
+    return content
+
+
+def count_tokens(
+    messages: List[BaseMessage], tokenizer: Optional[Callable[[str], int]] = None
+) -> int:
+    """
+    Counts the prompt tokens of a message list with the given tokenizer or the fast approximation.
+    """
+    tokenizer = tokenizer or approximate_tokens
+    # A few tokens of chat template overhead per message
+    return sum(tokenizer(_message_text(m)) + 4 for m in messages)
+
+
+def save_artifact(content: str) -> str:
+    """
+    Stores a tool output on disk and returns a handle for `load_artifact`.
+    """
+    handle = hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+    os.makedirs(ARTIFACTS_DIR, exist_ok=True)
+    path = os.path.join(ARTIFACTS_DIR, f"{handle}.txt")
+    if not os.path.exists(path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+    return handle
+
+
+def load_artifact(handle: str) -> str:
+    """
+    Returns the full text of an earlier tool output that was shortened in the conversation.
+
+    :param handle: The artifact handle shown in the shortened tool output.
+    :return: The original tool output.
+    """
+    path = os.path.join(ARTIFACTS_DIR, f"{os.path.basename(handle)}.txt")
+    if not os.path.exists(path):
+        raise ValueError(f"Artifact {handle} not found.")
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def split_turns(messages: List[BaseMessage]) -> List[List[BaseMessage]]:
+    """
+    Splits messages into turns, each starting at a user message, so tool calls stay with their outputs.
+    """
+    turns = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def compact_tool_outputs(
+    turns: List[List[BaseMessage]], keep_recent: int = CONTEXT_KEEP_TOOL_OUTPUTS
+) -> List[ToolMessage]:
+    """
+    Returns shortened replacements for long tool outputs, except the latest `keep_recent` tool
+    outputs of the last turn, which the model is most likely still working with.
+    The full output is kept as an artifact the model can load again.
+    """
+    tool_messages = [
+        [m for m in turn if isinstance(m, ToolMessage) and isinstance(m.content, str)]
+        for turn in turns
+    ]
+    if tool_messages and keep_recent > 0:
+        tool_messages[-1] = tool_messages[-1][:-keep_recent]
+
+    replacements = []
+    for turn in tool_messages:
+        for message in turn:
+            if len(message.content) <= TOOL_OUTPUT_COMPACT_CHARS:
+                continue
+            handle = save_artifact(message.content)
+            replacements.append(
+                ToolMessage(
+                    id=message.id,
+                    tool_call_id=message.tool_call_id,
+                    name=message.name,
+                    content=(
+                        message.content[:TOOL_OUTPUT_EXCERPT_CHARS]
+                        + f"\n...[{len(message.content)} characters shortened, "
+                        f'full output: load_artifact("{handle}")]'
+                    ),
+                )
+            )
+    return replacements
+
+
+def _summary_prompt(summary: str, messages: List[BaseMessage]) -> List[BaseMessage]:
+    transcript = "\n".join(
+        f"{m.type}: {_message_text(m)[:TOOL_OUTPUT_COMPACT_CHARS]}" for m in messages
+    )
+    return [
+        SystemMessage(content=SUMMARY_PROMPT),
+        HumanMessage(
+            content=f"Previous summary:\n{summary or '(none)'}\n\nNew excerpt:\n{transcript}"
+        ),
+    ]
+
+
+# Summaries are internal, keep them out of the token stream sent to the user
+SUMMARY_CONFIG = {"tags": ["nostream"]}
+
+
+def summarize(llm, summary: str, messages: List[BaseMessage]) -> str:
+    return llm.invoke(_summary_prompt(summary, messages), config=SUMMARY_CONFIG).content
+
+
+async def asummarize(llm, summary: str, messages: List[BaseMessage]) -> str:
+    response = await llm.ainvoke(_summary_prompt(summary, messages), config=SUMMARY_CONFIG)
+    return response.content
+
+
+def create_context_node(
+    llm,
+    max_tokens: int = CONTEXT_MAX_TOKENS,
+    keep_recent_tokens: int = CONTEXT_KEEP_RECENT_TOKENS,
+    tokenizer: Optional[Callable[[str], int]] = None,
+    system_prompt: str = "",
+    keep_tool_outputs: int = CONTEXT_KEEP_TOOL_OUTPUTS,
+):
+    """
+    Creates a graph node that keeps the prompt within a token budget.
+
+    The system prompt and the running summary count against `max_tokens`, and the message window
+    gets the rest. Nothing is rewritten while the prompt fits, so consecutive prompts only grow
+    at the end and the model server can reuse its prompt cache. Once it is over budget, long tool
+    outputs are replaced with excerpts and artifact handles (except the latest
+    `keep_tool_outputs` of the current turn), and if that is not enough, the oldest turns are
+    folded into the running summary until the remaining turns fit in `keep_recent_tokens` (the
+    latest turn is always kept).
+
+    The node runs with both `invoke`/`stream` and `ainvoke`/`astream`.
+
+    :param llm: The chat model used for summaries, without tools bound.
+    :param system_prompt: The system prompt sent with the messages.
+    """
+    tokenizer = tokenizer or approximate_tokens
+    system_tokens = tokenizer(system_prompt) if system_prompt else 0
+
+    def compact(state):
+        """
+        Returns the state update and the messages to fold into the summary.
+        """
+        messages = state["messages"]
+        summary = state.get("summary") or ""
+        # A system prompt larger than the whole budget still leaves room for the recent turns,
+        # instead of compacting on every call
+        window_tokens = max(
+            max_tokens - system_tokens - (tokenizer(summary) if summary else 0),
+            keep_recent_tokens,
+        )
+        if count_tokens(messages, tokenizer) <= window_tokens:
+            return {}, []
+
+        turns = split_turns(messages)
+        replacements = compact_tool_outputs(turns, keep_tool_outputs)
+        if replacements:
+            replaced = {m.id: m for m in replacements}
+            turns = [[replaced.get(m.id, m) for m in turn] for turn in turns]
+
+        update = {"messages": list(replacements)}
+        dropped = []
+
+        window = [m for turn in turns for m in turn]
+        if count_tokens(window, tokenizer) > window_tokens and len(turns) > 1:
+            kept, kept_tokens = [], 0
+            for turn in reversed(turns):
+                turn_tokens = count_tokens(turn, tokenizer)
+                if kept and kept_tokens + turn_tokens > keep_recent_tokens:
+                    break
+                kept.insert(0, turn)
+                kept_tokens += turn_tokens
+
+            dropped = [m for turn in turns[: len(turns) - len(kept)] for m in turn]
+            if dropped:
+                update["messages"] = [RemoveMessage(id=m.id) for m in dropped] + [
+                    m for m in replacements if m.id not in {d.id for d in dropped}
+                ]
+                logging.info(
+                    f"context:summarized {len(dropped)} messages, kept {kept_tokens} tokens"
+                )
+
+        return update, dropped
+
+    def context_node(state):
+        update, dropped = compact(state)
+        if dropped:
+            update["summary"] = summarize(llm, state.get("summary", ""), dropped)
+        return update
+
+    async def acontext_node(state):
+        update, dropped = compact(state)
+        if dropped:
+            update["summary"] = await asummarize(llm, state.get("summary", ""), dropped)
+        return update
+
+    return RunnableLambda(context_node, afunc=acontext_node, name="context_node")
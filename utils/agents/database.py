@@ -0,0 +1,221 @@
+from dotenv import load_dotenv
+from abc import ABC, abstractmethod
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+
+from utils.agents.query_guard import run_guarded_query
+from utils.agents.table_stats import collect_table_stats, collect_generic_table_stats
+from utils.tracing import instrument_sqlalchemy
+
+
+load_dotenv()
+# Spans for the SQL statements of every engine, when tracing is on
+instrument_sqlalchemy()
+
+
+# "postgres" (default), "sqlite" or "duckdb"
+DATABASE_BACKEND = os.getenv("DATABASE_BACKEND", "postgres").lower()
+# Database file used by the sqlite and duckdb backends
+DATABASE_PATH = os.getenv("DATABASE_PATH", "./fixtures/analytics.db")
+
+
+def get_connection_string():
+    db_user = os.getenv("POSTGRES_USER")
+    db_password = os.getenv("POSTGRES_PASSWORD")
+    db_host = os.getenv("POSTGRES_HOST")
+    db_port = os.getenv("POSTGRES_PORT")
+    db_name = os.getenv("POSTGRES_DB")
+
+    return f"postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}"
+
+
+class DatabaseBackend(ABC):
+    """
+    The database the agent introspects and queries.
+
+    Subclasses create the engine and may override the dialect-specific parts: schema
+    fingerprinting, statistics collection and how a query is executed safely.
+    """
+
+    name = "base"
+    # How the backend is described to the model: its SQL dialect and the limits on its queries
+    dialect = "SQL"
+    query_limits = "Queries run on a read-only connection."
+
+    def __init__(self):
+        self._engine = None
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def create_engine(self):
+        """
+        Creates the SQLAlchemy engine of the backend, called once by `get_engine`.
+        """
+
+    def get_engine(self):
+        """
+        Returns the backend's engine, creating it on first use so every caller shares one pool.
+        """
+        if self._engine is None:
+            with self._lock:
+                if self._engine is None:
+                    self._engine = self.create_engine()
+        return self._engine
+
+    def schema_fingerprint(self, conn) -> str:
+        """
+        Returns a hash of the tables, columns and column types in the database.
+        """
+        columns = []
+        inspector = inspect(conn)
+        for table in sorted(inspector.get_table_names()):
+            for column in inspector.get_columns(table):
+                columns.append(f"{table}.{column['name']}:{column['type']}")
+        return hashlib.md5(",".join(columns).encode("utf-8")).hexdigest()
+
+    def run_query(self, conn, sql: str, params: Optional[dict] = None) -> pd.DataFrame:
+        return pd.read_sql_query(text(sql), conn, params=params or {})
+
+    def collect_table_stats(self, tables: Optional[List[str]] = None) -> Dict[str, dict]:
+        return collect_generic_table_stats(self.get_engine(), tables)
+
+    def dispose(self):
+        if self._engine is not None:
+            self._engine.dispose()
+            self._engine = None
+
+
+class PostgresBackend(DatabaseBackend):
+    """
+    The production backend, configured from the POSTGRES_* environment variables.
+
+    Queries go through the EXPLAIN cost guard in a read-only transaction, and statistics
+    are read from the planner catalogs instead of scanning tables.
+    """
+
+    name = "postgres"
+    dialect = "PostgreSQL"
+    query_limits = (
+        "Queries run read-only with a time limit, and queries whose estimated cost is too high "
+        "are rejected before they run."
+    )
+
+    SCHEMA_FINGERPRINT_QUERY = """
+    SELECT md5(coalesce(string_agg(
+        table_name || '.' || column_name || ':' || data_type,
+        ',' ORDER BY table_name, ordinal_position
+    ), ''))
+    FROM information_schema.columns
+    WHERE table_schema = current_schema()
+    """
+
+    def __init__(self, connection_string: Optional[str] = None):
+        super().__init__()
+        self.connection_string = connection_string or get_connection_string()
+
+    def create_engine(self):
+        return create_engine(self.connection_string, pool_pre_ping=True)
+
+    def schema_fingerprint(self, conn) -> str:
+        return conn.execute(text(self.SCHEMA_FINGERPRINT_QUERY)).scalar() or ""
+
+    def run_query(self, conn, sql: str, params: Optional[dict] = None) -> pd.DataFrame:
+        return run_guarded_query(conn, sql, params)
+
+    def collect_table_stats(self, tables: Optional[List[str]] = None) -> Dict[str, dict]:
+        return collect_table_stats(self.get_engine(), tables)
+
+
+class SQLiteBackend(DatabaseBackend):
+    """
+    A file-based stand-in for Postgres, e.g. a fixture built with `utils.agents.fixtures`.
+
+    Connections are opened read-only, so the model cannot modify the fixture.
+    """
+
+    name = "sqlite"
+    dialect = "SQLite"
+
+    def __init__(self, path: str = DATABASE_PATH):
+        super().__init__()
+        self.path = path
+
+    def create_engine(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(
+                f"Database file {self.path} not found. Generate one with "
+                f"`python -m utils.agents.fixtures --path {self.path}`."
+            )
+        uri = f"file:{os.path.abspath(self.path)}?mode=ro"
+        return create_engine(
+            "sqlite://",
+            creator=lambda: sqlite3.connect(uri, uri=True, check_same_thread=False),
+        )
+
+
+class DuckDBBackend(DatabaseBackend):
+    """
+    A file-based stand-in for Postgres stored in DuckDB. Requires the duckdb-engine package.
+    """
+
+    name = "duckdb"
+    dialect = "DuckDB"
+
+    def __init__(self, path: str = DATABASE_PATH):
+        super().__init__()
+        self.path = path
+
+    def create_engine(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(
+                f"Database file {self.path} not found. Generate one with "
+                f"`python -m utils.agents.fixtures --backend duckdb --path {self.path}`."
+            )
+        return create_engine(
+            f"duckdb:///{self.path}", connect_args={"read_only": True}
+        )
+
+
+BACKENDS = {
+    PostgresBackend.name: PostgresBackend,
+    SQLiteBackend.name: SQLiteBackend,
+    DuckDBBackend.name: DuckDBBackend,
+}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> DatabaseBackend:
+    """
+    Returns the process-wide backend selected by the DATABASE_BACKEND environment variable.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if DATABASE_BACKEND not in BACKENDS:
+                    raise ValueError(
+                        f"Unknown DATABASE_BACKEND {DATABASE_BACKEND}. "
+                        f"Choose one of: {', '.join(BACKENDS)}"
+                    )
+                _backend = BACKENDS[DATABASE_BACKEND]()
+    return _backend
+
+
+def set_backend(backend: DatabaseBackend):
+    """
+    Replaces the process-wide backend, e.g. to point benchmarks at a generated fixture.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is not None and _backend is not backend:
+            _backend.dispose()
+        _backend = backend
@@ -0,0 +1,172 @@
+import argparse
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import (
+    Column,
+    Date,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    create_engine,
+)
+
+
+SECTORS = [
+    "Technology", "Healthcare", "Energy", "Real Estate", "Finance", "Consumer",
+    "Industrials", "Materials", "Utilities", "Telecom", "Logistics", "Media",
+]
+REGIONS = ["Seoul", "Busan", "Incheon", "Daegu", "Daejeon", "Gwangju", "Ulsan", "Jeju"]
+FACT_TABLES = [
+    "investments", "transactions", "orders", "revenues", "valuations",
+    "dividends", "expenses", "shipments", "subscriptions", "payments",
+]
+STATUSES = ["completed", "pending", "cancelled", "refunded"]
+BATCH_SIZE = 10_000
+
+
+def build_metadata(tables: int) -> MetaData:
+    """
+    Builds a star schema: `sectors`, `regions` and `companies` dimensions plus `tables - 3` fact tables.
+    """
+    metadata = MetaData()
+    Table(
+        "sectors",
+        metadata,
+        Column("sector_id", Integer, primary_key=True, autoincrement=False),
+        Column("name", String(64), nullable=False),
+    )
+    Table(
+        "regions",
+        metadata,
+        Column("region_id", Integer, primary_key=True, autoincrement=False),
+        Column("name", String(64), nullable=False),
+    )
+    Table(
+        "companies",
+        metadata,
+        Column("company_id", Integer, primary_key=True, autoincrement=False),
+        Column("name", String(128), nullable=False),
+        Column("sector_id", Integer, ForeignKey("sectors.sector_id"), nullable=False),
+        Column("region_id", Integer, ForeignKey("regions.region_id"), nullable=False),
+        Column("founded", Date),
+    )
+
+    for i in range(max(tables - 3, 1)):
+        name = FACT_TABLES[i] if i < len(FACT_TABLES) else f"facts_{i}"
+        Table(
+            name,
+            metadata,
+            Column("id", Integer, primary_key=True, autoincrement=False),
+            Column("company_id", Integer, ForeignKey("companies.company_id"), nullable=False),
+            Column("date", Date, nullable=False),
+            Column("amount", Float, nullable=False),
+            Column("quantity", Integer),
+            Column("status", String(16), nullable=False),
+            Index(f"ix_{name}_company_id", "company_id"),
+            Index(f"ix_{name}_date", "date"),
+        )
+    return metadata
+
+
+def generate_fixture(
+    path: str,
+    backend: str = "sqlite",
+    tables: int = 5,
+    rows: int = 10_000,
+    cardinality: int = 100,
+    seed: int = 0,
+) -> dict:
+    """
+    Generates a synthetic analytics database for local runs and performance tests.
+
+    :param path: The database file to create. An existing file is replaced.
+    :param backend: "sqlite" or "duckdb" (the latter requires duckdb-engine).
+    :param tables: Total number of tables, including the three dimension tables.
+    :param rows: Rows per fact table.
+    :param cardinality: Number of companies. Sectors and regions are capped by their name lists.
+    :param seed: Random seed, so the same arguments always produce the same data.
+    :return: A summary with row counts per table and the generation time.
+    """
+    rng = random.Random(seed)
+    start = time.monotonic()
+
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    engine = create_engine(f"{backend}:///{path}")
+    metadata = build_metadata(tables)
+    metadata.create_all(engine)
+
+    counts = {}
+    with engine.begin() as conn:
+        sectors = [{"sector_id": i + 1, "name": n} for i, n in enumerate(SECTORS)]
+        regions = [{"region_id": i + 1, "name": n} for i, n in enumerate(REGIONS)]
+        conn.execute(metadata.tables["sectors"].insert(), sectors)
+        conn.execute(metadata.tables["regions"].insert(), regions)
+
+        # Skewed sector popularity, like real portfolios
+        sector_weights = [1 / (i + 1) for i in range(len(sectors))]
+        companies = [
+            {
+                "company_id": i + 1,
+                "name": f"Company {i + 1:05d}",
+                "sector_id": rng.choices(range(1, len(sectors) + 1), sector_weights)[0],
+                "region_id": rng.randint(1, len(regions)),
+                "founded": date(1980, 1, 1) + timedelta(days=rng.randint(0, 16000)),
+            }
+            for i in range(cardinality)
+        ]
+        conn.execute(metadata.tables["companies"].insert(), companies)
+        counts.update(
+            {"sectors": len(sectors), "regions": len(regions), "companies": len(companies)}
+        )
+
+        first_day = date(2015, 1, 1)
+        for table in metadata.sorted_tables:
+            if table.name in counts:
+                continue
+            for offset in range(0, rows, BATCH_SIZE):
+                batch = [
+                    {
+                        "id": offset + i + 1,
+                        "company_id": int(rng.paretovariate(1.2)) % cardinality + 1,
+                        "date": first_day + timedelta(days=rng.randint(0, 3650)),
+                        "amount": round(rng.lognormvariate(8, 1.5), 2),
+                        "quantity": rng.randint(1, 100) if rng.random() > 0.05 else None,
+                        "status": rng.choices(STATUSES, [85, 10, 4, 1])[0],
+                    }
+                    for i in range(min(BATCH_SIZE, rows - offset))
+                ]
+                conn.execute(table.insert(), batch)
+            counts[table.name] = rows
+
+    engine.dispose()
+    return {"path": path, "tables": counts, "duration": time.monotonic() - start}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic analytics database.")
+    parser.add_argument("--path", default="./fixtures/analytics.db")
+    parser.add_argument("--backend", choices=["sqlite", "duckdb"], default="sqlite")
+    parser.add_argument("--tables", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--cardinality", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    summary = generate_fixture(
+        args.path,
+        backend=args.backend,
+        tables=args.tables,
+        rows=args.rows,
+        cardinality=args.cardinality,
+        seed=args.seed,
+    )
+    print(summary)
@@ -0,0 +1,176 @@
+import time
+from typing import Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from utils.metrics import (
+    CURRENT_PIPELINE,
+    LLM_DURATION,
+    LLM_TOKENS_PER_SECOND,
+    TOOL_DURATION,
+)
+from utils.tracing import CURRENT_SPAN, start_span
+
+
+class MetricsCallback(BaseCallbackHandler):
+    """
+    Records the duration of the model calls and tool executions of one graph run.
+    """
+
+    # Only reads the clock and updates counters, so it can run on the event loop
+    run_inline = True
+
+    def __init__(self, pipeline: Optional[str] = None):
+        self.pipeline = pipeline or CURRENT_PIPELINE.get() or "unknown"
+        self._llm_runs: Dict[UUID, tuple] = {}
+        self._tool_runs: Dict[UUID, tuple] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        model = (metadata or {}).get("ls_model_name") or kwargs.get(
+            "invocation_params", {}
+        ).get("model", "unknown")
+        self._llm_runs[run_id] = (model, time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if run_id not in self._llm_runs:
+            return
+        model, start = self._llm_runs.pop(run_id)
+        duration = time.perf_counter() - start
+        LLM_DURATION.observe(duration, pipeline=self.pipeline, model=model, status="ok")
+
+        generations = response.generations[0] if response.generations else []
+        message = getattr(generations[0], "message", None) if generations else None
+        usage = getattr(message, "usage_metadata", None) or {}
+        if usage.get("output_tokens") and duration > 0:
+            LLM_TOKENS_PER_SECOND.observe(
+                usage["output_tokens"] / duration, pipeline=self.pipeline, model=model
+            )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        if run_id in self._llm_runs:
+            model, start = self._llm_runs.pop(run_id)
+            LLM_DURATION.observe(
+                time.perf_counter() - start, pipeline=self.pipeline, model=model, status="error"
+            )
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        self._tool_runs[run_id] = (name, time.perf_counter())
+
+    def _end_tool(self, run_id, status: str):
+        if run_id in self._tool_runs:
+            name, start = self._tool_runs.pop(run_id)
+            TOOL_DURATION.observe(
+                time.perf_counter() - start, pipeline=self.pipeline, tool=name, status=status
+            )
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end_tool(run_id, getattr(output, "status", None) or "ok")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end_tool(run_id, "error")
+
+
+class TracingCallback(BaseCallbackHandler):
+    """
+    Records a span for each graph node, model call and tool execution of one graph run, nested by
+    their LangChain parent runs under the span that was current when the run started.
+
+    Node and tool spans are made the current span while they run, so spans started by their
+    code, e.g. SQL statements, are nested under them.
+    """
+
+    run_inline = True
+
+    def __init__(self, parent=None):
+        self.parent = parent or CURRENT_SPAN.get()
+        self._spans: Dict[UUID, tuple] = {}
+        # Parents of the runs without a span, to nest their children under the closest span
+        self._parents: Dict[UUID, Optional[UUID]] = {}
+
+    def _parent_span(self, parent_run_id):
+        while parent_run_id is not None and parent_run_id not in self._spans:
+            parent_run_id = self._parents.get(parent_run_id)
+        return self._spans[parent_run_id][0] if parent_run_id is not None else self.parent
+
+    def _start(self, name: str, run_id, parent_run_id, current: bool = False, **attributes):
+        parent = self._parent_span(parent_run_id)
+        span = start_span(name, parent, **attributes)
+        token = CURRENT_SPAN.set(span) if current else None
+        self._spans[run_id] = (span, token)
+
+    def _end(self, run_id, error: Optional[BaseException] = None):
+        self._parents.pop(run_id, None)
+        if run_id not in self._spans:
+            return
+        span, token = self._spans.pop(run_id)
+        if error is not None:
+            span.record_exception(error)
+        span.end()
+        if token is not None:
+            try:
+                CURRENT_SPAN.reset(token)
+            except ValueError:
+                # The span was made current in another context, e.g. the copy LangGraph runs a
+                # node in, which is discarded with the run, so there is nothing to restore here
+                pass
+
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs
+    ):
+        metadata = metadata or {}
+        node = metadata.get("langgraph_node")
+        # Only the graph itself and its nodes, not every runnable inside a node
+        if parent_run_id is None:
+            self._start(kwargs.get("name") or "graph", run_id, parent_run_id, current=True)
+        elif node and kwargs.get("name") == node:
+            self._start(
+                f"node {node}",
+                run_id,
+                parent_run_id,
+                current=True,
+                **{"langgraph.node": node, "langgraph.step": metadata.get("langgraph_step")},
+            )
+        else:
+            self._parents[run_id] = parent_run_id
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_chat_model_start(
+        self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs
+    ):
+        model = (metadata or {}).get("ls_model_name") or kwargs.get(
+            "invocation_params", {}
+        ).get("model", "unknown")
+        self._start("llm", run_id, parent_run_id, **{"llm.model": model})
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if run_id in self._spans:
+            generations = response.generations[0] if response.generations else []
+            message = getattr(generations[0], "message", None) if generations else None
+            usage = getattr(message, "usage_metadata", None) or {}
+            span = self._spans[run_id][0]
+            for key in ("input_tokens", "output_tokens"):
+                if usage.get(key) is not None:
+                    span.set_attribute(f"llm.{key}", usage[key])
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        self._start(f"tool {name}", run_id, parent_run_id, current=True, **{"tool.name": name})
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        if getattr(output, "status", None) == "error" and run_id in self._spans:
+            self._spans[run_id][0].set_status("ERROR")
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
@@ -0,0 +1,334 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Iterator, AsyncIterator, List, Optional, Tuple
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.messages.utils import message_chunk_to_message
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+# Opt-in: off unless LLM_CACHE_ENABLED is set
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./llm_cache.sqlite")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(24 * 60 * 60))) or None
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# Fields of a streamed chunk needed to replay it. The message id is left out, so a replayed
+# message gets a fresh id and does not replace the original in the same thread.
+_CHUNK_FIELDS = (
+    "content",
+    "additional_kwargs",
+    "response_metadata",
+    "tool_call_chunks",
+    "usage_metadata",
+)
+
+
+def _normalize_text(text) -> str:
+    if isinstance(text, list):
+        text = "".join(
+            item.get("text", "") if isinstance(item, dict) else str(item) for item in text
+        )
+    return _WHITESPACE_PATTERN.sub(" ", text or "").strip().casefold()
+
+
+def _message_data(message: BaseMessage, normalized: bool) -> list:
+    content = _normalize_text(message.content) if normalized else message.content
+    # Tool call ids are generated per call, only the calls themselves define the prompt
+    tool_calls = [
+        [tool_call["name"], tool_call["args"]]
+        for tool_call in getattr(message, "tool_calls", None) or []
+    ]
+    return [message.type, content, tool_calls]
+
+
+def _hash(data) -> str:
+    serialized = json.dumps(data, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def serialize_chunks(chunks: List[AIMessageChunk]) -> str:
+    return json.dumps(
+        [{field: getattr(chunk, field) for field in _CHUNK_FIELDS} for chunk in chunks],
+        default=str,
+        ensure_ascii=False,
+    )
+
+
+def deserialize_chunks(value: str) -> List[AIMessageChunk]:
+    return [AIMessageChunk(**data) for data in json.loads(value)]
+
+
+class LLMResponseCache:
+    """
+    A persistent cache of chat model responses in a SQLite file.
+
+    Worker processes share the file, but each opens its own connection on first use, as a
+    connection inherited from the parent across fork must not be used.
+
+    A response is stored as the chunks it was streamed in, so a hit can be streamed again. It is
+    found by an exact key (model, tools and system prompt, messages verbatim), or failing that by
+    a normalized key where whitespace and case of the message texts are ignored.
+
+    Entries expire after `ttl` seconds, and the least recently used entries are evicted once
+    the stored responses exceed `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        ttl: Optional[float] = LLM_CACHE_TTL,
+        max_bytes: int = LLM_CACHE_MAX_BYTES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self._pid = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.normalized_hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Returns this process's connection, opening it and creating the table on first use.
+        """
+        if self._pid == os.getpid():
+            return self._conn
+        with self._lock:
+            if self._pid != os.getpid():
+                self._conn = self._open()
+                self._pid = os.getpid()
+        return self._conn
+
+    def _open(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                normalized_key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_responses_normalized_key ON responses (normalized_key)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_responses_accessed_at ON responses (accessed_at)"
+        )
+        conn.commit()
+        return conn
+
+    def make_keys(self, model: str, prefix: str, messages: List[BaseMessage]) -> Tuple[str, str]:
+        """
+        Returns the exact and the normalized key of a prompt.
+
+        :param model: Identifies the chat model and its parameters.
+        :param prefix: Identifies the system prompt and the bound tools, e.g. `PromptPrefix.version`.
+        :param messages: The messages sent to the model.
+        """
+        exact = _hash([model, prefix, [_message_data(m, False) for m in messages]])
+        normalized = _hash([model, prefix, [_message_data(m, True) for m in messages]])
+        return exact, normalized
+
+    def get(self, keys: Tuple[str, str]) -> Optional[List[AIMessageChunk]]:
+        exact, normalized = keys
+        now = time.time()
+        oldest = now - self.ttl if self.ttl else 0
+        conn = self._connect()
+        with self._lock:
+            row = conn.execute(
+                "SELECT key, value FROM responses WHERE key = ? AND created_at >= ?",
+                (exact, oldest),
+            ).fetchone()
+            matched = "exact"
+            if row is None:
+                row = conn.execute(
+                    "SELECT key, value FROM responses WHERE normalized_key = ? AND created_at >= ? "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (normalized, oldest),
+                ).fetchone()
+                matched = "normalized"
+            if row is None:
+                self.misses += 1
+                return None
+
+            conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, row[0])
+            )
+            conn.commit()
+            if matched == "exact":
+                self.hits += 1
+            else:
+                self.normalized_hits += 1
+
+        logging.info(f"llm_cache:hit:{matched}")
+        return deserialize_chunks(row[1])
+
+    def put(self, keys: Tuple[str, str], chunks: List[AIMessageChunk]):
+        exact, normalized = keys
+        value = serialize_chunks(chunks)
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        now = time.time()
+        conn = self._connect()
+        with self._lock:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (exact, normalized, value, size, now, now),
+            )
+            if self.ttl:
+                conn.execute(
+                    "DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)
+                )
+            self._evict(conn)
+            conn.commit()
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT coalesce(sum(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        removed = 0
+        for key, size in conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        logging.info(f"llm_cache:evicted {removed} entries")
+
+    def clear(self):
+        conn = self._connect()
+        with self._lock:
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        with self._lock:
+            entries, size = conn.execute(
+                "SELECT count(*), coalesce(sum(size), 0) FROM responses"
+            ).fetchone()
+            lookups = self.hits + self.normalized_hits + self.misses
+            return {
+                "entries": entries,
+                "bytes": size,
+                "hits": self.hits,
+                "normalized_hits": self.normalized_hits,
+                "misses": self.misses,
+                "hit_rate": ((self.hits + self.normalized_hits) / lookups) if lookups else 0.0,
+            }
+
+
+class ReplayChatModel(BaseChatModel):
+    """
+    A chat model that streams back a cached response chunk by chunk.
+
+    It runs like any chat model, so LangGraph's message stream forwards the replayed chunks to
+    the user just as it forwards the tokens of a live model.
+    """
+
+    chunks: List[Any]
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = message_chunk_to_message(_merge(self.chunks))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> Iterator[ChatGenerationChunk]:
+        for chunk in self.chunks:
+            generation = ChatGenerationChunk(message=chunk.model_copy())
+            if run_manager:
+                run_manager.on_llm_new_token(generation.text, chunk=generation)
+            yield generation
+
+    async def _astream(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        for chunk in self.chunks:
+            generation = ChatGenerationChunk(message=chunk.model_copy())
+            if run_manager:
+                await run_manager.on_llm_new_token(generation.text, chunk=generation)
+            yield generation
+
+
+def _merge(chunks: List[AIMessageChunk]) -> AIMessageChunk:
+    merged = chunks[0]
+    for chunk in chunks[1:]:
+        merged = merged + chunk
+    return merged
+
+
+def _cacheable(chunks: List[AIMessageChunk]) -> bool:
+    if not chunks:
+        return False
+    message = _merge(chunks)
+    return bool(message.content or message.tool_call_chunks)
+
+
+def _strip_ids(chunks: List[AIMessageChunk]) -> List[AIMessageChunk]:
+    return [chunk.model_copy(update={"id": None}) for chunk in chunks]
+
+
+def cached_invoke(cache: LLMResponseCache, llm, payload, keys) -> Tuple[AIMessage, bool]:
+    """
+    Answers from the cache if possible, otherwise streams the model and stores its chunks.
+
+    :return: The response and whether it came from the cache.
+    """
+    chunks = cache.get(keys)
+    if chunks:
+        return ReplayChatModel(chunks=chunks).invoke(payload), True
+
+    chunks = list(llm.stream(payload))
+    if _cacheable(chunks):
+        cache.put(keys, _strip_ids(chunks))
+    return message_chunk_to_message(_merge(chunks)), False
+
+
+async def acached_invoke(
+    cache: LLMResponseCache, llm, payload, keys
+) -> Tuple[AIMessage, bool]:
+    """
+    Async version of `cached_invoke`. SQLite access runs in a worker thread.
+    """
+    chunks = await asyncio.to_thread(cache.get, keys)
+    if chunks:
+        return await ReplayChatModel(chunks=chunks).ainvoke(payload), True
+
+    chunks = [chunk async for chunk in llm.astream(payload)]
+    if _cacheable(chunks):
+        await asyncio.to_thread(cache.put, keys, _strip_ids(chunks))
+    return message_chunk_to_message(_merge(chunks)), False
+
+
+LLM_CACHE = LLMResponseCache() if LLM_CACHE_ENABLED else None
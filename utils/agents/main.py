@@ -1,5 +1,63 @@
 import re
+from typing import Tuple
 
 
 def remove_think_tags(text):
     return re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
+
+
+class ThinkTagFilter:
+    """
+    Splits a streamed response into its answer and its `<think>...</think>` reasoning.
+
+    Unlike `remove_think_tags`, it works on chunks as they arrive, wherever the chunk boundaries
+    fall, including inside a tag. Only the state and a possibly incomplete tag (at most seven
+    characters) are kept between chunks.
+    """
+
+    OPEN_TAG = "<think>"
+    CLOSE_TAG = "</think>"
+
+    def __init__(self):
+        self.in_think = False
+        self.pending = ""
+
+    def feed(self, text: str) -> Tuple[str, str]:
+        """
+        Filters the next chunk of the response.
+
+        :return: The answer text and the reasoning text of the chunk, either may be empty.
+        """
+        text = self.pending + text
+        self.pending = ""
+        content, reasoning = [], []
+
+        position = 0
+        while position < len(text):
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            output = reasoning if self.in_think else content
+            found = text.find(tag, position)
+            if found != -1:
+                output.append(text[position:found])
+                position = found + len(tag)
+                self.in_think = not self.in_think
+                continue
+
+            # Hold back an incomplete tag at the end until the next chunk completes or rules it out
+            keep = 0
+            for length in range(min(len(tag) - 1, len(text) - position), 0, -1):
+                if text.endswith(tag[:length]):
+                    keep = length
+                    break
+            output.append(text[position : len(text) - keep])
+            self.pending = text[len(text) - keep :]
+            break
+
+        return "".join(content), "".join(reasoning)
+
+    def flush(self) -> Tuple[str, str]:
+        """
+        Returns the text held back at the end of the response.
+        """
+        pending, self.pending = self.pending, ""
+        return ("", pending) if self.in_think else (pending, "")
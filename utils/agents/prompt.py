@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from utils.agents.context import count_tokens
+
+
+MAX_TRACKED_THREADS = 1024
+
+
+class PromptPrefix:
+    """
+    The stable head of every prompt sent by `llm_node`: system prompt, schema catalog and tool schemas.
+
+    Ollama only reuses its KV cache for a byte-identical prompt prefix, so this part is built once,
+    tools are ordered by name, and anything that changes between calls goes after it. The version
+    changes only when the system prompt, the catalog or the tools change.
+    """
+
+    def __init__(self, system_prompt: str, tools: List):
+        self.tools = sorted(tools, key=lambda tool: tool.name)
+        tool_schemas = json.dumps(
+            [convert_to_openai_tool(tool) for tool in self.tools],
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        self.system_prompt = system_prompt
+        self.version = hashlib.sha256(
+            (system_prompt + tool_schemas).encode("utf-8")
+        ).hexdigest()[:12]
+        self.message = SystemMessage(content=system_prompt)
+
+    def assemble(
+        self,
+        messages: List[BaseMessage],
+        summary: Optional[str] = None,
+        tail: Optional[List[BaseMessage]] = None,
+    ) -> List[BaseMessage]:
+        """
+        Builds the prompt: the prefix, the running summary, the conversation and volatile content last.
+
+        The summary only changes when old turns are folded into it, and the conversation only grows
+        between compactions, so consecutive calls share everything but the newest messages.
+        """
+        payload = [self.message]
+        if summary:
+            payload.append(
+                SystemMessage(content=f"Summary of the earlier conversation:\n{summary}")
+            )
+        payload += messages
+        if tail:
+            payload += tail
+        return payload
+
+
+def _message_digest(message: BaseMessage) -> str:
+    data = json.dumps(
+        [message.type, message.content, getattr(message, "tool_calls", None)],
+        sort_keys=True,
+        default=str,
+        ensure_ascii=False,
+    )
+    return hashlib.md5(data.encode("utf-8")).hexdigest()
+
+
+class PrefixCacheMonitor:
+    """
+    Measures how much of each prompt repeats the previous prompt of the same thread, i.e. how
+    much Ollama can take from its KV cache, and the prompt evaluation time that saves.
+
+    The shared prefix is counted in messages and with the local token estimate. The saving is
+    computed in Ollama's units only: the first, uncached call of a thread gives the prompt size
+    in Ollama tokens per estimated token and Ollama's seconds per prompt token. A later prompt's
+    Ollama size is its estimate scaled by that ratio; what Ollama did not evaluate of it came from
+    the cache, and saved that many tokens at the thread's rate.
+    """
+
+    def __init__(self, max_threads: int = MAX_TRACKED_THREADS):
+        self.max_threads = max_threads
+        # Thread -> (message digests of the last prompt, calibration of its first call or None)
+        self._last: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.shared_tokens = 0
+        self.evaluated_tokens = 0
+        self.eval_seconds = 0.0
+        self.cached_tokens = 0
+        self.saved_seconds = 0.0
+
+    def observe(self, thread_id: str, prefix: PromptPrefix, payload, response) -> dict:
+        digests = [_message_digest(m) for m in payload]
+        with self._lock:
+            previous, calibration = self._last.pop(thread_id, ([], None))
+
+        shared = 0
+        for current, last in zip(digests, previous):
+            if current != last:
+                break
+            shared += 1
+
+        prompt_tokens = count_tokens(payload)
+        shared_tokens = count_tokens(payload[:shared])
+
+        # Tokens Ollama evaluated for this prompt; the rest of it came from its cache
+        metadata = response.response_metadata or {}
+        eval_count = metadata.get("prompt_eval_count")
+        eval_seconds = (metadata.get("prompt_eval_duration") or 0) / 1e9
+
+        cached_tokens, saved_seconds = None, None
+        if eval_count and prompt_tokens:
+            if calibration is None and not shared:
+                # Nothing to reuse, so Ollama evaluated the whole prompt
+                calibration = (eval_count / prompt_tokens, eval_seconds / eval_count)
+            if calibration is not None:
+                ollama_per_token, seconds_per_token = calibration
+                cached_tokens = max(round(prompt_tokens * ollama_per_token) - eval_count, 0)
+                saved_seconds = cached_tokens * seconds_per_token
+
+        with self._lock:
+            self._last[thread_id] = (digests, calibration)
+            while len(self._last) > self.max_threads:
+                self._last.popitem(last=False)
+
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.shared_tokens += shared_tokens
+            self.evaluated_tokens += eval_count or 0
+            self.eval_seconds += eval_seconds
+            self.cached_tokens += cached_tokens or 0
+            self.saved_seconds += saved_seconds or 0.0
+
+        report = {
+            "prefix_version": prefix.version,
+            "prompt_tokens_estimate": prompt_tokens,
+            "shared_prefix_messages": shared,
+            "shared_prefix_tokens_estimate": shared_tokens,
+            "prompt_eval_count": eval_count,
+            "prompt_eval_seconds": round(eval_seconds, 3),
+            # In Ollama tokens, None until the thread's first uncached call calibrated them
+            "cached_prompt_tokens": cached_tokens,
+            "prompt_eval_seconds_saved": None if saved_seconds is None else round(saved_seconds, 3),
+        }
+        logging.info(f"prefix_cache:{report}")
+        return report
+
+    def stats(self) -> dict:
+        """
+        Totals over all calls. `shared_rate` is the estimated share of prompt tokens repeated from
+        the thread's previous prompt; the evaluated, cached and saved figures are in Ollama's
+        tokens and seconds.
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prompt_tokens_estimate": self.prompt_tokens,
+                "shared_tokens_estimate": self.shared_tokens,
+                "shared_rate": (self.shared_tokens / self.prompt_tokens)
+                if self.prompt_tokens
+                else 0.0,
+                "evaluated_tokens": self.evaluated_tokens,
+                "eval_seconds": round(self.eval_seconds, 3),
+                "cached_tokens": self.cached_tokens,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+
+PREFIX_CACHE_MONITOR = PrefixCacheMonitor()
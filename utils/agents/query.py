@@ -0,0 +1,128 @@
+import logging
+import os
+import time
+from typing import Optional
+
+from utils.agents.database import get_backend, get_connection_string
+from utils.agents.query_cache import QueryResultCache
+from utils.agents.table_stats import TableStatsCache, format_table_stats
+from utils.metrics import DB_QUERY_DURATION
+from utils.tracing import span
+
+
+SCHEMA_FINGERPRINT_TTL = float(os.getenv("SCHEMA_FINGERPRINT_TTL", "60"))
+
+
+def get_engine():
+    """
+    Returns the engine of the configured database backend, so every query shares one connection pool.
+    """
+    return get_backend().get_engine()
+
+
+_fingerprint = None
+_fingerprint_backend = None
+_fingerprint_checked_at = 0.0
+
+
+def get_schema_fingerprint(force: bool = False) -> str:
+    """
+    Returns a hash of the current schema's tables, columns and types.
+
+    The value is re-read at most every SCHEMA_FINGERPRINT_TTL seconds. When it changes,
+    cached results computed against the previous schema are dropped.
+    """
+    global _fingerprint, _fingerprint_backend, _fingerprint_checked_at
+    backend = get_backend()
+    now = time.monotonic()
+    if (
+        force
+        or _fingerprint is None
+        or _fingerprint_backend is not backend
+        or now - _fingerprint_checked_at >= SCHEMA_FINGERPRINT_TTL
+    ):
+        with backend.get_engine().connect() as conn:
+            fingerprint = f"{backend.name}:{backend.schema_fingerprint(conn)}"
+        if _fingerprint is not None and fingerprint != _fingerprint:
+            removed = QUERY_CACHE.invalidate_fingerprint(fingerprint)
+            logging.info(f"query_cache:schema changed, dropped {removed} entries")
+        _fingerprint = fingerprint
+        _fingerprint_backend = backend
+        _fingerprint_checked_at = now
+    return _fingerprint
+
+
+QUERY_CACHE = QueryResultCache()
+
+
+def run_query(sql: str, params: Optional[dict] = None, use_cache: bool = True):
+    """
+    Runs a read-only SQL query against the analytics database and returns a pandas DataFrame.
+
+    On Postgres, queries run in a read-only transaction with a statement timeout, and their plan
+    is checked with EXPLAIN first, so runaway scans fail fast with a QueryRejected error.
+
+    Results are served from the shared query result cache when the same query (after
+    normalization) with the same parameters was already run against the current schema.
+
+    :param sql: The SQL query. Use named bind parameters such as :sector.
+    :param params: Values for the bind parameters.
+    :param use_cache: Set to False to always hit the database.
+    :return: The query result as a pandas DataFrame.
+    """
+    with span("run_query") as current:
+        start = time.perf_counter()
+        backend = get_backend()
+        fingerprint = get_schema_fingerprint()
+        current.set_attribute("db.system", backend.name)
+
+        if use_cache:
+            cached = QUERY_CACHE.get(sql, params, fingerprint)
+            if cached is not None:
+                logging.info(f"query_cache:hit {QUERY_CACHE.stats()}")
+                DB_QUERY_DURATION.observe(
+                    time.perf_counter() - start, backend=backend.name, cache="hit"
+                )
+                current.set_attribute("db.cache", "hit")
+                return cached.copy()
+
+        with backend.get_engine().connect() as conn:
+            result = backend.run_query(conn, sql, params)
+        cache = "miss" if use_cache else "off"
+        DB_QUERY_DURATION.observe(
+            time.perf_counter() - start, backend=backend.name, cache=cache
+        )
+        current.set_attribute("db.cache", cache)
+        current.set_attribute("db.rows", len(result))
+
+        # A truncated result is not the query's result, so it is not served for it later
+        if use_cache and not result.attrs.get("truncated"):
+            QUERY_CACHE.put(sql, params, fingerprint, result.copy())
+            logging.info(f"query_cache:miss {QUERY_CACHE.stats()}")
+        return result
+
+
+def invalidate_tables(*tables: str) -> int:
+    """
+    Drops cached results that read from any of the given tables (all results if none are given).
+    """
+    return QUERY_CACHE.invalidate(tables or None)
+
+
+TABLE_STATS = TableStatsCache(lambda: get_backend().collect_table_stats())
+
+
+def describe_table(table: str) -> str:
+    """
+    Returns the precomputed statistics of a table: approximate row count, per-column null fraction,
+    distinct count and most common values, and a few sample rows.
+
+    Use this instead of running COUNT(*), SELECT DISTINCT or SELECT * LIMIT queries to explore the data.
+
+    :param table: The table name.
+    :return: A markdown summary of the table.
+    """
+    stats = TABLE_STATS.get()
+    if table not in stats:
+        return f"No statistics for table {table}. Known tables: {', '.join(sorted(stats))}"
+    return f"## Table: {table}\n" + format_table_stats(stats[table])
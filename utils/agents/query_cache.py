@@ -0,0 +1,233 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+DEFAULT_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DEFAULT_TTL = float(os.getenv("QUERY_CACHE_TTL", "0")) or None
+
+_COMMENT_PATTERN = re.compile(r"--[^\n]*|/\*.*?\*/", flags=re.DOTALL)
+_TOKEN_PATTERN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\s+|[^'\"\s]+")
+_TABLE_PATTERN = re.compile(
+    r"\b(?:from|join)\s+((?:\"[^\"]+\"|[a-z_][\w$]*)(?:\.(?:\"[^\"]+\"|[a-z_][\w$]*))?)",
+    flags=re.IGNORECASE,
+)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Normalizes SQL text so that cosmetic differences do not produce different cache keys.
+
+    Comments are removed, whitespace is collapsed, keywords and identifiers are lower-cased
+    and a trailing semicolon is dropped. Quoted literals and quoted identifiers are kept verbatim.
+
+    :param sql: The SQL text to normalize.
+    :return: The normalized SQL text.
+    """
+    sql = _COMMENT_PATTERN.sub(" ", sql)
+    parts = []
+    for token in _TOKEN_PATTERN.findall(sql):
+        if token.isspace():
+            parts.append(" ")
+        elif token[0] in ("'", '"'):
+            parts.append(token)
+        else:
+            parts.append(token.lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def referenced_tables(sql: str) -> List[str]:
+    """
+    Returns the (unqualified, lower-cased) table names referenced in FROM and JOIN clauses.
+    """
+    tables = []
+    for match in _TABLE_PATTERN.findall(normalize_sql(sql)):
+        table = match.split(".")[-1].strip('"').lower()
+        if table not in tables:
+            tables.append(table)
+    return tables
+
+
+def estimate_size(value) -> int:
+    """
+    Estimates the in-memory size of a cached query result in bytes.
+    """
+    if hasattr(value, "memory_usage"):
+        try:
+            return int(value.memory_usage(index=True, deep=True).sum())
+        except TypeError:
+            pass
+    return len(repr(value).encode("utf-8"))
+
+
+class _Entry:
+    __slots__ = ("value", "size", "tables", "fingerprint", "expires_at")
+
+    def __init__(self, value, size, tables, fingerprint, expires_at):
+        self.value = value
+        self.size = size
+        self.tables = tables
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+
+
+class QueryResultCache:
+    """
+    Byte-budgeted LRU cache of query results.
+
+    Entries are keyed by the normalized SQL text, the bound parameters and the schema fingerprint,
+    so a schema change never serves results computed against an older schema.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        default_ttl: Optional[float] = DEFAULT_TTL,
+        table_ttls: Optional[Dict[str, float]] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.table_ttls = {k.lower(): v for k, v in (table_ttls or {}).items()}
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._hooks: List[Callable[[List[str]], None]] = []
+        self.current_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.bytes_saved = 0
+
+    @staticmethod
+    def make_key(sql: str, params: Optional[dict], fingerprint: str) -> str:
+        payload = json.dumps(
+            [normalize_sql(sql), params or {}, fingerprint], sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def set_table_ttl(self, table: str, ttl: Optional[float]):
+        if ttl is None:
+            self.table_ttls.pop(table.lower(), None)
+        else:
+            self.table_ttls[table.lower()] = ttl
+
+    def _ttl_for(self, tables: Iterable[str]) -> Optional[float]:
+        ttls = [self.table_ttls[t] for t in tables if t in self.table_ttls]
+        if self.default_ttl is not None:
+            ttls.append(self.default_ttl)
+        return min(ttls) if ttls else None
+
+    def get(self, sql: str, params: Optional[dict], fingerprint: str):
+        """
+        Returns the cached result or None if there is no fresh entry.
+        """
+        key = self.make_key(sql, params, fingerprint)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None:
+                if entry.expires_at <= time.monotonic():
+                    self._remove(key)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += entry.size
+            return entry.value
+
+    def put(self, sql: str, params: Optional[dict], fingerprint: str, value):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        tables = referenced_tables(sql)
+        ttl = self._ttl_for(tables)
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        key = self.make_key(sql, params, fingerprint)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, size, tables, fingerprint, expires_at)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.current_bytes -= entry.size
+
+    def add_invalidation_hook(self, hook: Callable[[List[str]], None]):
+        """
+        Registers a callback invoked with the affected table names whenever entries are invalidated.
+        An empty list means the whole cache was invalidated.
+        """
+        self._hooks.append(hook)
+
+    def invalidate(self, tables: Optional[Iterable[str]] = None) -> int:
+        """
+        Drops every entry that references one of the given tables, or all entries if no table is given.
+
+        :return: The number of removed entries.
+        """
+        tables = [t.lower() for t in tables] if tables is not None else None
+        with self._lock:
+            if tables is None:
+                keys = list(self._entries.keys())
+            else:
+                keys = [
+                    key
+                    for key, entry in self._entries.items()
+                    if any(t in entry.tables for t in tables)
+                ]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+
+        for hook in self._hooks:
+            try:
+                hook(tables or [])
+            except Exception as e:
+                logging.warning(f"query_cache:invalidation hook failed: {e}")
+        return len(keys)
+
+    def invalidate_fingerprint(self, fingerprint: str) -> int:
+        """
+        Drops every entry computed against a schema fingerprint other than the given one.
+        """
+        with self._lock:
+            keys = [
+                key
+                for key, entry in self._entries.items()
+                if entry.fingerprint != fingerprint
+            ]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+        return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
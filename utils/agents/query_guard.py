@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+from contextlib import contextmanager
+from typing import Optional
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+
+STATEMENT_TIMEOUT_MS = int(os.getenv("QUERY_STATEMENT_TIMEOUT_MS", "30000"))
+MAX_PLAN_COST = float(os.getenv("QUERY_MAX_PLAN_COST", "10000000"))
+MAX_PLAN_ROWS = float(os.getenv("QUERY_MAX_PLAN_ROWS", "5000000"))
+# When a plan returns more rows than MAX_PLAN_ROWS but is otherwise cheap enough, return only
+# the first this many rows instead of rejecting the query. 0 disables truncation.
+TRUNCATE_ROWS = int(os.getenv("QUERY_TRUNCATE_ROWS", "100000"))
+
+# Postgres SQLSTATE codes
+QUERY_CANCELED = "57014"
+READ_ONLY_SQL_TRANSACTION = "25006"
+
+
+class QueryRejected(ValueError):
+    """
+    An error raised when a query is refused before or during execution.
+
+    The message is written for the model: it says what limit was hit and how to rewrite the query.
+    """
+
+    pass
+
+
+def explain(conn, sql: str, params: Optional[dict] = None) -> dict:
+    """
+    Returns the top plan node of `EXPLAIN (FORMAT JSON)` for the query, without running it.
+    """
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params or {}).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def check_plan(
+    plan: dict,
+    max_cost: float = MAX_PLAN_COST,
+    max_rows: float = MAX_PLAN_ROWS,
+    truncate_rows: int = TRUNCATE_ROWS,
+) -> Optional[int]:
+    """
+    Checks the estimated plan against the configured thresholds.
+
+    :return: None if the query can run as is, or the number of rows to truncate it to.
+    :raises QueryRejected: If the plan is too expensive to run.
+    """
+    cost = plan.get("Total Cost", 0.0)
+    rows = plan.get("Plan Rows", 0)
+
+    if cost > max_cost:
+        raise QueryRejected(
+            f"Query rejected: estimated cost {cost:.3g} exceeds the limit of {max_cost:.3g} "
+            f"(estimated {rows:.3g} rows, top plan node: {plan.get('Node Type')}). "
+            "Add WHERE filters on indexed columns, aggregate with GROUP BY in SQL instead of in pandas, "
+            "avoid cross joins, or query a smaller time range."
+        )
+
+    if rows > max_rows:
+        if truncate_rows:
+            return truncate_rows
+        raise QueryRejected(
+            f"Query rejected: it would return about {rows:.3g} rows, more than the limit of {max_rows:.3g}. "
+            "Aggregate in SQL or add a LIMIT."
+        )
+
+    return None
+
+
+@contextmanager
+def guarded_transaction(conn, statement_timeout_ms: int = STATEMENT_TIMEOUT_MS):
+    """
+    Opens a read-only Postgres transaction in which every statement is cancelled after
+    `statement_timeout_ms`.
+    """
+    with conn.begin():
+        conn.execute(text("SET TRANSACTION READ ONLY"))
+        conn.execute(text(f"SET LOCAL statement_timeout = {int(statement_timeout_ms)}"))
+        yield conn
+
+
+def run_guarded_query(
+    conn,
+    sql: str,
+    params: Optional[dict] = None,
+    statement_timeout_ms: int = STATEMENT_TIMEOUT_MS,
+) -> pd.DataFrame:
+    """
+    Runs a query in a read-only transaction with a statement timeout after checking its plan.
+
+    If the plan returns too many rows, only the first rows the database produces are returned,
+    which are not a representative sample, and `df.attrs["truncated"]` holds the estimated full
+    row count.
+    """
+    params = params or {}
+    with guarded_transaction(conn, statement_timeout_ms):
+        try:
+            plan = explain(conn, sql, params)
+            limit = check_plan(plan)
+
+            query = sql.strip().rstrip(";")
+            if limit is not None:
+                query = f"SELECT * FROM ({query}) AS _truncated LIMIT {int(limit)}"
+                logging.info(
+                    f"query_guard:truncated to {limit} rows (estimated {plan.get('Plan Rows')})"
+                )
+
+            result = pd.read_sql_query(text(query), conn, params=params)
+        except DBAPIError as e:
+            code = getattr(e.orig, "pgcode", None)
+            if code == QUERY_CANCELED:
+                raise QueryRejected(
+                    f"Query cancelled after the {statement_timeout_ms} ms statement timeout. "
+                    "Narrow the query with WHERE filters or aggregate in SQL."
+                ) from None
+            if code == READ_ONLY_SQL_TRANSACTION:
+                raise QueryRejected(
+                    "Query rejected: the database is read-only for analysis. Only SELECT queries are allowed."
+                ) from None
+            raise
+
+    if limit is not None:
+        result.attrs["truncated"] = plan.get("Plan Rows")
+    return result
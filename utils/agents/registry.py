@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+
+# Compiled graphs kept per (model, authorized imports) pair, the active one is never evicted
+GRAPH_REGISTRY_SIZE = int(os.getenv("GRAPH_REGISTRY_SIZE", "4"))
+
+
+class GraphRegistry:
+    """
+    Lazily builds and caches one compiled graph per key, e.g. a (model, authorized imports) pair.
+
+    One key is active and serves new requests. `activate` builds and pre-warms the graph of a new
+    key before switching to it with a single assignment, so requests already running keep the
+    graph they started with and new requests never wait for a build.
+    """
+
+    def __init__(
+        self,
+        build: Callable[..., object],
+        warm: Optional[Callable[..., Awaitable]] = None,
+        max_graphs: int = GRAPH_REGISTRY_SIZE,
+    ):
+        """
+        :param build: Builds the compiled graph of a key. Called in a worker thread with the key's items.
+        :param warm: Optional coroutine function loading the key's model before traffic is switched.
+        :param max_graphs: Number of compiled graphs to keep.
+        """
+        self.build = build
+        self.warm = warm
+        self.max_graphs = max_graphs
+
+        self._graphs: "OrderedDict[Hashable, object]" = OrderedDict()
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._active = None
+
+    @property
+    def active_key(self) -> Optional[Hashable]:
+        return self._active[0] if self._active else None
+
+    def current(self):
+        """
+        Returns the graph of the active key. Requests should call this once and keep the result.
+        """
+        if self._active is None:
+            raise RuntimeError("No graph is active yet, call `activate` first.")
+        return self._active[1]
+
+    async def get(self, key: tuple):
+        """
+        Returns the graph of a key, building it on first use. Concurrent calls share one build.
+        """
+        if key in self._graphs:
+            self._graphs.move_to_end(key)
+            return self._graphs[key]
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            graph = self._graphs.get(key)
+            if graph is None:
+                start = time.perf_counter()
+                # Building reads the database schema, keep it off the event loop
+                graph = await asyncio.to_thread(self.build, *key)
+                self._graphs[key] = graph
+                logging.info(f"registry:built {key} in {time.perf_counter() - start:.3f}s")
+                self._evict(keep=key)
+        self._locks.pop(key, None)
+        return graph
+
+    async def activate(self, key: tuple, require_warm: bool = True):
+        """
+        Builds and pre-warms the graph of a key, then routes new requests to it.
+
+        :param key: The key to activate.
+        :param require_warm: Whether a failed pre-warm aborts the switch. Otherwise it is only logged,
+            e.g. at startup when the model server may still be starting.
+        :return: The activated graph.
+        """
+        graph = await self.get(key)
+        if self.warm is not None:
+            start = time.perf_counter()
+            try:
+                await self.warm(*key)
+                logging.info(f"registry:warmed {key} in {time.perf_counter() - start:.3f}s")
+            except Exception as e:
+                if require_warm:
+                    raise
+                logging.warning(f"registry:failed to warm {key}: {e}")
+
+        self._active = (key, graph)
+        logging.info(f"registry:active {key}")
+        return graph
+
+    def _evict(self, keep: Optional[Hashable] = None):
+        """
+        Drops the least recently used graphs beyond `max_graphs`, never the active key or `keep`.
+        """
+        active_key = self.active_key
+        for key in list(self._graphs):
+            if len(self._graphs) <= self.max_graphs:
+                break
+            if key != active_key and key != keep:
+                del self._graphs[key]
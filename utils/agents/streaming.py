@@ -0,0 +1,124 @@
+import time
+from typing import AsyncGenerator, List, Optional, Union
+
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+
+from utils.agents.instrumentation import MetricsCallback, TracingCallback
+from utils.agents.main import ThinkTagFilter
+from utils.agents.threads import aprepare_thread, get_chat_id
+from utils.tracing import TRACER
+
+
+async def astream_graph(
+    graph,
+    messages: List[dict],
+    body: dict,
+    stream_reasoning: bool = False,
+    hidden_nodes: tuple = ("CONTEXT_NODE",),
+    thread_namespace: Optional[str] = None,
+) -> AsyncGenerator[Union[str, dict], None]:
+    """
+    Runs a checkpointed agent graph for one Open WebUI request and yields what the user sees.
+
+    Tokens are streamed as the LLM produces them, tool calls are announced as soon as the model
+    starts them, and tool outputs are forwarded when the tool returns. `<think>` reasoning is
+    filtered out of the tokens, or yielded as {"reasoning_content": ...} deltas. The turn budget
+    report of the final answer, if any, is yielded last as {"metadata": {"budget": ...}}.
+
+    :param graph: The compiled graph, with an async checkpointer.
+    :param messages: The Open WebUI messages of the request.
+    :param body: The request body, for the chat id and the `llm_cache` flag.
+    :param stream_reasoning: Whether to yield the reasoning instead of dropping it.
+    :param hidden_nodes: Nodes whose messages are not shown, e.g. ones that only rewrite history.
+    :param thread_namespace: Prefix of the chat's thread id, so pipelines sharing a checkpointer
+        keep separate threads.
+    """
+    start = time.perf_counter()
+    first_token_at = None
+    current_message_id = None
+    think_filter, think_filter_message_id = ThinkTagFilter(), None
+    try:
+        # Convert OpenWebUI messages to LangChain format, appending to the chat's thread if it is in sync
+        payload, config, ephemeral = await aprepare_thread(
+            graph, messages, get_chat_id(body), thread_namespace
+        )
+        # Requests can skip the LLM response cache, e.g. to get a fresh answer
+        config["configurable"]["llm_cache"] = body.get("llm_cache", True)
+        config["callbacks"] = [MetricsCallback()]
+        if TRACER.enabled:
+            config["callbacks"].append(TracingCallback())
+    except Exception as e:
+        msg = f"Error in pipe: {str(e)}"
+        print(msg)
+        yield msg + "\n"
+        return
+
+    try:
+        # Forward LLM tokens as they are generated instead of waiting for the whole ReAct loop
+        async for chunk, metadata in graph.astream(
+            payload, config, stream_mode="messages"
+        ):
+            if metadata.get("langgraph_node") in hidden_nodes:
+                continue
+
+            text, reasoning = "", ""
+            if isinstance(chunk, AIMessageChunk):
+                # Every response starts outside a <think> block
+                if chunk.id != think_filter_message_id:
+                    text, reasoning = think_filter.flush()
+                    think_filter = ThinkTagFilter()
+                    think_filter_message_id = chunk.id
+                if isinstance(chunk.content, str):
+                    content, thought = think_filter.feed(chunk.content)
+                    text += content
+                    reasoning += thought
+                for tool_call_chunk in chunk.tool_call_chunks:
+                    if tool_call_chunk.get("name"):
+                        text += f"\n[Tool Call: {tool_call_chunk['name']}]\n"
+            elif isinstance(chunk, ToolMessage) and chunk.content:
+                text = f"{chunk.content}"
+
+            if reasoning and stream_reasoning:
+                yield {"reasoning_content": reasoning}
+
+            if not text:
+                continue
+
+            if current_message_id is not None and chunk.id != current_message_id:
+                text = "\n" + text
+            current_message_id = chunk.id
+
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                print(f"pipe:ttft:{first_token_at - start:.3f}s")
+            yield text
+
+        text, reasoning = think_filter.flush()
+        if reasoning and stream_reasoning:
+            yield {"reasoning_content": reasoning}
+        if text:
+            yield text
+
+        report = await final_budget_report(graph, config)
+        if report:
+            yield {"metadata": {"budget": report}}
+    except Exception as e:
+        msg = f"Error in pipe: {str(e)}"
+        print(msg)
+        yield msg + "\n"
+    finally:
+        if ephemeral:
+            await graph.checkpointer.adelete_thread(config["configurable"]["thread_id"])
+
+    print(f"pipe:total:{time.perf_counter() - start:.3f}s")
+
+
+async def final_budget_report(graph, config) -> Optional[dict]:
+    """
+    Returns the turn budget report of the thread's last message, see utils.agents.budget.
+    """
+    snapshot = await graph.aget_state(config)
+    messages = snapshot.values.get("messages", [])
+    if messages and isinstance(messages[-1], AIMessage):
+        return messages[-1].response_metadata.get("budget")
+    return None
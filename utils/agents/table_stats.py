@@ -0,0 +1,236 @@
+import csv
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import inspect, text
+
+
+TABLE_STATS_REFRESH_INTERVAL = float(os.getenv("TABLE_STATS_REFRESH_INTERVAL", "3600"))
+TABLE_STATS_SAMPLE_ROWS = int(os.getenv("TABLE_STATS_SAMPLE_ROWS", "3"))
+MAX_COMMON_VALUES = 5
+MAX_VALUE_LENGTH = 40
+
+ROW_ESTIMATE_QUERY = """
+SELECT c.relname AS table_name, GREATEST(c.reltuples, 0)::bigint AS row_estimate
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p', 'm')
+"""
+
+COLUMN_STATS_QUERY = """
+SELECT tablename AS table_name, attname AS column_name, null_frac, n_distinct,
+       most_common_vals::text AS most_common_vals
+FROM pg_stats
+WHERE schemaname = current_schema()
+"""
+
+
+def _parse_pg_array(value: Optional[str]) -> List[str]:
+    if not value or not value.startswith("{"):
+        return []
+    reader = csv.reader([value[1:-1]], delimiter=",", quotechar='"', escapechar="\\")
+    return next(reader, [])
+
+
+def _shorten(value, max_length: int = MAX_VALUE_LENGTH) -> str:
+    value = str(value).replace("\n", " ")
+    if len(value) > max_length:
+        return value[: max_length - 1] + "…"
+    return value
+
+
+def collect_table_stats(
+    engine, tables: Optional[List[str]] = None, sample_rows: int = TABLE_STATS_SAMPLE_ROWS
+) -> Dict[str, dict]:
+    """
+    Reads planner statistics and a few sample rows for every table in the current schema.
+
+    Row counts come from `pg_class.reltuples` and column statistics from `pg_stats`, so no table
+    is scanned. Tables that were never analyzed have no column statistics.
+
+    :param engine: The SQLAlchemy engine to read from.
+    :param tables: Restrict collection to these tables.
+    :param sample_rows: Number of sample rows per table. 0 disables sampling.
+    :return: A dict keyed by table name.
+    """
+    stats = {}
+    with engine.connect() as conn:
+        for row in conn.execute(text(ROW_ESTIMATE_QUERY)).mappings():
+            if tables is not None and row["table_name"] not in tables:
+                continue
+            stats[row["table_name"]] = {
+                "row_estimate": int(row["row_estimate"]),
+                "columns": {},
+                "sample": [],
+                "sample_columns": [],
+            }
+
+        for row in conn.execute(text(COLUMN_STATS_QUERY)).mappings():
+            table = stats.get(row["table_name"])
+            if table is None:
+                continue
+            n_distinct = row["n_distinct"]
+            # Negative values are a fraction of the row count
+            if n_distinct is not None and n_distinct < 0:
+                n_distinct = -n_distinct * table["row_estimate"]
+            table["columns"][row["column_name"]] = {
+                "null_frac": row["null_frac"],
+                "n_distinct": int(n_distinct) if n_distinct is not None else None,
+                "most_common_vals": _parse_pg_array(row["most_common_vals"])[
+                    :MAX_COMMON_VALUES
+                ],
+            }
+
+        if sample_rows:
+            preparer = engine.dialect.identifier_preparer
+            for table_name, table in stats.items():
+                try:
+                    result = conn.execute(
+                        text(
+                            f"SELECT * FROM {preparer.quote(table_name)} LIMIT {int(sample_rows)}"
+                        )
+                    )
+                    table["sample_columns"] = list(result.keys())
+                    table["sample"] = [list(r) for r in result]
+                except Exception as e:
+                    conn.rollback()
+                    logging.warning(f"table_stats:sampling {table_name} failed: {e}")
+
+    return stats
+
+
+def collect_generic_table_stats(
+    engine, tables: Optional[List[str]] = None, sample_rows: int = TABLE_STATS_SAMPLE_ROWS
+) -> Dict[str, dict]:
+    """
+    Computes the same statistics as `collect_table_stats` with portable SQL, for databases without
+    planner statistics such as the SQLite and DuckDB stand-ins.
+
+    Unlike `collect_table_stats` this scans every table, so it is meant for small local databases.
+    """
+    stats = {}
+    preparer = engine.dialect.identifier_preparer
+    with engine.connect() as conn:
+        inspector = inspect(conn)
+        for table_name in inspector.get_table_names():
+            if tables is not None and table_name not in tables:
+                continue
+            table = preparer.quote(table_name)
+            row_count = conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar() or 0
+            columns = {}
+            for column in inspector.get_columns(table_name):
+                name = preparer.quote(column["name"])
+                nulls, n_distinct = conn.execute(
+                    text(
+                        f"SELECT COUNT(*) - COUNT({name}), COUNT(DISTINCT {name}) FROM {table}"
+                    )
+                ).one()
+                common = conn.execute(
+                    text(
+                        f"SELECT {name} FROM {table} WHERE {name} IS NOT NULL "
+                        f"GROUP BY {name} HAVING COUNT(*) > 1 "
+                        f"ORDER BY COUNT(*) DESC LIMIT {MAX_COMMON_VALUES}"
+                    )
+                ).scalars()
+                columns[column["name"]] = {
+                    "null_frac": (nulls / row_count) if row_count else 0.0,
+                    "n_distinct": int(n_distinct),
+                    "most_common_vals": [str(v) for v in common],
+                }
+
+            sample_columns, sample = [], []
+            if sample_rows:
+                result = conn.execute(
+                    text(f"SELECT * FROM {table} LIMIT {int(sample_rows)}")
+                )
+                sample_columns = list(result.keys())
+                sample = [list(r) for r in result]
+
+            stats[table_name] = {
+                "row_estimate": int(row_count),
+                "columns": columns,
+                "sample": sample,
+                "sample_columns": sample_columns,
+            }
+    return stats
+
+
+def format_table_stats(table: dict) -> str:
+    """
+    Formats the statistics of one table as a compact markdown section.
+    """
+    output = f"\n### Statistics\n- Approximate rows: {table['row_estimate']:,}\n"
+    for column, column_stats in table["columns"].items():
+        parts = [f"nulls {column_stats['null_frac'] * 100:.0f}%"]
+        if column_stats["n_distinct"] is not None:
+            parts.append(f"~{column_stats['n_distinct']:,} distinct")
+        if column_stats["most_common_vals"]:
+            values = ", ".join(_shorten(v) for v in column_stats["most_common_vals"])
+            parts.append(f"common: {values}")
+        output += f"- {column}: {'; '.join(parts)}\n"
+
+    if table["sample"]:
+        output += "\n### Sample Rows\n"
+        output += "| " + " | ".join(table["sample_columns"]) + " |\n"
+        output += "|" + "---|" * len(table["sample_columns"]) + "\n"
+        for row in table["sample"]:
+            output += "| " + " | ".join(_shorten(v) for v in row) + " |\n"
+    return output
+
+
+class TableStatsCache:
+    """
+    Keeps the latest table statistics snapshot and refreshes it in a background thread.
+
+    `collect` is a callable returning the statistics, such as a backend's `collect_table_stats`.
+    """
+
+    def __init__(self, collect, refresh_interval: float = TABLE_STATS_REFRESH_INTERVAL):
+        self.collect = collect
+        self.refresh_interval = refresh_interval
+        self.refreshed_at = None
+        self._stats: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self) -> Dict[str, dict]:
+        start = time.monotonic()
+        stats = self.collect()
+        self._stats = stats
+        self.refreshed_at = time.time()
+        logging.info(
+            f"table_stats:refreshed {len(stats)} tables in {time.monotonic() - start:.2f}s"
+        )
+        return stats
+
+    def get(self) -> Dict[str, dict]:
+        if self.refreshed_at is None:
+            with self._lock:
+                if self.refreshed_at is None:
+                    self.refresh()
+        return self._stats
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.warning(f"table_stats:refresh failed: {e}")
+
+    def start(self):
+        """
+        Starts the periodic refresh. Does nothing if it is already running.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="table-stats-refresh", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
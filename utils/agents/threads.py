@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import sqlite3
+import uuid
+from typing import List, Optional, Tuple
+
+import aiosqlite
+from langchain_core.messages import convert_to_messages
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+
+CHECKPOINTS_PATH = os.getenv("CHECKPOINTS_PATH", "./checkpoints.sqlite")
+
+
+async def get_async_checkpointer(path: str = CHECKPOINTS_PATH) -> AsyncSqliteSaver:
+    """
+    Returns a SQLite checkpointer for graphs run with `astream`/`ainvoke`.
+
+    It is bound to the running event loop, so call it from the loop that runs the graph.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # WAL is a property of the database file, so a short-lived connection is enough to set it
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+    return AsyncSqliteSaver(await aiosqlite.connect(path))
+
+
+def get_chat_id(body: dict) -> Optional[str]:
+    """
+    Returns the Open WebUI chat id from the request body, if there is one.
+    """
+    metadata = body.get("metadata") or {}
+    return body.get("chat_id") or metadata.get("chat_id")
+
+
+def _text(content) -> str:
+    if isinstance(content, list):
+        return "".join(item.get("text", "") for item in content if isinstance(item, dict))
+    return content or ""
+
+
+def history_digest(messages: List[dict]) -> str:
+    """
+    Hashes the user turns of an Open WebUI conversation.
+
+    Only user messages are hashed: assistant messages are rendered by Open WebUI from the stream
+    and do not round-trip exactly, while user messages do.
+    """
+    turns = [_text(m["content"]) for m in messages if m["role"] == "user"]
+    return hashlib.sha256(json.dumps(turns).encode("utf-8")).hexdigest()
+
+
+def _thread_payload(state, messages: List[dict], digest: str) -> Optional[dict]:
+    """
+    Returns the input that appends the new message to the stored thread, or None if it is out of sync.
+    """
+    if (
+        state.values
+        and not state.next
+        and messages
+        and messages[-1]["role"] == "user"
+        and state.values.get("history_digest") == history_digest(messages[:-1])
+    ):
+        return {"messages": convert_to_messages(messages[-1:]), "history_digest": digest}
+    return None
+
+
+def get_thread_id(chat_id: Optional[str], namespace: Optional[str] = None) -> str:
+    """
+    Returns the checkpoint thread id of a chat, prefixed with `namespace` so pipelines sharing a
+    checkpoint database do not read each other's threads. Without a chat id, a throwaway id.
+    """
+    if chat_id is None:
+        return f"ephemeral-{uuid.uuid4()}"
+    return f"{namespace}:{chat_id}" if namespace else chat_id
+
+
+async def aprepare_thread(
+    graph, messages: List[dict], chat_id: Optional[str], namespace: Optional[str] = None
+) -> Tuple[dict, dict, bool]:
+    """
+    Builds the graph input and config for one turn of a checkpointed conversation.
+
+    When the stored thread matches every earlier user turn, only the new message is sent and the
+    thread keeps its tool calls and outputs from previous turns. Otherwise (first turn, edited
+    or regenerated messages, an interrupted run) the thread is rebuilt from the full history.
+
+    :param graph: The compiled graph, with an async checkpointer.
+    :param messages: The Open WebUI messages of the request.
+    :param chat_id: The Open WebUI chat id. Without one, a throwaway thread is used.
+    :param namespace: Prefix of the thread id, e.g. the pipeline id.
+    :return: The graph input, the run config and whether the thread is throwaway.
+    """
+    ephemeral = chat_id is None
+    thread_id = get_thread_id(chat_id, namespace)
+    config = {"configurable": {"thread_id": thread_id}}
+    digest = history_digest(messages)
+
+    if not ephemeral:
+        state = await graph.aget_state(config)
+        payload = _thread_payload(state, messages, digest)
+        if payload is not None:
+            return payload, config, ephemeral
+
+        if state.values:
+            await graph.checkpointer.adelete_thread(thread_id)
+
+    payload = {"messages": convert_to_messages(messages), "history_digest": digest}
+    return payload, config, ephemeral
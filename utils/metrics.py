@@ -0,0 +1,248 @@
+import bisect
+import hashlib
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Sequence, Tuple
+
+
+# Pipeline the current request runs, the default `pipeline` label of agent side metrics
+CURRENT_PIPELINE: ContextVar[str] = ContextVar("current_pipeline", default="")
+
+# Callers with their own label on per-caller metrics, later callers share the "other" label
+METRICS_MAX_CALLERS = int(os.getenv("METRICS_MAX_CALLERS", "50"))
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if "pipeline" in self.labelnames and not labels.get("pipeline"):
+            labels = {**labels, "pipeline": CURRENT_PIPELINE.get() or "unknown"}
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> [count per bucket (not cumulative) + overflow, sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts, _ = self._values[key]
+            counts[index] += 1
+            self._values[key][1] += value
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(c), total) for key, (c, total) in self._values.items()]
+        lines = self.header()
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += counts[-1]
+            le = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Metrics kept in process memory and rendered in the Prometheus text format on `/metrics`.
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+REQUESTS = METRICS.counter(
+    "pipelines_requests_total",
+    "Chat completion requests by pipeline and outcome.",
+    ("pipeline", "status"),
+)
+REQUEST_DURATION = METRICS.histogram(
+    "pipelines_request_duration_seconds",
+    "Time from receiving a chat completion request to its last byte, streams included.",
+    ("pipeline", "stream"),
+)
+TIME_TO_FIRST_CHUNK = METRICS.histogram(
+    "pipelines_time_to_first_chunk_seconds",
+    "Time from receiving a streaming request to its first content chunk.",
+    ("pipeline",),
+)
+CHUNKS_PER_SECOND = METRICS.histogram(
+    "pipelines_stream_chunks_per_second",
+    "Content chunks per second of a streamed response, after its first chunk.",
+    ("pipeline",),
+    buckets=RATE_BUCKETS,
+)
+QUEUE_WAIT = METRICS.histogram(
+    "pipelines_queue_wait_seconds",
+    "Time a request waited for an execution slot of its pipeline, by hashed caller.",
+    ("pipeline", "caller"),
+)
+ADMISSIONS = METRICS.counter(
+    "pipelines_admissions_total",
+    "Admitted, rejected, timed out and rate limited requests by pipeline and hashed caller.",
+    ("pipeline", "caller", "outcome"),
+)
+LLM_DURATION = METRICS.histogram(
+    "pipelines_llm_call_duration_seconds",
+    "Duration of model calls.",
+    ("pipeline", "model", "status"),
+)
+LLM_TOKENS_PER_SECOND = METRICS.histogram(
+    "pipelines_llm_tokens_per_second",
+    "Output tokens per second of model calls that reported token usage.",
+    ("pipeline", "model"),
+    buckets=RATE_BUCKETS,
+)
+TOOL_DURATION = METRICS.histogram(
+    "pipelines_tool_duration_seconds",
+    "Duration of tool executions.",
+    ("pipeline", "tool", "status"),
+)
+DB_QUERY_DURATION = METRICS.histogram(
+    "pipelines_db_query_duration_seconds",
+    "Duration of SQL queries run by tools, including result cache hits.",
+    ("pipeline", "backend", "cache"),
+)
+
+
+_caller_labels: Dict[str, str] = {}
+_caller_labels_lock = threading.Lock()
+
+
+def caller_label(caller: str) -> str:
+    """
+    The `caller` label of a caller: a short hash, so emails stay out of the metrics. Only the
+    first `METRICS_MAX_CALLERS` callers get their own label, later ones share "other".
+    """
+    with _caller_labels_lock:
+        label = _caller_labels.get(caller)
+        if label is None:
+            if len(_caller_labels) >= METRICS_MAX_CALLERS:
+                return "other"
+            label = hashlib.sha256(caller.encode()).hexdigest()[:8]
+            _caller_labels[caller] = label
+        return label
+
+
+async def measure_stream(pipeline: str, started: float, body):
+    """
+    Passes an SSE response body through, recording its time to first chunk, chunk rate and
+    total duration. SSE comments, e.g. queue positions, are not counted as chunks.
+    """
+    first_chunk_at = None
+    chunks = 0
+    status = "ok"
+    try:
+        async for line in body:
+            if isinstance(line, str) and line.startswith("data:"):
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+                    TIME_TO_FIRST_CHUNK.observe(first_chunk_at - started, pipeline=pipeline)
+                chunks += 1
+            yield line
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        end = time.perf_counter()
+        REQUESTS.inc(pipeline=pipeline, status=status)
+        REQUEST_DURATION.observe(end - started, pipeline=pipeline, stream="true")
+        if first_chunk_at is not None and chunks > 1 and end > first_chunk_at:
+            CHUNKS_PER_SECOND.observe((chunks - 1) / (end - first_chunk_at), pipeline=pipeline)
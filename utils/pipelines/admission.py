@@ -0,0 +1,471 @@
+import asyncio
+import hashlib
+import math
+import os
+import time
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Mapping, Optional
+
+from starlette.responses import StreamingResponse
+
+from utils.metrics import ADMISSIONS, caller_label
+
+
+# Requests a pipeline runs at the same time, 0 for no limit
+PIPELINE_MAX_CONCURRENCY = int(os.getenv("PIPELINE_MAX_CONCURRENCY", "2"))
+# Requests that may wait for a pipeline; beyond that new requests get a 429
+PIPELINE_MAX_QUEUE = int(os.getenv("PIPELINE_MAX_QUEUE", "8"))
+# Seconds a request may wait before it gets a 429
+PIPELINE_MAX_QUEUE_WAIT = float(os.getenv("PIPELINE_MAX_QUEUE_WAIT", "120"))
+# Seconds between queue position updates sent to a waiting streaming client
+QUEUE_POSITION_INTERVAL = float(os.getenv("QUEUE_POSITION_INTERVAL", "2"))
+# Requests one caller may wait with for a pipeline, so a batch of questions cannot fill the queue
+PIPELINE_USER_MAX_QUEUE = int(os.getenv("PIPELINE_USER_MAX_QUEUE", "4"))
+# Requests per minute a caller may start across all pipelines, 0 for no limit
+USER_RATE_LIMIT = float(os.getenv("USER_RATE_LIMIT", "30"))
+# Requests a caller may start in a burst above that rate
+USER_RATE_BURST = float(os.getenv("USER_RATE_BURST", "10"))
+# Share of the queue per caller, e.g. "alice@example.com=2,batch-key=0.5". Others get 1.
+USER_WEIGHTS = os.getenv("USER_WEIGHTS", "")
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    weights = {}
+    for item in value.split(","):
+        if "=" in item:
+            caller, weight = item.rsplit("=", 1)
+            weights[caller.strip()] = float(weight)
+    return weights
+
+
+def caller_id(body: Mapping, headers: Mapping) -> str:
+    """
+    Identifies who sent a chat completion request.
+
+    Open WebUI sends its user in the `user` field of the body, or in X-OpenWebUI-User-* headers
+    when it forwards user info. Other clients are told apart by their API key.
+    """
+    user = body.get("user")
+    if isinstance(user, dict):
+        for key in ("email", "id", "name"):
+            if user.get(key):
+                return str(user[key])
+    elif isinstance(user, str) and user:
+        return user
+    for header in ("x-openwebui-user-email", "x-openwebui-user-id", "x-user-id"):
+        if headers.get(header):
+            return headers[header]
+    authorization = headers.get("authorization", "")
+    if authorization:
+        # Never keep the key itself in the metrics
+        return f"key-{hashlib.sha256(authorization.encode()).hexdigest()[:8]}"
+    return "anonymous"
+
+
+class AdmissionRejected(Exception):
+    """
+    A request that was not admitted, with the seconds after which a retry is likely to succeed.
+    """
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    A request's place in an `AdmissionQueue`, either waiting or holding a slot until released.
+    """
+
+    def __init__(self, queue: "AdmissionQueue", caller: str, finish: float, granted: bool):
+        self.queue = queue
+        self.caller = caller
+        # Virtual finish time of weighted fair queuing, waiting tickets are served lowest first
+        self.finish = finish
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = self.enqueued_at if granted else None
+        self.released = False
+        self._on_release = []
+        self._granted = asyncio.get_running_loop().create_future()
+        if granted:
+            self._granted.set_result(True)
+
+    @property
+    def granted(self) -> bool:
+        return self._granted.done() and not self._granted.cancelled()
+
+    def position(self) -> int:
+        """
+        1-based position in the queue, 0 once the request runs.
+        """
+        return 0 if self.granted else self.queue.position(self)
+
+    def grant(self):
+        self.started_at = time.monotonic()
+        self._granted.set_result(True)
+
+    @property
+    def waited(self) -> float:
+        return (self.started_at or time.monotonic()) - self.enqueued_at
+
+    async def wait(self):
+        """
+        Waits for a slot, raising `AdmissionRejected` once the maximum queue wait has passed.
+        """
+        async for _ in self.positions(interval=None):
+            pass
+
+    async def positions(
+        self, interval: Optional[float] = QUEUE_POSITION_INTERVAL
+    ) -> AsyncIterator[int]:
+        """
+        Yields the queue position right away and then every `interval` seconds until a slot is
+        granted. Raises `AdmissionRejected` once the maximum queue wait has passed.
+        """
+        deadline = self.enqueued_at + self.queue.max_queue_wait
+        while not self.granted:
+            yield self.position()
+            timeout = deadline - time.monotonic()
+            if interval is not None:
+                timeout = min(timeout, interval)
+            try:
+                await asyncio.wait_for(asyncio.shield(self._granted), max(timeout, 0))
+            except asyncio.TimeoutError:
+                if not self.granted and time.monotonic() >= deadline:
+                    self.queue.count(self.caller, "timed_out")
+                    self.release()
+                    raise AdmissionRejected(
+                        f"Waited {self.queue.max_queue_wait:.0f}s for {self.queue.name}",
+                        self.queue.retry_after(),
+                    )
+
+    def release(self):
+        """
+        Frees the slot, or leaves the queue if the request is still waiting. Safe to call twice.
+        """
+        if self.released:
+            return
+        self.released = True
+        self.queue.release(self)
+        for callback in self._on_release:
+            callback()
+
+    def on_release(self, callback):
+        """
+        Calls `callback()` when the ticket is released.
+        """
+        self._on_release.append(callback)
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per minute on average, and bursts of up to `burst` requests.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate / 60
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    @property
+    def full(self) -> bool:
+        """
+        Whether the bucket has refilled, i.e. behaves like a new one.
+        """
+        self.refill(time.monotonic())
+        return self.tokens >= self.burst
+
+    def take(self) -> float:
+        """
+        Takes a token and returns 0, or returns the seconds until one is available.
+        """
+        self.refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    A token bucket per caller, shared by all pipelines.
+
+    Buckets that have refilled are dropped, as a new bucket is the same, so the limiter only keeps
+    callers seen within the time a bucket takes to refill.
+    """
+
+    def __init__(self, rate: float = USER_RATE_LIMIT, burst: float = USER_RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.limited: Dict[str, int] = defaultdict(int)
+        # Seconds an empty bucket takes to refill, the interval between prunes
+        self.prune_interval = burst / (rate / 60) if rate else 0.0
+        self.pruned_at = time.monotonic()
+
+    def check(self, caller: str):
+        """
+        Raises `AdmissionRejected` if the caller has used up its rate.
+        """
+        if not self.rate:
+            return
+        if time.monotonic() - self.pruned_at >= self.prune_interval:
+            self.prune()
+        if caller not in self.buckets:
+            self.buckets[caller] = TokenBucket(self.rate, self.burst)
+        wait = self.buckets[caller].take()
+        if wait:
+            self.limited[caller] += 1
+            ADMISSIONS.inc(caller=caller_label(caller), outcome="rate_limited")
+            raise AdmissionRejected(
+                f"Rate limit of {self.rate:g} requests per minute reached", math.ceil(wait)
+            )
+
+    def prune(self):
+        """
+        Drops the buckets of callers that have not been limited for long enough to refill. Their
+        `limited` counts are kept.
+        """
+        self.pruned_at = time.monotonic()
+        for caller in [caller for caller, bucket in self.buckets.items() if bucket.full]:
+            del self.buckets[caller]
+
+    def stats(self) -> dict:
+        stats = {}
+        for caller in {**self.buckets, **self.limited}:
+            # A dropped bucket was full
+            bucket = self.buckets.get(caller)
+            tokens = bucket.tokens if bucket else self.burst
+            stats[caller] = {
+                "tokens": round(tokens, 2),
+                "rate_limited": self.limited.get(caller, 0),
+            }
+        return stats
+
+
+CALLER_STATS = (
+    "admitted",
+    "rejected",
+    "timed_out",
+    "running",
+    "waiting",
+    "wait_seconds",
+    "max_wait_seconds",
+)
+
+
+class AdmissionQueue:
+    """
+    Bounded concurrency for one pipeline, with a bounded queue in front of it.
+
+    A single local model serves requests faster one or two at a time than all at once, so requests
+    beyond `max_concurrency` wait their turn, and requests beyond `max_queue` are turned away with a
+    retry hint instead of making everyone slower.
+
+    Waiting requests are served by weighted fair queuing rather than in arrival order: each gets
+    a virtual finish time one unit (divided by its caller's weight) after the caller's previous
+    request, so someone asking one question is served before the rest of another caller's batch.
+
+    A caller with no running or waiting request whose last finish time the virtual time has
+    passed no longer affects the order, so its finish time is dropped. Once nothing runs or waits,
+    the virtual time moves to the latest finish time, as when a busy period of WFQ ends, and every
+    finish time is dropped. The per-caller counters in `callers` are kept.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int = PIPELINE_MAX_CONCURRENCY,
+        max_queue: int = PIPELINE_MAX_QUEUE,
+        max_queue_wait: float = PIPELINE_MAX_QUEUE_WAIT,
+        user_max_queue: int = PIPELINE_USER_MAX_QUEUE,
+        weights: Optional[Dict[str, float]] = None,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_wait = max_queue_wait
+        self.user_max_queue = user_max_queue
+        self.weights = parse_weights(USER_WEIGHTS) if weights is None else weights
+        self.running = 0
+        self.waiting = []
+        # Virtual time: the finish time of the request that got the last slot
+        self.virtual_time = 0.0
+        self.last_finish: Dict[str, float] = {}
+        # Per caller counters, see `CALLER_STATS`
+        self.callers: Dict[str, Dict[str, float]] = defaultdict(
+            lambda: dict.fromkeys(CALLER_STATS, 0)
+        )
+        # Moving average of how long a request holds a slot, for the Retry-After estimate
+        self.average_duration = 10.0
+
+    def admit(self, caller: str = "anonymous") -> Ticket:
+        """
+        Returns a ticket that already holds a slot or waits for one. Raises `AdmissionRejected`
+        if the queue, or the caller's share of it, is full.
+        """
+        stats = self.callers[caller]
+        start = max(self.virtual_time, self.last_finish.get(caller, 0.0))
+        finish = start + 1 / self.weights.get(caller, 1.0)
+
+        if not self.max_concurrency or (
+            self.running < self.max_concurrency and not self.waiting
+        ):
+            self.last_finish[caller] = finish
+            self.virtual_time = max(self.virtual_time, start)
+            return self._start(Ticket(self, caller, finish, granted=True))
+
+        if len(self.waiting) >= self.max_queue or (
+            self.user_max_queue and stats["waiting"] >= self.user_max_queue
+        ):
+            self.count(caller, "rejected")
+            raise AdmissionRejected(
+                f"{self.name} has {len(self.waiting)} requests waiting", self.retry_after()
+            )
+        self.last_finish[caller] = finish
+        ticket = Ticket(self, caller, finish, granted=False)
+        self.waiting.append(ticket)
+        stats["waiting"] += 1
+        return ticket
+
+    def _start(self, ticket: Ticket) -> Ticket:
+        self.running += 1
+        self.count(ticket.caller, "admitted")
+        self.callers[ticket.caller]["running"] += 1
+        return ticket
+
+    def count(self, caller: str, outcome: str):
+        """
+        Counts an admission outcome of a caller, in `callers` and in the metrics.
+        """
+        self.callers[caller][outcome] += 1
+        ADMISSIONS.inc(caller=caller_label(caller), outcome=outcome)
+
+    def position(self, ticket: Ticket) -> int:
+        if ticket not in self.waiting:
+            return 0
+        return 1 + sum(1 for other in self.waiting if other.finish < ticket.finish)
+
+    def release(self, ticket: Ticket):
+        stats = self.callers[ticket.caller]
+        if not ticket.granted:
+            self.waiting.remove(ticket)
+            stats["waiting"] -= 1
+        else:
+            duration = time.monotonic() - ticket.started_at
+            self.average_duration = 0.8 * self.average_duration + 0.2 * duration
+            self.running -= 1
+            stats["running"] -= 1
+            # The freed slot goes straight to the next request, so a new one cannot overtake it
+            if self.waiting and (not self.max_concurrency or self.running < self.max_concurrency):
+                self._grant_next()
+        self.prune()
+
+    def prune(self):
+        """
+        Drops the finish times of callers that are idle and behind the virtual time.
+        """
+        if not self.running and not self.waiting and self.last_finish:
+            self.virtual_time = max(self.virtual_time, *self.last_finish.values())
+        idle = [
+            caller
+            for caller, finish in self.last_finish.items()
+            if not self.callers[caller]["running"]
+            and not self.callers[caller]["waiting"]
+            and finish <= self.virtual_time
+        ]
+        for caller in idle:
+            del self.last_finish[caller]
+
+    def _grant_next(self):
+        ticket = min(self.waiting, key=lambda t: (t.finish, t.enqueued_at))
+        self.waiting.remove(ticket)
+        start = ticket.finish - 1 / self.weights.get(ticket.caller, 1.0)
+        self.virtual_time = max(self.virtual_time, start)
+        stats = self.callers[ticket.caller]
+        stats["waiting"] -= 1
+        self._start(ticket)
+        ticket.grant()
+        stats["wait_seconds"] += ticket.waited
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], ticket.waited)
+
+    def retry_after(self) -> int:
+        """
+        Seconds until the current queue has likely drained.
+        """
+        slots = self.max_concurrency or 1
+        return max(1, math.ceil(self.average_duration * (len(self.waiting) + 1) / slots))
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "waiting": len(self.waiting),
+            "rejected": sum(stats["rejected"] for stats in self.callers.values()),
+            "timed_out": sum(stats["timed_out"] for stats in self.callers.values()),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "max_queue_wait": self.max_queue_wait,
+            "average_duration": round(self.average_duration, 3),
+            "callers": {
+                caller: {
+                    **stats,
+                    "weight": self.weights.get(caller, 1.0),
+                    "wait_seconds": round(stats["wait_seconds"], 3),
+                    "max_wait_seconds": round(stats["max_wait_seconds"], 3),
+                }
+                for caller, stats in self.callers.items()
+            },
+        }
+
+
+async def stream_when_admitted(ticket: Ticket, body: AsyncIterator, error_line):
+    """
+    Streams a response body once the ticket holds a slot, and releases it when the body is done.
+
+    While the request waits, its queue position is sent as SSE comments, which clients ignore but
+    which keep the connection alive. If the wait times out, `error_line(rejection)` is sent instead
+    of the body, since the 200 status has already gone out.
+    """
+    try:
+        try:
+            async for position in ticket.positions():
+                yield f": queued, position {position}\n\n"
+        except AdmissionRejected as e:
+            yield error_line(e)
+            return
+        async for chunk in body:
+            yield chunk
+    finally:
+        ticket.release()
+
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    Sends a streaming response, then releases its ticket.
+
+    The body's own `finally` only runs once the body has been started, so a client that
+    disconnects before the first chunk would otherwise hold its slot forever. Releasing here
+    always runs once the response is sent or aborted; `Ticket.release` is safe to call twice.
+    """
+
+    def __init__(self, response: StreamingResponse, ticket: Ticket):
+        super().__init__(
+            response.body_iterator,
+            status_code=response.status_code,
+            media_type=response.media_type,
+            background=response.background,
+        )
+        self.raw_headers = response.raw_headers
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.ticket.release()
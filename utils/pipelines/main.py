@@ -9,6 +9,10 @@ from typing import get_type_hints, Literal, Tuple
 
 
 def stream_message_template(model: str, message: str):
+    return stream_delta_template(model, {"content": message})
+
+
+def stream_delta_template(model: str, delta: dict):
     return {
         "id": f"{model}-{str(uuid.uuid4())}",
         "object": "chat.completion.chunk",
@@ -17,7 +21,7 @@ def stream_message_template(model: str, message: str):
         "choices": [
             {
                 "index": 0,
-                "delta": {"content": message},
+                "delta": delta,
                 "logprobs": None,
                 "finish_reason": None,
             }
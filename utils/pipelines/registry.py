@@ -0,0 +1,65 @@
+import hashlib
+import json
+import time
+from types import MappingProxyType
+from typing import Callable, List, Mapping
+
+
+class RegistrySnapshot:
+    """
+    An immutable view of the loaded pipelines, replaced as a whole whenever they change.
+
+    Request handlers read the current snapshot once and use it for the whole request without
+    locking: a reload only builds a new snapshot and swaps the reference. The `/models` response
+    is rendered once per snapshot, with an ETag derived from its content.
+    """
+
+    __slots__ = (
+        "version",
+        "created",
+        "pipelines",
+        "modules",
+        "names",
+        "models_body",
+        "models_etag",
+    )
+
+    def __init__(
+        self,
+        version: int,
+        pipelines: dict,
+        modules: dict,
+        names: dict,
+        render_models: Callable[[Mapping, int], dict],
+    ):
+        """
+        :param version: Increases with every rebuild.
+        :param pipelines: Pipeline id -> description, as returned by `get_all_pipelines`.
+        :param modules: Pipeline id -> loaded Pipeline instance.
+        :param names: Pipeline id -> module name.
+        :param render_models: Builds the `/models` response from the pipelines and a timestamp.
+        """
+        created = int(time.time())
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "created", created)
+        object.__setattr__(self, "pipelines", MappingProxyType(dict(pipelines)))
+        object.__setattr__(self, "modules", MappingProxyType(dict(modules)))
+        object.__setattr__(self, "names", MappingProxyType(dict(names)))
+
+        body = json.dumps(render_models(self.pipelines, created)).encode("utf-8")
+        object.__setattr__(self, "models_body", body)
+        object.__setattr__(
+            self, "models_etag", f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RegistrySnapshot is immutable, build a new one instead")
+
+    def etag_matches(self, if_none_match: str) -> bool:
+        """
+        Whether an If-None-Match header names the current `/models` response.
+        """
+        if not if_none_match:
+            return False
+        tags: List[str] = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or self.models_etag in tags or f"W/{self.models_etag}" in tags
@@ -0,0 +1,131 @@
+import asyncio
+import os
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+
+def module_files(directory: str) -> Dict[str, str]:
+    """
+    Module name -> path of the pipeline files in a directory.
+    """
+    return {
+        filename[:-3]: os.path.join(directory, filename)
+        for filename in os.listdir(directory)
+        if filename.endswith(".py")
+    }
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """
+    Modification time and size of a file, or None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class InFlight:
+    """
+    Counts the requests running on each pipeline instance, so a replaced instance is only shut
+    down once the requests it already accepted are done.
+    """
+
+    def __init__(self):
+        self.counts: Dict[int, int] = defaultdict(int)
+        self.idle: Dict[int, asyncio.Event] = {}
+
+    def enter(self, pipeline):
+        key = id(pipeline)
+        self.counts[key] += 1
+        if key in self.idle:
+            self.idle[key].clear()
+
+    def exit(self, pipeline):
+        key = id(pipeline)
+        self.counts[key] -= 1
+        if self.counts[key] <= 0:
+            del self.counts[key]
+            if key in self.idle:
+                self.idle[key].set()
+
+    def running(self, pipeline) -> int:
+        return self.counts.get(id(pipeline), 0)
+
+    async def drain(self, pipeline, timeout: float) -> bool:
+        """
+        Waits until no request runs on the pipeline instance. Returns False on timeout.
+        """
+        key = id(pipeline)
+        if not self.counts.get(key):
+            return True
+        event = self.idle.setdefault(key, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.idle.pop(key, None)
+
+
+# Open WebUI pipelines set their type ("filter", "manifold") and id in `__init__`, so a module
+# whose source mentions any of these has to be imported to be listed correctly
+EAGER_SOURCE_MARKERS = ("self.type", "self.id", "manifold", "filter")
+
+
+def can_be_lazy(source: str) -> bool:
+    """
+    Whether a module is known to be a plain pipe with the module name as id without importing it.
+    """
+    return not any(marker in source for marker in EAGER_SOURCE_MARKERS)
+
+
+class LazyPipeline:
+    """
+    Stands in for a pipeline that is listed from its frontmatter but not imported yet.
+
+    Only modules that `can_be_lazy` are listed this way, as plain pipes named after the module.
+    It has no `pipe` or `valves`; the server loads the real pipeline on the first request for it.
+    """
+
+    lazy = True
+
+    def __init__(self, id: str, name: str):
+        self.id = id
+        self.name = name
+
+
+def is_lazy(pipeline) -> bool:
+    return getattr(pipeline, "lazy", False) is True
+
+
+class LoadingPipeline:
+    """
+    Stands in for a pipeline whose requirements are being installed, listed from its frontmatter.
+
+    `status` is "loading" until the install is done and the real pipeline replaces it, or "failed"
+    with the `error` if the install failed.
+    """
+
+    def __init__(self, id: str, name: str):
+        self.id = id
+        self.name = name
+        self.status = "loading"
+        self.error = None
+
+
+def is_placeholder(pipeline) -> bool:
+    return is_lazy(pipeline) or isinstance(pipeline, LoadingPipeline)
+
+
+def pipeline_status(pipeline) -> str:
+    """
+    "ready", "lazy" (loads on its first request), "loading" or "failed".
+    """
+    if is_lazy(pipeline):
+        return "lazy"
+    if isinstance(pipeline, LoadingPipeline):
+        return pipeline.status
+    return "ready"
@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def parse_requirements(value: str) -> List[str]:
+    """
+    The requirements of a frontmatter `requirements: pandas, duckdb>=1.2` line, sorted and unique.
+    """
+    return sorted({req.strip() for req in (value or "").split(",") if req.strip()})
+
+
+class RequirementsInstaller:
+    """
+    Installs the frontmatter requirements of pipelines with pip, in the background.
+
+    Installed requirement sets are remembered by a hash of their content (and the Python version)
+    in `installed.json`, so a reload or restart does not run pip again for the same set. pip runs
+    as a subprocess, one install at a time, without blocking the event loop. Worker processes
+    sharing `cache_dir` also take turns, through a lock file, and skip sets another one installed.
+
+    With `isolated`, each set is installed into its own directory under `cache_dir` with
+    `pip install --target`, which is put in front of `sys.path` before the pipeline is imported.
+    Pipelines share one interpreter, so this keeps their packages out of the server's environment
+    but does not separate pipelines that import the same package in different versions.
+    """
+
+    def __init__(self, cache_dir: str, isolated: bool = False):
+        self.cache_dir = cache_dir
+        self.isolated = isolated
+        self.cache_path = os.path.join(cache_dir, "installed.json")
+        self.installed: Dict[str, dict] = {}
+        self._installs: Dict[str, asyncio.Task] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.cache_path, "r") as f:
+                self.installed = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def reset_lock(self):
+        """
+        Drops the lock and finished installs of a previous event loop, e.g. in a forked worker.
+        """
+        self._lock = None
+        self._installs.clear()
+
+    def key(self, requirements: List[str]) -> str:
+        content = "\n".join([sys.version, str(self.isolated), *requirements])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+    def target(self, requirements: List[str]) -> str:
+        return os.path.join(self.cache_dir, self.key(requirements))
+
+    def is_installed(self, requirements: List[str]) -> bool:
+        if not requirements:
+            return True
+        if self.key(requirements) not in self.installed:
+            return False
+        return not self.isolated or os.path.isdir(self.target(requirements))
+
+    def activate(self, requirements: List[str]):
+        """
+        Makes installed requirements importable; only needed for isolated installs.
+        """
+        if self.isolated and requirements:
+            target = self.target(requirements)
+            if target not in sys.path:
+                sys.path.insert(0, target)
+
+    def install(self, requirements: List[str]) -> asyncio.Task:
+        """
+        Starts installing a requirement set, or returns the install already running for it.
+        """
+        key = self.key(requirements)
+        if key not in self._installs or (
+            self._installs[key].done() and self._installs[key].exception() is not None
+        ):
+            self._installs[key] = asyncio.create_task(self._install(key, requirements))
+        return self._installs[key]
+
+    async def _install(self, key: str, requirements: List[str]):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            lock_file = await asyncio.to_thread(self._lock_file)
+            try:
+                await self._install_locked(key, requirements)
+            finally:
+                lock_file.close()
+
+    def _lock_file(self):
+        """
+        Opens and locks the cache directory's lock file, waiting for other processes' installs.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.cache_dir, ".lock"), "w")
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    async def _install_locked(self, key: str, requirements: List[str]):
+        # Another worker may have installed the set meanwhile
+        self._load()
+        if self.is_installed(requirements):
+            return
+        command = [sys.executable, "-m", "pip", "install"]
+        if self.isolated:
+            command += ["--target", self.target(requirements)]
+        logging.info(f"Installing requirements: {', '.join(requirements)}")
+        start = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            *requirements,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        output, _ = await process.communicate()
+        if process.returncode != 0:
+            tail = output.decode("utf-8", "replace").strip().splitlines()[-5:]
+            raise RuntimeError(
+                f"pip install {' '.join(requirements)} failed: {' '.join(tail)}"
+            )
+        self.installed[key] = {
+            "requirements": requirements,
+            "seconds": round(time.perf_counter() - start, 3),
+            "installed_at": int(time.time()),
+        }
+        self._save()
+        logging.info(f"Installed requirements: {', '.join(requirements)}")
+
+    def _save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = f"{self.cache_path}.tmp"
+        with open(path, "w") as f:
+            json.dump(self.installed, f, indent=2)
+        os.replace(path, self.cache_path)
@@ -0,0 +1,232 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import AsyncIterator, Iterator
+
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Coalesce streamed text for up to this many milliseconds (0 sends every chunk as it comes)
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "0"))
+# Send the coalesced text early once it reaches this many characters
+SSE_COALESCE_CHARS = int(os.getenv("SSE_COALESCE_CHARS", "512"))
+
+
+if orjson is not None:
+
+    def dumps(value) -> str:
+        return orjson.dumps(value).decode("utf-8")
+
+else:
+
+    def dumps(value) -> str:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class StreamEncoder:
+    """
+    Encodes the lines yielded by a pipe as OpenAI chat completion chunk events.
+
+    The envelope (id, created, model) is the same for every chunk of a response, so it is rendered
+    once and only the delta is serialized per chunk, with orjson when it is installed.
+    """
+
+    def __init__(self, model: str):
+        self.envelope = {
+            "id": f"{model}-{uuid.uuid4()}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+        }
+        envelope = dumps(self.envelope)
+        self._head = f'data: {envelope[:-1]},"choices":[{{"index":0,"delta":'
+        self._tail = ',"logprobs":null,"finish_reason":null}]}\n\n'
+        self.finish = (
+            f'data: {envelope[:-1]},"choices":[{{"index":0,"delta":{{}},'
+            '"logprobs":null,"finish_reason":"stop"}]}\n\n'
+        )
+
+    def delta(self, delta: dict) -> str:
+        return f"{self._head}{dumps(delta)}{self._tail}"
+
+    def content(self, text: str) -> str:
+        return f'{self._head}{{"content":{dumps(text)}}}{self._tail}'
+
+    def metadata(self, fields: dict) -> str:
+        """
+        A chunk without choices carrying top-level fields, like the usage chunk of OpenAI streams.
+        """
+        return f"data: {dumps({**self.envelope, 'choices': [], **fields})}\n\n"
+
+    def encode(self, line) -> str:
+        """
+        Encodes one line of a pipe: text, a delta dict, {"metadata": {...}} with top-level fields of
+        the completion, a pydantic model or a ready "data:" event.
+        """
+        if isinstance(line, str) and not line.startswith("data:"):
+            return self.content(line)
+        if isinstance(line, dict) and "metadata" in line:
+            return self.metadata(line["metadata"])
+        if isinstance(line, dict):
+            # A delta with fields besides the content, e.g. {"reasoning_content": "..."}
+            return self.delta(line)
+        if isinstance(line, BaseModel):
+            line = f"data: {line.model_dump_json()}"
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if line.startswith("data:"):
+            return f"{line}\n\n"
+        return self.content(line)
+
+
+def _coalesce_key(line):
+    """
+    Returns which delta field a line adds text to, or None if it cannot be merged with others.
+    """
+    if isinstance(line, str) and not line.startswith("data:"):
+        return "content"
+    if isinstance(line, dict) and len(line) == 1:
+        key, value = next(iter(line.items()))
+        if isinstance(value, str):
+            return key
+    return None
+
+
+def _line_text(line) -> str:
+    return line if isinstance(line, str) else next(iter(line.values()))
+
+
+class _Buffer:
+    def __init__(self):
+        self.key = None
+        self.parts = []
+        self.size = 0
+        self.started_at = 0.0
+
+    def add(self, key, text: str):
+        if not self.parts:
+            self.started_at = time.monotonic()
+        self.key = key
+        self.parts.append(text)
+        self.size += len(text)
+
+    def take(self):
+        text = "".join(self.parts)
+        line = text if self.key == "content" else {self.key: text}
+        self.key, self.parts, self.size = None, [], 0
+        return line
+
+
+def coalesce(
+    lines: Iterator, max_delay: float = SSE_COALESCE_MS / 1000, max_chars: int = SSE_COALESCE_CHARS
+) -> Iterator:
+    """
+    Merges consecutive text lines of a synchronous pipe into fewer, larger ones.
+
+    Buffered text is sent once it is `max_delay` seconds old or `max_chars` long. Without a timer,
+    the age is checked when the next line arrives.
+    """
+    buffer = _Buffer()
+    for line in lines:
+        key = _coalesce_key(line)
+        if buffer.parts and key != buffer.key:
+            yield buffer.take()
+        if key is None:
+            yield line
+            continue
+        buffer.add(key, _line_text(line))
+        if buffer.size >= max_chars or time.monotonic() - buffer.started_at >= max_delay:
+            yield buffer.take()
+    if buffer.parts:
+        yield buffer.take()
+
+
+async def acoalesce(
+    lines: AsyncIterator,
+    max_delay: float = SSE_COALESCE_MS / 1000,
+    max_chars: int = SSE_COALESCE_CHARS,
+) -> AsyncIterator:
+    """
+    Merges consecutive text lines of an async pipe into fewer, larger ones.
+
+    Buffered text is sent once it is `max_delay` seconds old, even while the pipe is waiting for
+    its next token, or once it is `max_chars` long.
+    """
+    buffer = _Buffer()
+    iterator = lines.__aiter__()
+    next_line = None
+    try:
+        while True:
+            if next_line is None:
+                next_line = asyncio.ensure_future(iterator.__anext__())
+            if buffer.parts:
+                timeout = max(buffer.started_at + max_delay - time.monotonic(), 0)
+                done, _ = await asyncio.wait({next_line}, timeout=timeout)
+                if not done:
+                    # The pipe is slow, send what is buffered and keep waiting for the same line
+                    yield buffer.take()
+                    continue
+            try:
+                line = await next_line
+            except StopAsyncIteration:
+                break
+            next_line = None
+
+            key = _coalesce_key(line)
+            if buffer.parts and key != buffer.key:
+                yield buffer.take()
+            if key is None:
+                yield line
+                continue
+            buffer.add(key, _line_text(line))
+            if buffer.size >= max_chars:
+                yield buffer.take()
+        if buffer.parts:
+            yield buffer.take()
+    finally:
+        if next_line is not None and not next_line.done():
+            next_line.cancel()
+
+
+def benchmark(chunks: int = 200_000, model: str = "data_analyst") -> dict:
+    """
+    Measures encoded chunks per second of the original per-chunk templating and of StreamEncoder.
+    """
+    from utils.pipelines.main import stream_message_template
+
+    tokens = [f"token{i % 97} " for i in range(chunks)]
+    results = {}
+
+    start = time.perf_counter()
+    for token in tokens:
+        f"data: {json.dumps(stream_message_template(model, token))}\n\n"
+    results["template_json_dumps"] = chunks / (time.perf_counter() - start)
+
+    encoder = StreamEncoder(model)
+    start = time.perf_counter()
+    for token in tokens:
+        encoder.encode(token)
+    results[f"stream_encoder_{'orjson' if orjson else 'json'}"] = chunks / (
+        time.perf_counter() - start
+    )
+
+    start = time.perf_counter()
+    events = 0
+    for line in coalesce(iter(tokens), max_delay=float("inf"), max_chars=SSE_COALESCE_CHARS):
+        encoder.encode(line)
+        events += 1
+    results["stream_encoder_coalesced"] = chunks / (time.perf_counter() - start)
+    results["coalesced_events"] = events
+
+    return {key: round(value) for key, value in results.items()}
+
+
+if __name__ == "__main__":
+    print(benchmark())
@@ -0,0 +1,217 @@
+import asyncio
+import gc
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import time
+from typing import Awaitable, Callable, Optional
+
+
+# Directory of the workers' channel sockets. Set by `serve`; set it yourself to connect workers
+# started another way, e.g. `uvicorn --workers N`.
+CHANNEL_DIR_ENV = "PIPELINES_CHANNEL_DIR"
+
+# Seconds before a worker that exited unexpectedly is started again
+RESTART_DELAY = 1.0
+
+
+def write_json_atomic(path: str, data):
+    """
+    Writes JSON to a file by renaming a complete temporary file over it, so other processes
+    never read a partly written file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class WorkerChannel:
+    """
+    Broadcasts events, e.g. valves updates and reloads, to the other worker processes of the
+    server.
+
+    Each worker binds a Unix datagram socket named after its pid in a shared directory, and
+    sends an event to every other socket in it. Sockets of workers that are gone are removed.
+    Without a directory (a single process) or Unix sockets, broadcasting does nothing.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self.sock: Optional[socket.socket] = None
+        self.path = None
+        self.handler: Optional[Callable[[dict], Awaitable]] = None
+        self._tasks = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sock is not None
+
+    def start(self, handler: Callable[[dict], Awaitable]):
+        """
+        Starts receiving the other workers' events on the running event loop.
+        """
+        self.directory = self.directory or os.getenv(CHANNEL_DIR_ENV)
+        if not self.directory:
+            return
+        if not hasattr(socket, "AF_UNIX"):
+            logging.warning("Unix sockets are not available, workers will not share events")
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+        self.handler = handler
+        asyncio.get_running_loop().add_reader(self.sock.fileno(), self._receive)
+        logging.info(f"Worker {os.getpid()} listening for events on {self.path}")
+
+    def stop(self):
+        if self.sock is None:
+            return
+        asyncio.get_running_loop().remove_reader(self.sock.fileno())
+        self.sock.close()
+        self.sock = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def broadcast(self, event: dict):
+        """
+        Sends an event to every other worker. Delivery is best effort: a worker that is starting
+        or stopping may miss it.
+        """
+        if self.sock is None:
+            return
+        data = json.dumps({**event, "sender": os.getpid()}).encode("utf-8")
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if not filename.endswith(".sock") or path == self.path:
+                continue
+            try:
+                self.sock.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that exited
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except OSError as e:
+                logging.warning(f"Could not send {event.get('type')} event to {path}: {e}")
+
+    def _receive(self):
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            try:
+                event = json.loads(data)
+            except ValueError:
+                logging.warning("Ignoring a malformed worker event")
+                continue
+            task = asyncio.create_task(self._handle(event))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, event: dict):
+        try:
+            await self.handler(event)
+        except Exception as e:
+            logging.error(
+                f"Handling {event.get('type')} event from {event.get('sender')} failed: {e}"
+            )
+
+
+def serve(
+    app,
+    host: str,
+    port: int,
+    workers: int,
+    preload: Optional[Callable[[], None]] = None,
+    **config,
+):
+    """
+    Runs the app in `workers` forked processes that share one listening socket.
+
+    `preload` runs in the parent before forking, so the modules and objects it loads are shared
+    by the workers copy-on-write instead of being loaded by each. It must not leave threads, open
+    connections or a running event loop behind. Workers that exit unexpectedly are restarted;
+    SIGINT or SIGTERM stops them all.
+
+    :param config: Further `uvicorn.Config` options.
+    """
+    import uvicorn
+
+    directory = tempfile.mkdtemp(prefix="pipelines-workers-")
+    os.environ[CHANNEL_DIR_ENV] = directory
+
+    if preload:
+        preload()
+    uvicorn_config = uvicorn.Config(app, host=host, port=port, **config)
+    sock = uvicorn_config.bind_socket()
+    # Objects created so far are never collected, so the collector does not write to (and copy)
+    # their pages in every worker
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                uvicorn.Server(uvicorn_config).run(sockets=[sock])
+            finally:
+                os._exit(0)
+        children[pid] = index
+        logging.info(f"Started worker {index} (pid {pid})")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for index in range(workers):
+        spawn(index)
+
+    try:
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            index = children.pop(pid, None)
+            # A worker killed without shutting down leaves its channel socket behind
+            try:
+                os.unlink(os.path.join(directory, f"{pid}.sock"))
+            except FileNotFoundError:
+                pass
+            if index is None or stopping:
+                continue
+            logging.warning(f"Worker {index} (pid {pid}) exited with status {status}, restarting")
+            time.sleep(RESTART_DELAY)
+            if not stopping:
+                spawn(index)
+    finally:
+        sock.close()
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,363 @@
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+
+# Comma separated exporters: "jsonl" (OTLP-like span lines) and/or "chrome" (one trace file per
+# request, for chrome://tracing or https://ui.perfetto.dev). Tracing is off when empty.
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "")
+TRACING_PATH = os.getenv("TRACING_PATH", "./traces")
+# Spans kept per unfinished trace by the chrome exporter
+TRACING_MAX_SPANS = int(os.getenv("TRACING_MAX_SPANS", "10000"))
+
+# Statements longer than this are truncated in the db.statement attribute
+MAX_STATEMENT_LENGTH = 2000
+
+
+class Span:
+    """
+    A timed operation of a trace, following the OpenTelemetry span data model: 128 bit trace and
+    64 bit span ids in hex, a parent span id, Unix nanosecond timestamps, attributes, events and
+    a status of "UNSET", "OK" or "ERROR".
+    """
+
+    def __init__(
+        self,
+        name: str,
+        parent: Optional["Span"] = None,
+        attributes: Optional[dict] = None,
+    ):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.events: List[dict] = []
+        self.status = "UNSET"
+        self.status_message = None
+        self.thread_id = threading.get_native_id()
+        self.start_time = time.time_ns()
+        self.end_time = None
+
+    @property
+    def recording(self) -> bool:
+        return True
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def set_status(self, status: str, message: Optional[str] = None):
+        self.status = status
+        self.status_message = message
+
+    def record_exception(self, error: BaseException):
+        self.events.append(
+            {
+                "name": "exception",
+                "time": time.time_ns(),
+                "attributes": {
+                    "exception.type": type(error).__name__,
+                    "exception.message": str(error),
+                },
+            }
+        )
+        self.set_status("ERROR", str(error))
+
+    def end(self):
+        # Ending twice, e.g. from a callback and a finally block, only exports once
+        if self.end_time is not None:
+            return
+        self.end_time = time.time_ns()
+        TRACER.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_time,
+            "endTimeUnixNano": self.end_time,
+            "attributes": self.attributes,
+            "events": self.events,
+            "status": {"code": self.status, "message": self.status_message},
+            "threadId": self.thread_id,
+        }
+
+
+class NoopSpan:
+    """
+    The span handed out when tracing is off; recording into it costs nothing.
+    """
+
+    recording = False
+    trace_id = span_id = None
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def set_status(self, status: str, message: Optional[str] = None):
+        pass
+
+    def record_exception(self, error: BaseException):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+# Span new spans are parented to when no parent is given
+CURRENT_SPAN: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class JsonlExporter:
+    """
+    Appends every finished span as a JSON line to `spans.jsonl`.
+    """
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, "spans.jsonl")
+
+    def export(self, span: Span):
+        return [(self.path, "a", json.dumps(span.to_dict(), default=str) + "\n")]
+
+
+class ChromeTraceExporter:
+    """
+    Writes each trace to `<trace id>.json` in the Chrome trace event format once its root span
+    ends. Spans are complete ("X") events on the thread that started them.
+    """
+
+    def __init__(self, directory: str, max_spans: int = TRACING_MAX_SPANS):
+        self.directory = directory
+        self.max_spans = max_spans
+        self.traces: Dict[str, List[Span]] = {}
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        with self._lock:
+            spans = self.traces.setdefault(span.trace_id, [])
+            if len(spans) < self.max_spans:
+                spans.append(span)
+            if span.parent_span_id is not None:
+                return []
+            spans = self.traces.pop(span.trace_id)
+
+        origin = min(s.start_time for s in spans)
+        events = [
+            {
+                "name": s.name,
+                "ph": "X",
+                "ts": (s.start_time - origin) / 1000,
+                "dur": (s.end_time - s.start_time) / 1000,
+                "pid": 1,
+                "tid": s.thread_id,
+                "args": {**s.attributes, "status": s.status, "span_id": s.span_id},
+            }
+            for s in spans
+        ]
+        trace = {"traceEvents": events, "otherData": {"trace_id": span.trace_id}}
+        path = os.path.join(self.directory, f"{span.trace_id}.json")
+        return [(path, "w", json.dumps(trace, default=str))]
+
+
+EXPORTERS = {"jsonl": JsonlExporter, "chrome": ChromeTraceExporter}
+
+
+class Tracer:
+    """
+    Creates spans and hands finished ones to the configured exporters.
+
+    Files are written by a background thread, so ending a span on the event loop does not wait
+    for the disk.
+    """
+
+    def __init__(self, exporters: str = TRACING_EXPORTER, directory: str = TRACING_PATH):
+        self.directory = directory
+        self.exporters = []
+        for name in filter(None, (name.strip() for name in exporters.split(","))):
+            if name not in EXPORTERS:
+                logging.warning(f"Unknown tracing exporter: {name}")
+                continue
+            self.exporters.append(EXPORTERS[name](directory))
+        self._writes: Optional[queue.SimpleQueue] = None
+        self._writer_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters)
+
+    def export(self, span: Span):
+        writes = []
+        for exporter in self.exporters:
+            writes.extend(exporter.export(span))
+        if writes:
+            self._writer().put(writes)
+
+    def _writer(self) -> queue.SimpleQueue:
+        if self._writes is None:
+            with self._writer_lock:
+                if self._writes is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    writes = queue.SimpleQueue()
+                    threading.Thread(
+                        target=self._write, args=(writes,), name="trace-writer", daemon=True
+                    ).start()
+                    self._writes = writes
+        return self._writes
+
+    def _write(self, writes: queue.SimpleQueue):
+        while True:
+            for path, mode, text in writes.get():
+                try:
+                    with open(path, mode) as f:
+                        f.write(text)
+                except OSError as e:
+                    logging.warning(f"Could not write trace to {path}: {e}")
+
+
+TRACER = Tracer()
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes):
+    """
+    Starts a span under `parent`, or under the current span, or as the root of a new trace.
+    It must be ended with `.end()`.
+    """
+    if not TRACER.enabled:
+        return NOOP_SPAN
+    return Span(name, parent or CURRENT_SPAN.get(), attributes)
+
+
+@contextmanager
+def use_span(span):
+    """
+    Makes a started span the current span for the block, without ending it.
+    """
+    if not span.recording:
+        yield span
+        return
+    token = CURRENT_SPAN.set(span)
+    try:
+        yield span
+    finally:
+        CURRENT_SPAN.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Runs the block in a new child of the current span, recording an exception it raises.
+    """
+    current = start_span(name, **attributes)
+    try:
+        with use_span(current):
+            yield current
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        current.end()
+
+
+async def atrace_iter(current, iterator):
+    """
+    Iterates an async generator with `current` as the current span while each item is produced,
+    e.g. a pipe's response stream that starts spans of its own.
+    """
+    iterator = iterator.__aiter__()
+    while True:
+        with use_span(current):
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+        yield item
+
+
+async def traced_stream(name: str, parent, body, **attributes):
+    """
+    Iterates an async response body in a new child span of `parent`, started when the first item
+    is requested and ended when the body is exhausted or aborted.
+    """
+    current = start_span(name, parent, **attributes)
+    try:
+        async for item in atrace_iter(current, body):
+            yield item
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        current.end()
+
+
+async def end_span_after(current, body):
+    """
+    Passes a response body through and ends `current` once it is fully sent or aborted.
+    """
+    try:
+        async for item in body:
+            yield item
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        current.end()
+
+
+def instrument_sqlalchemy():
+    """
+    Records a span for each statement executed by any SQLAlchemy engine. A no-op when tracing is
+    off; safe to call more than once.
+    """
+    if not TRACER.enabled:
+        return
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    if event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Only statements run for a traced operation, not e.g. the checkpointer's outside requests
+    if CURRENT_SPAN.get() is None:
+        return
+    current = start_span(
+        "db.execute",
+        **{
+            "db.system": conn.dialect.name,
+            "db.statement": statement[:MAX_STATEMENT_LENGTH],
+        },
+    )
+    conn.info.setdefault("trace_spans", []).append(current)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get("trace_spans")
+    if spans:
+        current = spans.pop()
+        if cursor is not None and cursor.rowcount is not None and cursor.rowcount >= 0:
+            current.set_attribute("db.rowcount", cursor.rowcount)
+        current.end()
+
+
+def _handle_error(context):
+    conn = context.connection
+    spans = conn.info.get("trace_spans") if conn is not None else None
+    if spans:
+        current = spans.pop()
+        current.record_exception(context.original_exception)
+        current.end()